@@ -0,0 +1,229 @@
+import argparse
+import codecs
+import multiprocessing
+import os
+import random
+import re
+import resource
+import tempfile
+import time
+
+from os import listdir
+from os.path import isfile, join
+
+from benchmark_parse import make_script, time_call
+from parse_files import read_txt, split_txt
+from clean_files import clean_script, classify_line, prepare_text, read_text, line_labels, get_rule_matchers, \
+    new_rule_stats, get_clean_text, CLEAN_RULES
+
+# LINES MIXED INTO THE SYNTHETIC SCRIPTS, AS FOUND IN UNPROCESSED SOURCES
+NOISE_LINES = ['12.', '(3)', '  45  ', '- 7 -', '12/13', 'A', 'x', '(CONTINUED)', 'CONTINUED:', 'CONTINUED: (2)',
+               '***', '* * *', '--', '\f', '  •  ', '·', 'OMITTED', '  24  INT. HOUSE - NIGHT  24',
+               '25 OMITTED 25', '3 CONTINUED: 3', '7 EXT. ROAD 8', '  • He runs.', '']
+
+# PROCESS ARGUMENTS
+
+
+def read_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the clean_files line classifier against the legacy clean_script')
+    parser.add_argument("-s", "--sizes", nargs='+', type=int, default=[10000, 50000, 200000],
+                        help="Script sizes (number of lines) to benchmark")
+    parser.add_argument("-n", "--noise", type=float, default=0.1,
+                        help="Share of lines replaced by page numbers, continued markers and similar")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random seed for the synthetic scripts")
+    parser.add_argument("-d", "--corpus", default=None,
+                        help="Directory of unprocessed TXT scripts for the parity check and timing")
+    parser.add_argument("-M", "--memory", type=int, nargs='*', default=None,
+                        help="Compare peak RSS of whole-file and memory-mapped reading on synthetic files "
+                             "of these sizes in MB (default 50)")
+    args = parser.parse_args()
+    memory = args.memory
+    if memory is not None and len(memory) == 0:
+        memory = [50]
+    return args.sizes, args.noise, args.seed, args.corpus, memory
+
+
+# LEGACY clean_script (REFERENCE FOR PARITY AND TIMING)
+def clean_script_legacy(text):
+
+    text = text.encode('utf-8', 'ignore').decode('utf-8').strip()
+    text = text.replace("\f", "")
+    text = text.replace("•", "")
+    text = text.replace("·", "")
+
+    whitespace = re.compile(r'^[\s]+')
+    scenenumber = re.compile(r'^\d+\s+.*\s+\d+$')
+    pagenumber = re.compile(
+        r'^[(]?\d{1,3}[)]?[\.]?$|^.[(]?\d{1,3}[)]?[\.]?$|^[(]?\d{1,3}[)]?.?[(]?\d{1,3}[)]?[\.]?$')
+    cont = re.compile(r'^\(continued\)$|^continued:$|^continued: \(\d+\)$')
+    allspecialchars = re.compile(r'^[^\w\s ]*$')
+
+    lines = []
+
+    for line in text.split('\n'):
+        copy = line
+        line = line.lower().strip()
+        # skip lines with one char since they're likely typos
+        if len(line) == 1:
+            if line.lower() != 'a' or line.lower() != 'i':
+                continue
+        # skip lines containing page numbers
+        if pagenumber.match(line):
+            continue
+        # Lines which just say continued
+        if cont.match(line):
+            continue
+        # skip lines containing just special characters
+        if line != '' and allspecialchars.match(line):
+            continue
+        # Filter lines with numbers before and after scene details
+        if scenenumber.match(line):
+            numbers = copy.split()
+            if numbers[0] == numbers[-1]:
+                copy = " ".join(numbers[1:-1]).strip()
+                line = copy.lower().strip()
+        # Lines which just say continued
+        if cont.match(line):
+            continue
+        if line == "omitted":
+            continue
+        lines.append(copy.strip())
+
+    final_data = '\n'.join(lines)
+    final_data = re.sub(r'\n\n+', '\n\n', final_data).strip()
+    return final_data
+
+
+# SYNTHETIC UNPROCESSED SCRIPT: A SYNTHETIC SCREENPLAY WITH A SHARE OF NOISE LINES
+def make_raw_script(num_lines, seed=0, noise=0.1):
+    rng = random.Random(seed)
+    lines = make_script(num_lines, seed).split('\n')
+    return '\n'.join([rng.choice(NOISE_LINES) if rng.random() < noise else x for x in lines])
+
+
+# CHECK THAT clean_script MATCHES THE LEGACY FUNCTION, AND THAT EVERY LINE
+# IS DROPPED OR LEFT BLANK BY THE CLASSIFIER EXACTLY WHEN THE LEGACY FUNCTION DROPS IT
+# RETURNS THE NUMBER OF LINES WITH EACH LABEL
+def check_clean_parity(text, label):
+    if clean_script(text) != clean_script_legacy(text):
+        raise AssertionError("Cleaned text mismatch in %s" % label)
+    counts = dict.fromkeys(line_labels(), 0)
+    for i, line in enumerate(text.split('\n')):
+        line_label, kept = classify_line(prepare_text(line))
+        counts[line_label] += 1
+        if bool(kept) != (clean_script_legacy(line) != ''):
+            raise AssertionError("Line label mismatch in %s at line %d: %s" % (label, i, line_label))
+    return counts
+
+
+# TIME THE LEGACY AND CURRENT clean_script AND THE CLASSIFIER ALONE ON ONE TEXT
+def bench_text(text, label):
+    num_lines = text.count('\n') + 1
+    _, old_time = time_call(clean_script_legacy, text)
+    _, new_time = time_call(clean_script, text)
+    _, stats_time = time_call(clean_script, text, CLEAN_RULES, new_rule_stats())
+    lines = prepare_text(text).split('\n')
+    matchers = get_rule_matchers(CLEAN_RULES)
+    start = time.perf_counter()
+    for line in lines:
+        classify_line(line, matchers)
+    class_time = time.perf_counter() - start
+    print("clean   %-10s %7d lines: legacy %9.0f lines/s  new %9.0f lines/s  with rule stats %9.0f lines/s  "
+          "classify %9.0f lines/s  speedup %5.2fx" %
+          (label, num_lines, num_lines / max(old_time, 1e-9), num_lines / max(new_time, 1e-9),
+           num_lines / max(stats_time, 1e-9), num_lines / max(class_time, 1e-9), old_time / max(new_time, 1e-9)))
+    return num_lines, old_time, new_time
+
+
+# BENCHMARK ON SYNTHETIC SCRIPTS
+def bench_synthetic(sizes, noise, seed):
+    for num_lines in sizes:
+        text = make_raw_script(num_lines, seed, noise)
+        counts = check_clean_parity(text, "synthetic %d" % num_lines)
+        bench_text(text, "synthetic")
+        print("labels  %s" % counts)
+
+
+# PARITY AND TOTAL THROUGHPUT OVER A CORPUS DIRECTORY
+def bench_corpus(corpus_dir):
+    files = sorted([join(corpus_dir, x) for x in listdir(corpus_dir)
+                    if isfile(join(corpus_dir, x)) and x.lower().endswith('.txt')])
+    total_lines = 0
+    total_old = 0.0
+    total_new = 0.0
+    counts = dict.fromkeys(line_labels(), 0)
+    for file in files:
+        text = read_text(file)
+        for line_label, count in check_clean_parity(text, file).items():
+            counts[line_label] += count
+        old_time = time_call(clean_script_legacy, text)[1]
+        new_time = time_call(clean_script, text)[1]
+        total_lines += text.count('\n') + 1
+        total_old += old_time
+        total_new += new_time
+    print("corpus  %d scripts, %d lines match the legacy cleaner: legacy %.0f lines/s  new %.0f lines/s" %
+          (len(files), total_lines, total_lines / max(total_old, 1e-9), total_lines / max(total_new, 1e-9)))
+    print("labels  %s" % counts)
+
+
+# WHOLE-FILE READERS (REFERENCE FOR THE MEMORY BENCHMARK)
+def read_txt_legacy(file_path):
+    fid = codecs.open(file_path, mode='r', encoding='utf-8')
+    txt_file = fid.read()
+    fid.close()
+    return split_txt(txt_file)
+
+
+def get_clean_text_legacy(path):
+    return clean_script(read_text(path)).strip()
+
+
+# READERS COMPARED BY bench_memory
+MEMORY_READERS = {
+    'read_txt legacy': read_txt_legacy,
+    'read_txt mmap': read_txt,
+    'get_clean_text legacy': get_clean_text_legacy,
+    'get_clean_text mmap': get_clean_text
+}
+
+
+# RUN ONE READER IN A FRESH PROCESS, SENDING BACK THE GROWTH OF ITS PEAK RSS IN MB
+def rss_probe(reader_name, file_path, conn):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    MEMORY_READERS[reader_name](file_path)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    conn.send((after - before) / 1024)
+    conn.close()
+
+
+# PEAK RSS GROWTH OF EACH READER ON A SYNTHETIC UNPROCESSED SCRIPT OF EACH SIZE
+def bench_memory(sizes_mb, seed):
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size_mb in sizes_mb:
+            file_path = os.path.join(tmp_dir, 'bench_%d.txt' % size_mb)
+            block = make_raw_script(20000, seed) + '\n'
+            with open(file_path, 'w', encoding='utf-8') as outfile:
+                for _ in range(max(1, int(size_mb * 1e6 / len(block.encode('utf-8'))))):
+                    outfile.write(block)
+            file_mb = os.path.getsize(file_path) / 1e6
+            for reader_name in MEMORY_READERS:
+                parent_conn, child_conn = context.Pipe()
+                proc = context.Process(target=rss_probe, args=(reader_name, file_path, child_conn))
+                proc.start()
+                peak_mb = parent_conn.recv()
+                proc.join()
+                print("memory  %7.1f MB file  %-22s peak RSS +%8.1f MB (%4.1fx the file)" %
+                      (file_mb, reader_name, peak_mb, peak_mb / file_mb))
+
+
+# MAIN FUNCTION
+if __name__ == "__main__":
+    sizes, noise, seed, corpus_dir, memory_sizes = read_args()
+    bench_synthetic(sizes, noise, seed)
+    if corpus_dir is not None:
+        bench_corpus(corpus_dir)
+    if memory_sizes is not None:
+        bench_memory(memory_sizes, seed)
@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+import zlib
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import get_metadata
+from get_metadata import lookup_tmdb, get_tmdb_from_id, plan_tmdb, plan_tmdb_ids, attempt, PLAN_RESPONSES, \
+    PLAN_STATS
+from http_pool import HttpPool
+from metadata_cache import ResponseCache
+
+# CERTIFICATIONS HANDED OUT BY THE STUB SERVER
+STUB_RATINGS = ['G', 'PG', 'PG-13', 'R', 'NC-17']
+
+# PROCESS ARGUMENTS
+
+
+def read_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the pooled metadata fetcher against per-call urlopen on a local TMDb stub server')
+    parser.add_argument("-n", "--titles", type=int, default=200,
+                        help="Number of synthetic titles to look up")
+    parser.add_argument("-w", "--workers", type=int, default=8,
+                        help="Number of titles looked up at a time by the pooled fetcher")
+    parser.add_argument("-r", "--rate", type=float, default=1000,
+                        help="Most requests started per second by the pooled fetcher")
+    parser.add_argument("-l", "--latency", type=float, default=0.02,
+                        help="Seconds the stub server waits before each response")
+    parser.add_argument("-e", "--throttle-every", type=int, default=0,
+                        help="Answer every nth request with 429 Too Many Requests (0: never)")
+    args = parser.parse_args()
+    if args.titles < 1 or args.workers < 1 or args.rate <= 0 or args.latency < 0 or args.throttle_every < 0:
+        raise AssertionError(
+            "Invalid value. Titles, workers and rate must be positive")
+    return args.titles, args.workers, args.rate, args.latency, args.throttle_every
+
+
+# STUB TMDb ENDPOINTS: EVERY QUERY MATCHES ONE TITLE UNLESS IT CONTAINS "missing" (MOVIE SEARCH ONLY) OR
+# "nowhere" (ALL SEARCHES), AND QUERIES CONTAINING "broken" FAIL WITH 404; IDS AND RATINGS ARE DERIVED FROM
+# THE QUERY (IGNORING CASE, AS TMDb SEARCH DOES) SO EVERY RUN GIVES THE SAME ANSWERS
+def stub_response(path, query):
+    if path == '/search/movie' or path == '/search/tv':
+        name = query.get('query', [''])[0]
+        if 'broken' in name.lower():
+            return None
+        if 'nowhere' in name.lower() or (path == '/search/movie' and 'missing' in name.lower()):
+            return {'page': 1, 'results': [], 'total_results': 0}
+        title = 'title' if path == '/search/movie' else 'name'
+        date = 'release_date' if path == '/search/movie' else 'first_air_date'
+        movie = {title: name.title(), date: '2000-01-01', 'id': zlib.crc32(name.lower().encode('utf-8')) % 1000000,
+                 'overview': ''}
+        return {'page': 1, 'results': [movie], 'total_results': 1}
+    if path.startswith('/find/'):
+        imdb_id = path.split('/')[2]
+        movie = {'title': 'Film ' + imdb_id, 'release_date': '2000-01-01', 'id': int(imdb_id[2:]), 'overview': ''}
+        return {'movie_results': [movie], 'tv_results': []}
+    if path.startswith('/movie/') and path.endswith('/release_dates'):
+        movie_id = int(path.split('/')[2])
+        return {'id': movie_id, 'results': [
+            {'iso_3166_1': 'US', 'release_dates': [{'certification': STUB_RATINGS[movie_id % len(STUB_RATINGS)]}]}]}
+    return None
+
+
+# LOCAL HTTP/1.1 STUB OF THE TMDb API, COUNTING REQUESTS AND CONNECTIONS
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.count("connections")
+
+    def do_GET(self):
+        self.server.count("requests")
+        time.sleep(self.server.latency)
+        parts = urllib.parse.urlsplit(self.path)
+        if self.server.throttle_every and self.server.stats["requests"] % self.server.throttle_every == 0:
+            self.send_json(429, {'status_message': 'Too many requests'}, {'Retry-After': '0'})
+            return
+        response = stub_response(parts.path, urllib.parse.parse_qs(parts.query))
+        if response is None:
+            self.send_json(404, {'status_message': 'Not found'})
+        else:
+            self.send_json(200, response)
+
+    def send_json(self, status, response, headers={}):
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, throttle_every=0):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "connections": 0}
+
+    def count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def reset(self):
+        self.stats = {"requests": 0, "connections": 0}
+
+
+# LEGACY FETCHER (REFERENCE FOR PARITY AND TIMING): A NEW CONNECTION PER REQUEST, ONE TITLE AT A TIME
+class UrlopenFetcher:
+    def get_json(self, url):
+        response = urllib.request.urlopen(url)
+        return json.loads(response.read())
+
+    def map(self, func, items):
+        return map(func, items)
+
+
+# SYNTHETIC TITLES: MOST MATCH A MOVIE, SOME ONLY AFTER extra_clean, SOME ONLY AS TV AND SOME NOT AT ALL,
+# AND EVERY 7TH REPEATS AN EARLIER TITLE IN CAPITALS (AS SOURCES LISTING THE SAME FILM DO)
+def make_titles(num_titles):
+    kinds = ['%d Movie Title', 'The Movie Title %d, Part II', '%d Missing Series', 'Nowhere Title %d']
+    titles = []
+    for i in range(num_titles):
+        if i % 7 == 6:
+            titles.append(titles[i // 2].upper())
+        else:
+            titles.append(kinds[i % len(kinds)] % i if i % 5 else 'Movie Title %d' % i)
+    return titles
+
+
+# LOOK UP EVERY TITLE AND IMDb ID WITH ONE FETCHER, RETURNING THE RESULTS, SECONDS TAKEN AND SERVER STATS
+def run_lookups(server, fetcher, titles, imdb_ids):
+    server.reset()
+    get_metadata.HTTP_POOL = fetcher
+    start = time.perf_counter()
+    results = list(fetcher.map(lookup_tmdb, titles)) + list(fetcher.map(get_tmdb_from_id, imdb_ids))
+    return results, time.perf_counter() - start, dict(server.stats)
+
+
+# RUN THE LOOKUPS THROUGH A NEW RESPONSE CACHE TWICE, THEN OFFLINE: THE WARM AND OFFLINE RUNS MUST GIVE THE
+# SAME RESULTS AS THE COLD ONE WITHOUT A SINGLE REQUEST REACHING THE SERVER
+def check_cache(server, titles, imdb_ids, num_workers, rate):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_file = os.path.join(tmp_dir, 'metadata_cache.sqlite')
+        runs = []
+        for label, offline in [('cold', False), ('warm', False), ('offline', True)]:
+            get_metadata.METADATA_CACHE = ResponseCache(cache_file, offline=offline)
+            pool = HttpPool(num_workers, rate)
+            results, seconds, stats = run_lookups(server, pool, titles, imdb_ids)
+            pool.close()
+            runs.append((label, results, seconds, stats["requests"], get_metadata.METADATA_CACHE.stats))
+            get_metadata.METADATA_CACHE.close()
+        get_metadata.METADATA_CACHE = None
+    for label, results, seconds, requests, stats in runs:
+        if results != runs[0][1]:
+            raise AssertionError("Cached lookups differ from uncached lookups in the %s run" % label)
+        if label != 'cold' and requests > 0:
+            raise AssertionError("The %s run sent %d requests to the server" % (label, requests))
+        print("cache    %-7s %6.2fs  %4d requests  %4d hits  %4d fetched" %
+              (label, seconds, requests, stats["hits"], stats["fetched"]))
+    return runs
+
+
+# BATCHED, DEDUPLICATED LOOKUPS MUST GIVE EVERY TITLE THE SAME RESULT AS LOOKING IT UP ON ITS OWN
+def check_planner(server, titles, imdb_ids, num_workers, rate):
+    pool = HttpPool(num_workers, rate)
+    get_metadata.HTTP_POOL = pool
+    server.reset()
+    start = time.perf_counter()
+    old_results = list(pool.map(lambda x: attempt(lookup_tmdb, x), titles)) + \
+        list(pool.map(lambda x: attempt(get_tmdb_from_id, x), imdb_ids))
+    old_time, old_requests = time.perf_counter() - start, server.stats["requests"]
+
+    PLAN_RESPONSES.clear()
+    PLAN_STATS.update(naive=0, sent=0)
+    server.reset()
+    start = time.perf_counter()
+    new_results = plan_tmdb(titles) + plan_tmdb_ids(imdb_ids)
+    new_time, new_requests = time.perf_counter() - start, server.stats["requests"]
+    pool.close()
+
+    if new_results != old_results:
+        raise AssertionError("Batched lookups differ from per-title lookups")
+    if PLAN_STATS["naive"] != old_requests or PLAN_STATS["sent"] != new_requests:
+        raise AssertionError("Planner request counts do not match the requests the server saw")
+    print("planner  %d titles, %d IMDb ids match: per title %6.2fs (%d requests)  batched %6.2fs (%d requests, "
+          "%d saved)" % (len(titles), len(imdb_ids), old_time, old_requests, new_time, new_requests,
+                         old_requests - new_requests))
+
+
+# MAIN FUNCTION
+if __name__ == "__main__":
+    num_titles, num_workers, rate, latency, throttle_every = read_args()
+    titles = make_titles(num_titles)
+    imdb_ids = ['tt%07d' % i for i in range(0, num_titles, 4)]
+
+    server = StubServer(latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    get_metadata.TMDB_API = 'http://127.0.0.1:%d' % server.server_address[1]
+    get_metadata.tmdb_api_key = 'stub'
+
+    old_results, old_time, old_stats = run_lookups(server, UrlopenFetcher(), titles, imdb_ids)
+    server.throttle_every = throttle_every
+    pool = HttpPool(num_workers, rate)
+    new_results, new_time, new_stats = run_lookups(server, pool, titles, imdb_ids)
+    pool.close()
+
+    if new_results != old_results:
+        raise AssertionError("Pooled fetcher results differ from urlopen results")
+    print("metadata %d titles, %d IMDb ids match: urlopen %6.2fs (%d requests, %d connections)  "
+          "pooled %6.2fs (%d requests, %d connections, %d retried)  speedup %5.2fx" %
+          (num_titles, len(imdb_ids), old_time, old_stats["requests"], old_stats["connections"],
+           new_time, new_stats["requests"], new_stats["connections"], pool.stats["retries"],
+           old_time / max(new_time, 1e-9)))
+
+    server.throttle_every = 0
+    check_cache(server, titles, imdb_ids, num_workers, rate)
+    check_planner(server, titles, imdb_ids + imdb_ids[::3], num_workers, rate)
+    server.shutdown()
@@ -0,0 +1,418 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from os import listdir
+from os.path import isfile, join
+
+import parse_files
+from parse_files import get_offset, read_file, read_pdf, remove_indents, tag_script, combine_tag_lines, \
+    format_tag_lines_legacy, normalize_tag_lines, get_matchers, get_scene_bound, get_trans, get_meta, \
+    get_char_dial, get_scene_desc, get_tags_fast, combine_tags, build_records, write_parsed, write_abridged, \
+    get_char_info, write_char_info, PARSE_CONFIG
+
+# DEFAULT SYNTHETIC SCREENPLAY STRUCTURE
+# BLOCK WEIGHTS: page NUMBER, scene HEADING, trans(ITION), dialogue BLOCK, action (NARRATION) BLOCK
+# paren: CHANCE OF A PARENTHETICAL IN A DIALOGUE BLOCK; extension: CHANCE OF (V.O.)/(CONT'D) ON A CUE
+SCRIPT_STRUCTURE = {
+    'page': 0.03,
+    'scene': 0.12,
+    'trans': 0.05,
+    'dialogue': 0.4,
+    'action': 0.4,
+    'paren': 0.2,
+    'extension': 0.5
+}
+# PHASES OF parse() TIMED BY profile_parse
+PHASES = ['read', 'deindent', 'scene_bound', 'trans', 'meta', 'char_dial', 'scene_desc', 'tag_fast',
+          'combine', 'normalize', 'write']
+
+# PROCESS ARGUMENTS
+
+
+def read_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark parse_files components on synthetic screenplays')
+    parser.add_argument("-s", "--sizes", nargs='+', type=int, default=[10000, 50000, 100000, 200000],
+                        help="Script sizes (number of lines) to benchmark")
+    parser.add_argument("-l", "--legacy-limit", type=int, default=50000,
+                        help="Largest script size on which the legacy implementation is timed")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random seed for the synthetic screenplays")
+    parser.add_argument("-d", "--corpus", default=None,
+                        help="Directory of TXT/PDF scripts for the tagger parity check")
+    parser.add_argument("-P", "--pdfs", default=None,
+                        help="Directory of PDF scripts for the PDF backend throughput benchmark")
+    parser.add_argument("-m", "--mode", choices=['components', 'phases', 'all'], default='all',
+                        help="Benchmark old vs new components, time the phases of parse(), or both")
+    parser.add_argument("-g", "--fast", choices=['on', 'off'], default='off',
+                        help="Time the fast tagger instead of the detector chain in the phase profile")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Phase profile runs per size; the fastest is kept")
+    parser.add_argument("-t", "--structure", default=None,
+                        help="JSON object overriding SCRIPT_STRUCTURE, e.g. '{\"paren\": 0.5}'")
+    parser.add_argument("-o", "--output", default=None,
+                        help="Save phase profile results to this JSON file")
+    parser.add_argument("-c", "--compare", default=None,
+                        help="Phase profile JSON file from an earlier run to compare against")
+    args = parser.parse_args()
+    structure = dict(SCRIPT_STRUCTURE)
+    if args.structure is not None:
+        structure.update(json.loads(args.structure))
+    return args.sizes, args.legacy_limit, args.seed, args.corpus, args.pdfs, args.mode, args.fast, \
+        args.repeat, structure, args.output, args.compare
+
+
+# LEGACY OFFSET COMPUTATION (REFERENCE FOR PARITY AND TIMING)
+def get_offset_legacy(script_lines, script_str):
+    offset_mat = np.empty((0, 2), dtype=int)
+    pos_init = 0
+    for line_val in script_lines:
+        if line_val != '':
+            line_start = script_str.find(line_val, pos_init)
+            sub_script = script_str[line_start: (line_start + len(line_val))]
+            valid_indices = [(line_start + i)
+                             for i, x in enumerate(sub_script) if x != ' ']
+            offset_mat = np.append(offset_mat, np.array(
+                [[min(valid_indices), (max(valid_indices) + 1)]]), axis=0)
+            pos_init = line_start + len(line_val) + 1
+        else:
+            offset_mat = np.append(offset_mat, np.array(
+                [[pos_init, (pos_init + 1)]]), axis=0)
+            pos_init += 1
+
+    return offset_mat + 1
+
+
+# GENERATE SYNTHETIC SCREENPLAY TEXT WITH THE GIVEN NUMBER OF LINES AND STRUCTURE (SEE SCRIPT_STRUCTURE)
+def make_script(num_lines, seed=0, structure=SCRIPT_STRUCTURE):
+    rng = random.Random(seed)
+    words = ['door', 'night', 'gun', 'looks', 'runs', 'window', 'car', 'slowly',
+             'the', 'a', 'she', 'he', 'smiles', 'rain', 'street', 'phone']
+    names = ['JOHN', 'MARY', 'DETECTIVE COLE', 'SARAH', 'OLD MAN']
+    block_names = ['page', 'scene', 'trans', 'dialogue', 'action']
+    block_total = sum([structure[x] for x in block_names])
+    block_bounds = np.cumsum([structure[x] / block_total for x in block_names])
+    lines = ['PG-13', '', ' ' * 25 + 'A SYNTHETIC STORY', '', ' ' * 30 + 'by', ' ' * 27 + 'Nobody',
+             '', 'FADE IN:', '', 'BLACK', '']
+    while len(lines) < num_lines:
+        block = rng.random()
+        if block < block_bounds[0]:
+            lines += [' ' * 70 + str(rng.randint(1, 150)) + '.', '']
+        elif block < block_bounds[1]:
+            lines += [' ' * 15 + 'INT. ' + rng.choice(['HOUSE', 'OFFICE', 'BAR']) + ' - NIGHT', '']
+        elif block < block_bounds[2]:
+            lines += [' ' * 55 + rng.choice(['CUT TO:', 'FADE OUT.', 'DISSOLVE TO:']), '']
+        elif block < block_bounds[3]:
+            extension = ''
+            if rng.random() < structure['extension']:
+                extension = rng.choice([' (V.O.)', " (CONT'D)"])
+            lines += [' ' * 30 + rng.choice(names) + extension]
+            if rng.random() < structure['paren']:
+                lines += [' ' * 25 + '(beat)']
+            lines += [' ' * 20 + ' '.join(rng.choice(words) for _ in range(rng.randint(3, 9)))
+                      for _ in range(rng.randint(1, 3))]
+            if rng.random() < structure['paren'] / 2:
+                lines += [' ' * 25 + '(' + rng.choice(words) + ')',
+                          ' ' * 20 + rng.choice(words).upper() + ' INT. NOW']
+            lines += ['']
+        else:
+            lines += [' ' * 10 + ' '.join(rng.choice(words) for _ in range(rng.randint(5, 12)))
+                      for _ in range(rng.randint(1, 4))]
+            lines += ['']
+    return '\n'.join(lines[:num_lines]) + '\n'
+
+
+# TIME A FUNCTION CALL
+def time_call(func, *args):
+    start = time.perf_counter()
+    out = func(*args)
+    return out, time.perf_counter() - start
+
+
+# BENCHMARK OFFSET COMPUTATION
+def bench_offsets(sizes, legacy_limit, seed):
+    for num_lines in sizes:
+        script_str = make_script(num_lines, seed)
+        script_lines = script_str.splitlines()
+        new_mat, new_time = time_call(get_offset, script_lines, script_str)
+        if num_lines <= legacy_limit:
+            old_mat, old_time = time_call(
+                get_offset_legacy, script_lines, script_str)
+            if not np.array_equal(old_mat, new_mat):
+                raise AssertionError(
+                    "Offset mismatch on %d line script" % num_lines)
+            print("offsets %7d lines: legacy %8.3fs  new %8.3fs  speedup %6.1fx" %
+                  (num_lines, old_time, new_time, old_time / max(new_time, 1e-9)))
+        else:
+            print("offsets %7d lines: legacy  skipped  new %8.3fs" %
+                  (num_lines, new_time))
+
+
+# CHECK THAT THE FAST TAGGER MATCHES THE DETECTOR CHAIN
+def check_tag_parity(script_noind, label):
+    old_tags = tag_script(script_noind, 'off')
+    new_tags = tag_script(script_noind, 'on')
+    if not np.array_equal(old_tags, new_tags):
+        diff_ind = np.where(old_tags != new_tags)[0]
+        raise AssertionError("Tag mismatch in %s at lines %s" %
+                             (label, diff_ind[:10].tolist()))
+
+
+# BENCHMARK TAGGING
+def bench_tags(sizes, seed):
+    for num_lines in sizes:
+        script_noind = remove_indents(make_script(num_lines, seed).splitlines())
+        check_tag_parity(script_noind, "synthetic %d" % num_lines)
+        _, old_time = time_call(tag_script, script_noind, 'off')
+        _, new_time = time_call(tag_script, script_noind, 'on')
+        print("tags    %7d lines: chain  %8.3fs  fast %8.3fs  speedup %6.1fx" %
+              (num_lines, old_time, new_time, old_time / max(new_time, 1e-9)))
+
+
+# TAGGED, COMBINED LINES AS FED TO THE MERGE/REARRANGE STEP OF parse()
+def get_combined(script_noind):
+    tag_vec = tag_script(script_noind, 'on')
+    tag_valid = [x for x in tag_vec if x != '0']
+    script_valid = [script_noind[i]
+                    for i, x in enumerate(tag_vec) if x != '0']
+    tag_valid, script_valid, _, _ = combine_tag_lines(tag_valid, script_valid)
+    return tag_valid, script_valid
+
+
+# CHECK THAT THE ONE-PASS NORMALIZER MATCHES THE MERGE/REARRANGE LOOP
+# RETURNS THE NUMBER OF LOOP ITERATIONS AND WHETHER THE LOOP EMPTIED THE SCRIPT
+def check_norm_parity(tag_valid, script_valid, label):
+    old_tag, old_script, old_rev = format_tag_lines_legacy(
+        tag_valid, script_valid)
+    new_tag, new_script, _, num_rev, legacy_drop = normalize_tag_lines(
+        tag_valid, script_valid)
+    if num_rev != old_rev or (legacy_drop and old_tag != []) or \
+            (not legacy_drop and (old_tag, old_script) != (new_tag, new_script)):
+        raise AssertionError("Normalizer mismatch in %s" % label)
+
+    return old_rev, legacy_drop
+
+
+# BENCHMARK MERGE/REARRANGE
+def bench_norm(sizes, seed):
+    for num_lines in sizes:
+        tag_valid, script_valid = get_combined(
+            remove_indents(make_script(num_lines, seed).splitlines()))
+        check_norm_parity(tag_valid, script_valid, "synthetic %d" % num_lines)
+        _, old_time = time_call(format_tag_lines_legacy,
+                                tag_valid, script_valid)
+        _, new_time = time_call(normalize_tag_lines, tag_valid, script_valid)
+        print("format  %7d lines: loop   %8.3fs  norm %8.3fs  speedup %6.1fx" %
+              (num_lines, old_time, new_time, old_time / max(new_time, 1e-9)))
+
+
+# TAGGER AND NORMALIZER PARITY OVER A CORPUS DIRECTORY
+# LISTS THE SCRIPTS THAT NEEDED MORE THAN ONE MERGE/REARRANGE ITERATION OR WERE EMPTIED BY IT
+def corpus_parity(corpus_dir):
+    files = sorted([join(corpus_dir, f) for f in listdir(corpus_dir)
+                    if isfile(join(corpus_dir, f)) and f.endswith(('.txt', '.pdf'))])
+    rev_count = {}
+    for file_orig in files:
+        script_orig, _ = read_file(os.path.abspath(file_orig))
+        script_noind = remove_indents(script_orig)
+        check_tag_parity(script_noind, file_orig)
+        tag_valid, script_valid = get_combined(script_noind)
+        num_rev, legacy_drop = check_norm_parity(
+            tag_valid, script_valid, file_orig)
+        rev_count[num_rev] = rev_count.get(num_rev, 0) + 1
+        if num_rev > 1 or legacy_drop:
+            print("format  %s: %d iterations%s" %
+                  (file_orig, num_rev, ", emptied by old loop" if legacy_drop else ""))
+
+    print("tags    parity ok on %d corpus scripts" % len(files))
+    print("format  parity ok on %d corpus scripts, iterations: %s" %
+          (len(files), dict(sorted(rev_count.items()))))
+
+
+# PDF BACKEND THROUGHPUT OVER A FOLDER OF PDFS
+def bench_pdf(pdf_dir):
+    files = sorted([join(pdf_dir, f) for f in listdir(pdf_dir)
+                    if isfile(join(pdf_dir, f)) and f.endswith('.pdf')])
+    total_mb = sum([os.path.getsize(f) for f in files]) / 1e6
+    backends = []
+    if parse_files.pdftotext is not None:
+        backends.append('poppler')
+    if shutil.which('pdftotext') is not None:
+        backends.append('cli')
+    line_count = {}
+    for backend in backends:
+        start = time.perf_counter()
+        num_lines = 0
+        for file_orig in files:
+            script_lines, _ = read_pdf(file_orig, backend)
+            line_count[(backend, file_orig)] = len(script_lines)
+            num_lines += len(script_lines)
+        run_time = time.perf_counter() - start
+        print("pdf     %-7s %4d files %8.1f MB: %8.3fs  %7.1f files/s  %9.0f lines/s" %
+              (backend, len(files), total_mb, run_time, len(files) / max(run_time, 1e-9),
+               num_lines / max(run_time, 1e-9)))
+
+    if len(backends) == 2:
+        diff_files = [f for f in files if line_count[('poppler', f)] != line_count[('cli', f)]]
+        print("pdf     line counts differ between backends on %d of %d files" %
+              (len(diff_files), len(files)))
+
+
+# TIME EACH PHASE OF parse() ON ONE FILE, WRITING OUTPUTS TO out_dir
+# WITH trace_mem, ALSO RECORD THE PEAK TRACED MEMORY OF EACH PHASE (SLOWER; KEEP OUT OF TIMING RUNS)
+def profile_parse(file_orig, out_dir, fast_flag='off', trace_mem=False, config=PARSE_CONFIG):
+    stats = {}
+
+    def run_phase(name, func, *args):
+        if trace_mem:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        out = func(*args)
+        stats[name] = {'time': time.perf_counter() - start}
+        if trace_mem:
+            stats[name]['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+        return out
+
+    def write_phase(records):
+        write_parsed(records, join(out_dir, 'bench_parsed.txt'))
+        write_abridged(records, join(out_dir, 'bench_abridged.txt'))
+        write_char_info(get_char_info(records), join(out_dir, 'bench_charinfo.txt'))
+
+    matchers = get_matchers(config)
+    tag_set = set(config['tag_set'])
+    script_orig, script_offsets = run_phase('read', read_file, file_orig)
+    script_noind = run_phase('deindent', remove_indents, script_orig)
+    if fast_flag == 'on':
+        tag_vec = run_phase('tag_fast', get_tags_fast, script_noind, matchers, config['char_max_words'],
+                            config['meta_thresh'], config['sent_thresh'], config['trans_thresh'])
+    else:
+        tag_vec = np.array(['0' for x in range(len(script_noind))])
+        tag_vec, bound_ind = run_phase('scene_bound', get_scene_bound, script_noind, tag_vec, tag_set,
+                                       matchers['bound'])
+        tag_vec, trans_ind = run_phase('trans', get_trans, script_noind, tag_vec, tag_set, config['trans_thresh'],
+                                       matchers['trans'], matchers['word_filter'])
+        tag_vec = run_phase('meta', get_meta, script_noind, tag_vec, tag_set, config['meta_thresh'],
+                            matchers['meta'], matchers['word_filter'], config['sent_thresh'], bound_ind, trans_ind)
+        tag_vec = run_phase('char_dial', get_char_dial, script_noind, tag_vec, tag_set, config['char_max_words'])
+        tag_vec = run_phase('scene_desc', get_scene_desc, script_noind, tag_vec, tag_set)
+    combined = run_phase('combine', combine_tags, tag_vec, script_noind)
+    records, _, _ = run_phase('normalize', build_records, *combined, script_offsets)
+    run_phase('write', write_phase, records)
+
+    return stats, len(script_orig)
+
+
+# PHASE PROFILE OF parse() ON SYNTHETIC SCRIPTS: FASTEST OF repeat TIMING RUNS, THEN ONE MEMORY RUN
+def bench_phases(sizes, seed, fast_flag, repeat, structure):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_lines in sizes:
+            file_orig = join(tmp_dir, 'bench_%d.txt' % num_lines)
+            with open(file_orig, 'w', encoding='utf-8') as outfile:
+                outfile.write(make_script(num_lines, seed, structure))
+
+            best_stats = None
+            for _ in range(max(repeat, 1)):
+                stats, line_count = profile_parse(file_orig, tmp_dir, fast_flag)
+                if best_stats is None or sum([x['time'] for x in stats.values()]) < \
+                        sum([x['time'] for x in best_stats.values()]):
+                    best_stats = stats
+
+            tracemalloc.start()
+            mem_stats, _ = profile_parse(file_orig, tmp_dir, fast_flag, trace_mem=True)
+            total_peak = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+
+            phases = {}
+            for name in [x for x in PHASES if x in best_stats]:
+                phases[name] = {
+                    'time': best_stats[name]['time'],
+                    'lines_per_sec': line_count / max(best_stats[name]['time'], 1e-9),
+                    'peak_mb': mem_stats[name]['peak_mb']
+                }
+                print("phase   %7d lines %-11s %8.4fs %12.0f lines/s %9.1f MB" %
+                      (num_lines, name, phases[name]['time'], phases[name]['lines_per_sec'],
+                       phases[name]['peak_mb']))
+            total_time = sum([x['time'] for x in phases.values()])
+            results[str(num_lines)] = {
+                'phases': phases,
+                'total': {'time': total_time, 'lines_per_sec': line_count / max(total_time, 1e-9),
+                          'peak_mb': total_peak}
+            }
+            print("phase   %7d lines %-11s %8.4fs %12.0f lines/s %9.1f MB" %
+                  (num_lines, 'total', total_time, results[str(num_lines)]['total']['lines_per_sec'],
+                   total_peak))
+
+    return results
+
+
+# CURRENT GIT COMMIT, IF ANY
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# SAVE PHASE PROFILE RESULTS WITH THE SETTINGS THAT PRODUCED THEM
+def save_results(results, output_path, seed, fast_flag, repeat, structure):
+    with open(output_path, 'w') as outfile:
+        json.dump({
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'seed': seed,
+            'fast': fast_flag,
+            'repeat': repeat,
+            'structure': structure,
+            'results': results
+        }, outfile, indent=4)
+
+
+# COMPARE PHASE TIMES AGAINST AN EARLIER RESULTS FILE; RATIOS ABOVE 1 ARE SLOWER NOW
+def compare_results(results, compare_path, threshold=1.1):
+    with open(compare_path, 'r') as infile:
+        old_run = json.load(infile)
+
+    print("compare against commit %s (%s)" % (old_run.get('commit'), old_run.get('timestamp')))
+    for size in results:
+        if size not in old_run['results']:
+            continue
+        old_phases = dict(old_run['results'][size]['phases'])
+        old_phases['total'] = old_run['results'][size]['total']
+        new_phases = dict(results[size]['phases'])
+        new_phases['total'] = results[size]['total']
+        for name in [x for x in new_phases if x in old_phases]:
+            ratio = new_phases[name]['time'] / max(old_phases[name]['time'], 1e-9)
+            print("compare %7s lines %-11s %8.4fs -> %8.4fs  x%5.2f%s" %
+                  (size, name, old_phases[name]['time'], new_phases[name]['time'], ratio,
+                   "  REGRESSION" if ratio > threshold else ""))
+
+
+# MAIN FUNCTION
+if __name__ == "__main__":
+    sizes, legacy_limit, seed, corpus_dir, pdf_dir, mode, fast_flag, repeat, structure, output_path, \
+        compare_path = read_args()
+    if mode in ['components', 'all']:
+        bench_offsets(sizes, legacy_limit, seed)
+        bench_tags(sizes, seed)
+        bench_norm(sizes, seed)
+    if mode in ['phases', 'all']:
+        results = bench_phases(sizes, seed, fast_flag, repeat, structure)
+        if output_path is not None:
+            save_results(results, output_path, seed, fast_flag, repeat, structure)
+        if compare_path is not None:
+            compare_results(results, compare_path)
+    if corpus_dir is not None:
+        corpus_parity(corpus_dir)
+    if pdf_dir is not None:
+        bench_pdf(pdf_dir)
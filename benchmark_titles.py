@@ -0,0 +1,361 @@
+import argparse
+import os
+import random
+import re
+import string
+import tempfile
+import time
+
+from fuzzywuzzy import fuzz # type: ignore
+from unidecode import unidecode # type: ignore
+
+from benchmark_parse import time_call
+from title_match import extra_clean, average_ratio, origin_keys, use_rapidfuzz, TitleIndex, NORMAL_CACHE, rapid_fuzz
+from title_index import import_title_basics, LocalTitleIndex
+
+# WORDS AND DECORATIONS OF THE SYNTHETIC TITLES, AS FOUND IN SOURCE LISTINGS
+TITLE_WORDS = ['dark', 'night', 'return', 'star', 'king', 'love', 'city', 'blood', 'last', 'war', 'house', 'road',
+               'man', 'woman', 'ghost', 'river', 'summer', 'lost', 'dead', 'secret', 'space', 'heart', 'game', 'fire']
+TITLE_SUFFIXES = ['', '', '', ' II', ' III', ' Part IV', ' (2001)', ' - Episode V', ': The Beginning',
+                  ' (Filmed as "Night Road")', ' Transcript', ' First Draft', ' Pilot', ', The', ' Vol. 2']
+# ACCENTED SPELLINGS SWAPPED INTO SOME SYNTHETIC SOURCE NAMES AND TOP-K TITLES, AND NAMES AT THE EDGES OF THE
+# ORIGIN KEY RULES
+ACCENTED = {'a': '\u00e0', 'e': '\u00e9', 'o': '\u00f6', 'n': '\u00f1', 'u': '\u00fc'}
+# NON-ASCII TITLES AND QUERIES ADDED TO THE TOP-K SET: token_sort_ratio DROPS THEIR NON-ASCII LETTERS
+TOP_K_EDGE_NAMES = ['\u00e9a\u00f1a\u00f1', '\u00e8\u00f6\u00e8a', 'ada', '\u00e0d\u00e0', 'Am\u00e9lie', 'Amelie',
+                    '\u0421\u0442\u0430\u043b\u043a\u0435\u0440', '\u03a9mega Man', 'Omega Man',
+                    '\u6771\u4eac\u7269\u8a9e', 'Tokyo Story \u6771\u4eac', 'C\u00f4te d\'Azur', 'Cote d Azur']
+ORIGIN_EDGE_NAMES = ['', '   ', '(1999)', 'II', 'Part II', 'The Movie', 'Vol. 3', 'Spider-Man: No Way Home',
+                     "Ocean's Eleven (2001) [Draft]", 'Am\u00e9lie', '\u00c6on Flux', 'A.I.', 'Se7en',
+                     'Mission: Impossible \u2013 Fallout', 'Tab\tSeparated  Title', 'C\u00f4te d\'Azur (Transcript)',
+                     '\u0421\u0442\u0430\u043b\u043a\u0435\u0440', 'V', 'The End (Part 1) - Chapter 2',
+                     'AC\\DC Live', 'Back\\Slash\\Part II', '\\', 'C:\\Movies\\The Matrix (1999)']
+LEGACY_FORBIDDEN = ["the", "a", "an", "and", "or", "part",
+                    "vol", "chapter", "movie", "transcript"]
+# STAND-IN IMDb DATASET FILES, AND THE IDS SOURCE-STYLE AND MISSPELT NAMES MUST RESOLVE TO IN THEM
+FIXTURE_BASICS = os.path.join('fixtures', 'title.basics.sample.tsv')
+FIXTURE_RATINGS = os.path.join('fixtures', 'title.ratings.sample.tsv')
+FIXTURE_EXPECTED = {
+    'Matrix, The': '0133093',
+    'The Matrix Reloaded': '0234215',
+    'Godfather Part II, The': '0071562',
+    'The Godfather: Part III': '0099674',
+    'Spider Man': '0145487',
+    'Spider-Man 2 (Filmed as "Spider-Man 2")': '0316654',
+    'Star Wars': '0076759',
+    'Titanic': '0120338',
+    'Titanic (1953)': '0046435',
+    'Amelie': '0211915',
+    'Breaking Bad (Pilot)': '0903747',
+    'Back to the Future Part II': '0096874',
+    'Toy Story 3 Transcript': '0435761',
+    'Alien': '0078748',
+    'Unknown Film': None,
+    'Titanc': '0120338',
+    'Godfathr Part II, The': '0071562',
+    'Pulp Fictoin': '0110912',
+    'Aliens 3': None
+}
+
+# PROCESS ARGUMENTS
+
+
+def read_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark title normalisation and fuzzy matching against the legacy get_metadata functions')
+    parser.add_argument("-n", "--titles", type=int, default=5000,
+                        help="Number of synthetic catalogue titles in the index")
+    parser.add_argument("-q", "--queries", type=int, default=300,
+                        help="Number of misspelt titles looked up in the index")
+    parser.add_argument("-k", "--top-k", type=int, default=5,
+                        help="Number of candidates returned per query")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random seed for the synthetic titles")
+    parser.add_argument("-I", "--index-titles", type=int, default=200000,
+                        help="Number of synthetic rows in the title.basics file imported for the local index timing")
+    parser.add_argument("-O", "--origin-titles", type=int, default=50000,
+                        help="Number of synthetic source scripts grouped into origin keys")
+    parser.add_argument("-S", "--sources", type=int, default=10,
+                        help="Number of sources the origin scripts are spread over")
+    args = parser.parse_args()
+    if args.titles < 1 or args.queries < 1 or args.top_k < 1 or args.index_titles < 1 or \
+            args.origin_titles < 1 or args.sources < 1:
+        raise AssertionError(
+            "Invalid value. Titles, queries, k, index titles, origin titles and sources must be at least 1")
+    return args.titles, args.queries, args.top_k, args.seed, args.index_titles, args.origin_titles, args.sources
+
+
+# LEGACY get_metadata NORMALISATION AND SCORING (REFERENCE FOR PARITY AND TIMING)
+def clean_name_legacy(name):
+    name = name.lower()
+    name = " ".join(name.split("_"))
+    name = name.replace(", the", "")
+    name = name.replace(", a", "")
+    name = re.sub(' +', ' ', name).strip()
+    alt_name = name.split("filmed as")
+    if len(alt_name) > 1:
+        name = re.sub(r"[\([{})\]]", "", name).split("filmed as")[-1].strip()
+    alt_name = name.split("released as")
+    if len(alt_name) > 1:
+        name = re.sub(r"[\([{})\]]", "", name).split("released as")[-1].strip()
+    name = re.sub(r'\([^)]*\)', '', name)
+    name = name.replace("early pilot", "")
+    name = name.replace("final pilot", "")
+    name = name.replace("transcript", "")
+    name = name.replace("first draft", "")
+    name = name.replace("tv script pdf", "")
+    name = name.replace("pilot", "")
+    name = name.strip()
+    return name
+
+
+def roman_to_int_legacy(num):
+    string = num.split()
+    res = []
+    for s in string:
+        if s == "ii":
+            res.append("2")
+        elif s == "iii":
+            res.append("3")
+        elif s == "iv":
+            res.append("4")
+        elif s == "v":
+            res.append("5")
+        elif s == "vi":
+            res.append("6")
+        elif s == "vii":
+            res.append("7")
+        elif s == "viii":
+            res.append("8")
+        elif s == "ix":
+            res.append("9")
+        else:
+            res.append(s)
+    return " ".join(res)
+
+
+def extra_clean_legacy(name):
+    name = roman_to_int_legacy(clean_name_legacy(name)).replace(
+        "the ", "").replace("-", "").replace(":", "").replace("episode", "").replace(".", "")
+    return name
+
+
+def average_ratio_legacy(n, m):
+    return ((fuzz.token_sort_ratio(n,  m) + fuzz.token_sort_ratio(m,  n)) // 2)
+
+
+# LEGACY KEY OF A SCRIPT IN get_metadata's build_origin LOOP
+def origin_key_legacy(script):
+    name = re.sub(r'\([^)]*\)', '', script.strip()).lower()
+    name = " ".join(name.split('-'))
+    name = re.sub(r'['+string.punctuation+']', ' ', name)
+    name = re.sub(' +', ' ', name).strip()
+    name = name.split()
+    name = " ".join(list(filter(lambda a: a not in LEGACY_FORBIDDEN, name)))
+    name = "".join(name.split())
+    name = roman_to_int_legacy(name)
+    name = unidecode(name)
+    return name
+
+
+# SYNTHETIC CATALOGUE TITLES: TWO TO FOUR WORDS WITH SEQUEL NUMBERS, YEARS, DRAFT NOTES AND SIMILAR
+def make_titles(num_titles, seed=0):
+    rng = random.Random(seed)
+    titles = []
+    for _ in range(num_titles):
+        words = [rng.choice(TITLE_WORDS) for _ in range(rng.randint(2, 4))]
+        title = ' '.join(words).title() + rng.choice(TITLE_SUFFIXES)
+        titles.append(('The ' + title) if rng.random() < 0.2 else title)
+    return titles
+
+
+# A TITLE AS A SOURCE MIGHT MISSPELL IT: A DROPPED OR SWAPPED LETTER, OR WORDS IN ANOTHER ORDER
+def misspell(title, rng):
+    chars = list(title)
+    i = rng.randrange(len(chars))
+    kind = rng.random()
+    if kind < 0.4:
+        del chars[i]
+    elif kind < 0.8 and i + 1 < len(chars):
+        chars[i], chars[i + 1] = chars[i + 1], chars[i]
+    else:
+        words = title.split()
+        rng.shuffle(words)
+        return ' '.join(words)
+    return ''.join(chars)
+
+
+# NORMALISATION AND average_ratio MUST MATCH THE LEGACY FUNCTIONS, SCORED WITH fuzzywuzzy AS THEY WERE
+# WITH rapidfuzz INSTALLED, ALSO COUNT THE PAIRS WHOSE SCORE UNDER use_rapidfuzz() DIFFERS, AND THOSE THAT
+# WOULD END UP ON THE OTHER SIDE OF THE 85 THRESHOLD OF get_metadata.correct_names
+def check_match_parity(titles, queries):
+    for title in titles + queries:
+        if extra_clean(title) != extra_clean_legacy(title):
+            raise AssertionError("extra_clean mismatch for %r" % title)
+    pairs = [(extra_clean(n), extra_clean(m)) for n, m in zip(queries, titles)]
+    legacy = [average_ratio_legacy(n, m) for n, m in pairs]
+    for (n, m), score in zip(pairs, legacy):
+        if average_ratio(n, m) != score:
+            raise AssertionError("average_ratio mismatch for %r, %r" % (n, m))
+    print("titles   %d titles normalised as before; average_ratio matches on %d pairs" %
+          (len(titles) + len(queries), len(pairs)))
+    if rapid_fuzz is not None:
+        use_rapidfuzz()
+        rapid = [average_ratio(n, m) for n, m in pairs]
+        use_rapidfuzz(False)
+        print("titles   with rapidfuzz (-z): %d of %d scores differ, %d cross the 85 threshold" %
+              (sum([1 for x, y in zip(legacy, rapid) if x != y]), len(pairs),
+               sum([1 for x, y in zip(legacy, rapid) if (x < 85) != (y < 85) or (x > 85) != (y > 85)])))
+
+
+# TIME NORMALISING EVERY TITLE AND SCORING PAIRS, LEGACY AGAINST MEMOISED / SINGLE-SCORE
+def bench_scoring(titles, queries):
+    NORMAL_CACHE.clear()
+    names = titles + queries + titles
+    _, old_norm = time_call(lambda: [extra_clean_legacy(x) for x in names])
+    _, new_norm = time_call(lambda: [extra_clean(x) for x in names])
+    pairs = [(extra_clean(n), extra_clean(m)) for n, m in zip(queries, titles)]
+    _, old_ratio = time_call(lambda: [average_ratio_legacy(n, m) for n, m in pairs])
+    _, new_ratio = time_call(lambda: [average_ratio(n, m) for n, m in pairs])
+    print("titles   normalise %d names: legacy %7.3fs  memoised %7.3fs  |  score %d pairs: legacy %7.3fs  "
+          "new %7.3fs" % (len(names), old_norm, new_norm, len(pairs), old_ratio, new_ratio))
+
+
+# TOP-K LOOKUP OF MISSPELT QUERIES: THE INDEX AGAINST SCORING EVERY TITLE ONE PAIR AT A TIME
+def bench_top_k(titles, queries, k):
+    index = TitleIndex(titles)
+    start = time.perf_counter()
+    brute = []
+    for query in queries:
+        scored = sorted([(-average_ratio(extra_clean(query), name), i) for i, name in enumerate(index.normal)])
+        brute.append([(i, -score) for score, i in scored[:k]])
+    brute_time = time.perf_counter() - start
+    matches, index_time = time_call(index.top_k_batch, queries, k)
+    if [[(x[0], x[2]) for x in m] for m in matches] != brute:
+        raise AssertionError("Top-k matches of the index differ from scoring every title")
+    found = sum([len(set([x[0] for x in m]) & set([x[0] for x in b])) for m, b in zip(matches, brute)])
+    best = sum([1 for m, b in zip(matches, brute) if m and b and m[0][2] == b[0][1]])
+    print("top-k    %d queries x %d titles, k=%d: pairwise %7.3fs  index %7.3fs  speedup %6.1fx  "
+          "recall %.3f  best score found %d/%d" %
+          (len(queries), len(titles), k, brute_time, index_time, brute_time / max(index_time, 1e-9),
+           found / max(1, sum([len(b) for b in brute])), best, len(queries)))
+    if rapid_fuzz is not None:
+        use_rapidfuzz()
+        rapid, rapid_time = time_call(index.top_k_batch, queries, k)
+        use_rapidfuzz(False)
+        found = sum([len(set([x[0] for x in m]) & set([x[0] for x in b])) for m, b in zip(rapid, brute)])
+        print("top-k    with rapidfuzz (-z): index %7.3fs  speedup %6.1fx  recall %.3f" %
+              (rapid_time, brute_time / max(rapid_time, 1e-9), found / max(1, sum([len(b) for b in brute]))))
+
+
+# SYNTHETIC SOURCE LISTINGS: num_titles SCRIPT NAMES SPREAD OVER num_sources SOURCES, SOME ACCENTED, WITH
+# THE PATHS OF THE FILES DOWNLOADED FOR ABOUT NINE IN TEN OF THEM
+def make_sources(num_titles, num_sources, seed=0):
+    rng = random.Random(seed)
+    sources = dict([("source%d" % i, {}) for i in range(num_sources)])
+    files = dict([(x, []) for x in sources])
+    for i, title in enumerate(make_titles(num_titles, seed)):
+        if rng.random() < 0.1:
+            title = ''.join([ACCENTED.get(c, c) for c in title])
+        source = "source%d" % (i % num_sources)
+        file_name = "%s_%d" % (re.sub(r'\W+', '_', title), i)
+        sources[source]["%s #%d" % (title, i) if title in sources[source] else title] = {"file_name": file_name}
+        if rng.random() < 0.9:
+            files[source].append(os.path.join("scripts", "unprocessed", source, file_name + ".txt"))
+    return sources, files
+
+
+# ORIGIN KEYS MUST MATCH THE LEGACY build_origin LOOP, SINCE EVERYTHING DOWNSTREAM IS GROUPED BY THEM
+def check_origin_keys(titles, queries, sources):
+    names = ORIGIN_EDGE_NAMES + titles + queries
+    for source_meta in sources.values():
+        names += list(source_meta)
+    for name, key in zip(names, origin_keys(names)):
+        if key != origin_key_legacy(name):
+            raise AssertionError("origin key mismatch for %r: %r instead of %r" % (name, key, origin_key_legacy(name)))
+    print("origin   %d names keyed as before" % len(names))
+
+
+# KEYS AND DOWNLOADED-FILE CHECKS OF EVERY SCRIPT AS build_origin MAKES THEM: LEGACY (ONE SCRIPT AT A TIME, FILES
+# IN A LIST) AGAINST BATCHED KEYS AND FILES IN A DICT
+def bench_origin(sources, files):
+    def legacy():
+        found = []
+        for source, source_meta in sources.items():
+            for script in source_meta:
+                curr_file = os.path.join("scripts", "unprocessed", source, source_meta[script]["file_name"] + ".txt")
+                found.append((origin_key_legacy(script), curr_file in files[source]))
+        return found
+
+    def batched():
+        found = []
+        for source, source_meta in sources.items():
+            present = dict([(x, 0) for x in files[source]])
+            for script, name in zip(source_meta, origin_keys(list(source_meta))):
+                curr_file = os.path.join("scripts", "unprocessed", source, source_meta[script]["file_name"] + ".txt")
+                found.append((name, curr_file in present))
+        return found
+
+    old, old_time = time_call(legacy)
+    new, new_time = time_call(batched)
+    if old != new:
+        raise AssertionError("Batched origin keys or file checks differ from the legacy loop")
+    print("origin   %d scripts in %d sources (%d keys, %d files present): legacy %7.3fs  batched %7.3fs  "
+          "speedup %6.1fx" % (len(old), len(sources), len(set([x[0] for x in old])), sum([1 for x in old if x[1]]),
+                               old_time, new_time, old_time / max(new_time, 1e-9)))
+
+
+# THE FIXTURE DATASET MUST RESOLVE SOURCE-STYLE NAMES TO THE EXPECTED IMDb IDS
+def check_local_index():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index_path = os.path.join(tmp_dir, 'title_index.sqlite')
+        count = import_title_basics(FIXTURE_BASICS, index_path, FIXTURE_RATINGS)
+        index = LocalTitleIndex(index_path)
+        for name, expected in FIXTURE_EXPECTED.items():
+            hits = index.search(name, 1) or index.search_fuzzy(name, 1)
+            if (hits[0]["id"] if hits else None) != expected:
+                raise AssertionError("Local index resolves %r to %s instead of %s" % (name, hits, expected))
+    print("index    %d fixture titles, %d names resolve as expected" % (count, len(FIXTURE_EXPECTED)))
+
+
+# IMPORT A SYNTHETIC title.basics FILE AND TIME LOOKUPS OF SOURCE-STYLE NAMES IN IT
+def bench_local_index(num_rows, queries, seed):
+    titles = make_titles(num_rows, seed)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        basics_path = os.path.join(tmp_dir, 'title.basics.tsv')
+        with open(basics_path, 'w', encoding='utf-8') as outfile:
+            outfile.write('tconst\ttitleType\tprimaryTitle\toriginalTitle\tisAdult\tstartYear\tendYear\t'
+                          'runtimeMinutes\tgenres\n')
+            for i, title in enumerate(titles):
+                outfile.write('tt%07d\t%s\t%s\t%s\t0\t%d\t\\N\t90\tDrama\n' %
+                              (i + 1, 'movie' if i % 4 else 'tvSeries', title, title, 1950 + i % 70))
+        index_path = os.path.join(tmp_dir, 'title_index.sqlite')
+        count, import_time = time_call(import_title_basics, basics_path, index_path)
+        index = LocalTitleIndex(index_path)
+        hits, search_time = time_call(lambda: [index.search(x, 1) for x in queries])
+        misses = [x for x, hit in zip(queries, hits) if not hit]
+        fuzzy, fuzzy_time = time_call(lambda: [index.search_fuzzy(x, 1) for x in misses])
+        print("index    import %d rows (%d kept) in %6.2fs, %5.1f MB on disk (%4.1f MB TSV)  |  %d lookups "
+              "%7.0f/s, %d resolved  |  %d fuzzy %7.0f/s, %d resolved" %
+              (num_rows, count, import_time, os.path.getsize(index_path) / 1e6, os.path.getsize(basics_path) / 1e6,
+               len(queries), len(queries) / max(search_time, 1e-9), sum([1 for x in hits if x]),
+               len(misses), len(misses) / max(fuzzy_time, 1e-9), sum([1 for x in fuzzy if x])))
+
+
+# MAIN FUNCTION
+if __name__ == "__main__":
+    num_titles, num_queries, top_k, seed, index_titles, origin_titles, num_sources = read_args()
+    rng = random.Random(seed + 1)
+    titles = make_titles(num_titles, seed)
+    queries = [misspell(rng.choice(titles), rng) for _ in range(num_queries)]
+    check_match_parity(titles, queries)
+    bench_scoring(titles, queries)
+    accented = [''.join([ACCENTED.get(c, c) for c in x]) if rng.random() < 0.1 else x for x in titles]
+    bench_top_k(accented + TOP_K_EDGE_NAMES,
+                [''.join([ACCENTED.get(c, c) for c in x]) if rng.random() < 0.1 else x for x in queries] +
+                TOP_K_EDGE_NAMES, top_k)
+    sources, files = make_sources(origin_titles, num_sources, seed)
+    check_origin_keys(titles, queries, sources)
+    bench_origin(sources, files)
+    check_local_index()
+    bench_local_index(index_titles, queries, seed)
@@ -1,17 +1,23 @@
 from fuzzywuzzy import fuzz
-from os import listdir, makedirs
-from os.path import isfile, join, sep, getsize, exists
+from os import listdir, makedirs, stat, remove, replace, fdopen, umask, chmod, linesep
+from os.path import isfile, join, sep, getsize, exists, abspath, dirname, basename
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
+import argparse
+import hashlib
+import locale
 import re
-import itertools
 import string
+import tempfile
+import time
 
 from unidecode import unidecode
 
 import json
 
-f = open('sources.json', 'r')
-data = json.load(f)
+from line_reader import read_lines
+from script_dedup import find_duplicates, group_fingerprints, minhash_signature, text_hash
 
 SCRIPT_DIR = join("scripts", "unprocessed")
 META_DIR = join("scripts", "metadata")
@@ -19,14 +25,60 @@ CLEAN_DIR = join("scripts", "filtered")
 CLEANMPAA_DIR = join("scripts", "filtered_mpaa")
 META_FILE = join(META_DIR, "clean_meta.json")
 CLEAN_META = join(META_DIR, "clean_files_meta.json")
+CLEAN_DUPS = join(META_DIR, "clean_files_dups.json")
+CLEAN_RULES_REPORT = join(META_DIR, "clean_files_rules.json")
+CLEAN_WRITES = join(META_DIR, "clean_files_writes.json")
+CLEAN_CROSS_DUPS = join(META_DIR, "clean_files_cross_dups.json")
+
+# NUMBER OF LEADING CHARACTERS OF EACH CLEANED SCRIPT COMPARED BETWEEN SOURCES
+COMPARE_CHARS = 10000
+# BUMP WHEN clean_script CHANGES SO THE ON-DISK CLEANING CACHE IS NOT REUSED
+CLEAN_VERSION = 1
+# CLEANED TEXTS KEPT IN MEMORY (MOST RECENTLY USED), ENOUGH FOR ALL SOURCES OF A TITLE
+CLEAN_CACHE_SIZE = 64
+CLEAN_CACHE = OrderedDict()
+# THE PROCESS UMASK, READ ONCE AT IMPORT (umask CAN ONLY BE READ BY SETTING IT, WHICH RACES WITH OTHER THREADS)
+UMASK = umask(0)
+umask(UMASK)
+CACHE_STATS = {"cleaned": 0, "memory_hits": 0, "disk_hits": 0, "read_bytes": 0, "clean_time": 0.0,
+               "saved_read_bytes": 0, "saved_clean_time": 0.0}
+
+
+def read_args():
+    parser = argparse.ArgumentParser(
+        description='Clean the unprocessed scripts listed in clean_meta.json, keeping one source per title')
+    parser.add_argument("-n", "--near-thresh", type=float, default=0.9,
+                        help="Estimated similarity at which two sources of a title count as duplicates "
+                             "(1 counts identical text only)")
+    parser.add_argument("-C", "--cache-dir", default=None,
+                        help="Directory for an on-disk cache of cleaned scripts, reused while a script is unchanged "
+                             "(not with -w)")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="Clean titles over this many worker processes, streaming each script from disk "
+                             "(default: one title at a time in this process)")
+    parser.add_argument("-k", "--chunksize", type=int, default=4,
+                        help="Number of titles sent to a worker at a time")
+    parser.add_argument("-F", "--force", action='store_true',
+                        help="Rewrite every output file, even when its contents are unchanged")
+    parser.add_argument("-X", "--cross-dups", choices=['off', 'report', 'remove'], default='off',
+                        help="Look for the same script kept under different titles: report the clusters, or also "
+                             "remove all but the longest script of each cluster whose MPAA ratings agree "
+                             "(default: off, as it re-reads every kept script)")
+    parser.add_argument("-x", "--cross-thresh", type=float, default=0.9,
+                        help="Estimated similarity at which scripts of different titles count as duplicates")
+    args = parser.parse_args()
+    if not 0 < args.near_thresh <= 1 or not 0 < args.cross_thresh <= 1:
+        raise AssertionError(
+            "Invalid value. Similarity threshold must be in (0, 1]")
+    if (args.workers is not None and args.workers < 1) or args.chunksize < 1:
+        raise AssertionError(
+            "Invalid value. Workers and chunk size must be at least 1")
+    if args.workers is not None and args.cache_dir is not None:
+        raise AssertionError(
+            "Invalid value. The cache directory is only used without workers, which stream scripts instead")
+    return args.near_thresh, args.cache_dir, args.workers, args.chunksize, args.force, args.cross_dups, \
+        args.cross_thresh
 
-if not exists(CLEAN_DIR):
-    makedirs(CLEAN_DIR)
-if not exists(CLEANMPAA_DIR):
-    makedirs(CLEANMPAA_DIR)
-
-f = open(META_FILE, 'r')
-metadata = json.load(f)
 
 def get_mpaa_rating(metadata, script, mpaa_dict):
     """Retrieve the MPAA rating for a given script."""
@@ -44,169 +96,673 @@ def get_mpaa_rating(metadata, script, mpaa_dict):
     
     return mpaa_rating
 
-def clean_script(text):
+# CLEANING RULES, APPLIED IN ORDER TO EACH LOWERCASED, STRIPPED LINE; THE FIRST RULE WHOSE PATTERN MATCHES APPLIES
+# action: None DROPS THE LINE; OTHERWISE A FUNCTION GIVING THE REWRITTEN LINE (RETURNING THE LINE ITSELF KEEPS IT)
+# recheck: THE RULE ALSO APPLIES TO LINES REWRITTEN BY AN ACTION
+CleanRule = namedtuple('CleanRule', ['name', 'pattern', 'action', 'recheck'])
+RULE_CACHE = {}
+
+
+# Filter lines with numbers before and after scene details
+def strip_scene_numbers(line):
+    numbers = line.split()
+    if numbers[0] != numbers[-1]:
+        return line
+    return " ".join(numbers[1:-1])
+
+
+CLEAN_RULES = [
+    # skip lines with one char since they're likely typos
+    CleanRule('typo', r'.$', None, False),
+    # skip lines containing page numbers
+    CleanRule('page', r'[(]?\d{1,3}[)]?[\.]?$|.[(]?\d{1,3}[)]?[\.]?$|[(]?\d{1,3}[)]?.?[(]?\d{1,3}[)]?[\.]?$',
+              None, False),
+    # Lines which just say continued
+    CleanRule('cont', r'\(continued\)$|continued:$|continued: \(\d+\)$', None, True),
+    # skip lines containing just special characters
+    CleanRule('special', r'[^\w\s ]+$', None, False),
+    CleanRule('scene', r'\d+\s+.*\s+\d+$', strip_scene_numbers, False),
+    CleanRule('omitted', r'omitted$', None, True)
+]
+
+
+# ADD A RULE TO CLEAN_RULES, AT THE END OR BEFORE THE RULE NAMED before
+def register_rule(name, pattern, action=None, recheck=False, before=None):
+    if not name.isidentifier() or name == 'keep' or name in [x.name for x in CLEAN_RULES]:
+        raise AssertionError(
+            "Invalid value. Rule names must be new identifiers other than keep")
+    rule = CleanRule(name, pattern, action, recheck)
+    if before is None:
+        CLEAN_RULES.append(rule)
+    else:
+        CLEAN_RULES.insert([x.name for x in CLEAN_RULES].index(before), rule)
+    return rule
 
-    text = text.encode('utf-8', 'ignore').decode('utf-8').strip()
-    text = text.replace("", "")
-    text = text.replace("•", "")
-    text = text.replace("·", "")
 
-    whitespace = re.compile(r'^[\s]+')
-    scenenumber = re.compile(r'^\d+\s+.*\s+\d+$')
-    pagenumber = re.compile(
-        r'^[(]?\d{1,3}[)]?[\.]?$|^.[(]?\d{1,3}[)]?[\.]?$|^[(]?\d{1,3}[)]?.?[(]?\d{1,3}[)]?[\.]?$')
-    cont = re.compile(r'^\(continued\)$|^continued:$|^continued: \(\d+\)$')
-    allspecialchars = re.compile(r'^[^\w\s ]*$')
-
-    lines = []
-
-    for line in text.split('\n'):
-        copy = line
-        line = line.lower().strip()
-        # skip lines with one char since they're likely typos
-        if len(line) == 1:
-            if line.lower() != 'a' or line.lower() != 'i':
-                continue
-        # skip lines containing page numbers
-        if pagenumber.match(line):
-            continue
-        # Lines which just say continued
-        if cont.match(line):
-            continue
-        # skip lines containing just special characters
-        if line != '' and allspecialchars.match(line):
-            continue
-        # Filter lines with numbers before and after scene details
-        if scenenumber.match(line):
-            numbers = copy.split()
-            if numbers[0] == numbers[-1]:
-                copy = " ".join(numbers[1:-1]).strip()
-                line = copy.lower().strip()
-        # Lines which just say continued
-        if cont.match(line):
-            continue
-        if line == "omitted":
-            continue
-        lines.append(copy.strip())
+# ONE ALTERNATION OVER ALL RULES AND ONE OVER THE recheck RULES, EACH RULE A NAMED GROUP IN RULE ORDER,
+# SO A LINE IS MATCHED AGAINST EVERY RULE IN A SINGLE PASS (CACHED PER RULE LIST)
+def get_rule_matchers(rules):
+    key = tuple((x.name, x.pattern, x.recheck) for x in rules)
+    if key not in RULE_CACHE:
+        recheck_rules = [x for x in rules if x.recheck]
+        RULE_CACHE[key] = (
+            re.compile('|'.join(['(?P<%s>%s)' % (x.name, x.pattern) for x in rules])),
+            re.compile('|'.join(['(?P<%s>%s)' % (x.name, x.pattern) for x in recheck_rules])) if recheck_rules
+            else None,
+            {x.name: x for x in rules}
+        )
+    return RULE_CACHE[key]
+
+
+# LABELS classify_line CAN RETURN: keep, OR THE NAME OF THE RULE THAT DROPPED OR REWROTE THE LINE
+def line_labels(rules=CLEAN_RULES):
+    return ['keep'] + [x.name for x in rules]
+
 
-    final_data = '\n'.join(lines)
-    final_data = re.sub(r'\n\n+', '\n\n', final_data).strip()
-    return final_data
+# EMPTY PER-RULE COUNTERS FOR classify_line
+def new_rule_stats(rules=CLEAN_RULES):
+    return {x: {"matched": 0, "dropped": 0, "time": 0.0} for x in line_labels(rules)}
 
 
-def compare_scripts(scripts):
-    combos = list(itertools.combinations(scripts, 2))
+# PER-RULE COUNTERS OF THIS RUN
+RULE_STATS = new_rule_stats()
 
-    for combo in combos:
-        if combo[0]["text"] == combo[1]["text"]:
-            index_1 = next((index for (index, d) in enumerate(
-                scripts) if d["source"] == combo[0]["source"]), None)
-            index_2 = next((index for (index, d) in enumerate(
-                scripts) if d["source"] == combo[1]["source"]), None)
-            scripts[index_1]["matches"] += 1
-            scripts[index_2]["matches"] += 1
 
-    return sorted(scripts, key=lambda i: (i['matches'], i["size"]), reverse=True)[0]
+# ADD THE COUNTERS IN stats TO total
+def merge_rule_stats(total, stats):
+    for name in stats:
+        if name not in total:
+            total[name] = {"matched": 0, "dropped": 0, "time": 0.0}
+        for key in stats[name]:
+            total[name][key] += stats[name][key]
+    return total
 
 
-def get_clean_text(path):
+# DROP INVALID UTF-8 AND BULLET/FORM FEED CHARACTERS FROM A TEXT OR A SINGLE LINE
+def prepare_text(text):
+    text = text.encode('utf-8', 'ignore').decode('utf-8')
+    text = text.replace("\f", "")
+    text = text.replace("•", "")
+    text = text.replace("·", "")
+    return text
+
+
+# LABEL ONE LINE (ALREADY PASSED THROUGH prepare_text), RETURNING (label, kept text or None); SEE line_labels
+# matchers: get_rule_matchers OF THE RULES TO APPLY (DEFAULT CLEAN_RULES)
+# WITH stats (FROM new_rule_stats), COUNT THE LINES EACH RULE MATCHED AND DROPPED AND THE TIME SPENT ON THEM
+def classify_line(line, matchers=None, stats=None):
+    if stats is not None:
+        start = time.perf_counter()
+    rule_class, recheck_class, rule_dict = matchers if matchers is not None else get_rule_matchers(CLEAN_RULES)
+    label = 'keep'
+    matched = []
+    match = rule_class.match(line.lower().strip())
+    if match is not None:
+        label = match.lastgroup
+        matched.append(label)
+        action = rule_dict[label].action
+        if action is None:
+            line = None
+        else:
+            new_line = action(line)
+            if new_line is line:
+                label = 'keep'
+            else:
+                line = new_line.strip()
+                match = recheck_class.match(line.lower()) if recheck_class is not None else None
+                if match is not None:
+                    label = match.lastgroup
+                    matched.append(label)
+                    line = None
+    if line is not None:
+        line = line.strip()
+
+    if stats is not None:
+        elapsed = time.perf_counter() - start
+        if not matched:
+            stats['keep']["matched"] += 1
+            stats['keep']["time"] += elapsed
+        for name in matched:
+            stats[name]["matched"] += 1
+            stats[name]["time"] += elapsed / len(matched)
+        if line is None:
+            stats[label]["dropped"] += 1
+    return label, line
+
+
+# CLEAN ONE LINE; RETURNS None IF THE LINE IS DROPPED
+def clean_line(line):
+    return classify_line(prepare_text(line))[1]
+
+
+# CLEAN A STREAM OF LINES (WITH OR WITHOUT TRAILING NEWLINES), YIELDING THE KEPT LINES
+# RUNS OF BLANK LINES BECOME ONE BLANK LINE; LEADING AND TRAILING BLANK LINES ARE DROPPED
+# prepared: THE LINES ALREADY WENT THROUGH prepare_text; stats: PER-RULE COUNTERS (SEE classify_line)
+def clean_lines(lines, prepared=False, rules=CLEAN_RULES, stats=None):
+    matchers = get_rule_matchers(rules)
+    started = False
+    blank = False
+    for line in lines:
+        if line.endswith('\n'):
+            line = line[:-1]
+        if not prepared:
+            line = prepare_text(line)
+        line = classify_line(line, matchers, stats)[1]
+        if line is None:
+            continue
+        if line == '':
+            blank = started
+            continue
+        if blank:
+            yield ''
+            blank = False
+        started = True
+        yield line
+
+
+def clean_script(text, rules=CLEAN_RULES, stats=None):
+    return '\n'.join(clean_lines(prepare_text(text).split('\n'), True, rules, stats))
+
+
+# PER-RULE REPORT (LINES MATCHED AND DROPPED, SECONDS SPENT) IN RULE ORDER, FOR CLEAN_RULES_REPORT
+# keep COUNTS THE LINES NO RULE MATCHED
+def rule_report(stats, rules=CLEAN_RULES):
+    patterns = {x.name: x.pattern for x in rules}
+    return [dict(name=x, pattern=patterns.get(x), **stats[x]) for x in line_labels(rules) if x in stats]
+
+
+# SHA-1 OF A FILE'S CONTENTS, READ IN BLOCKS
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# MOVE THE FINISHED TEMPORARY FILE tmp_path TO path, UNLESS path ALREADY HOLDS THE SAME BYTES (tmp_path IS
+# THEN REMOVED); THE RENAME IS ATOMIC, SO READERS NEVER SEE A HALF-WRITTEN FILE
+# RETURNS 'created', 'updated' OR 'unchanged'; force REPLACES UNCHANGED FILES TOO
+def replace_if_changed(tmp_path, path, force=False):
+    if not exists(path):
+        replace(tmp_path, path)
+        return 'created'
+    if not force and getsize(tmp_path) == getsize(path) and file_digest(tmp_path) == file_digest(path):
+        remove(tmp_path)
+        return 'unchanged'
+    replace(tmp_path, path)
+    return 'updated'
+
+
+# WRITE text TO path AS open(path, 'w', errors="ignore") WOULD, SKIPPING THE WRITE IF path ALREADY HOLDS
+# THE SAME BYTES AND OTHERWISE WRITING A TEMPORARY FILE NEXT TO IT AND RENAMING IT INTO PLACE
+# RETURNS 'created', 'updated' OR 'unchanged' (SEE replace_if_changed)
+def write_if_changed(path, text, force=False):
+    data = text.replace('\n', linesep).encode(locale.getpreferredencoding(False), 'ignore')
+    if not force and exists(path) and getsize(path) == len(data) and \
+            file_digest(path) == hashlib.sha1(data).hexdigest():
+        return 'unchanged'
+    fd, tmp_path = tempfile.mkstemp(dir=dirname(path), prefix='.' + basename(path) + '.', suffix='.tmp')
+    with fdopen(fd, 'wb') as out:
+        out.write(data)
+    # mkstemp CREATES PRIVATE FILES; USE THE PERMISSIONS open() WOULD HAVE GIVEN
+    chmod(tmp_path, 0o666 & ~UMASK)
+    return replace_if_changed(tmp_path, path, force)
+
+
+# RECORD THE OUTCOME OF A WRITE IN write_dict (FOLDER -> FILE NAME -> OUTCOME); A FILE WRITTEN FOR SEVERAL
+# TITLES KEEPS created OR updated IF ANY OF ITS WRITES CHANGED IT
+def record_write(write_dict, folder, file_name, status):
+    folder_dict = write_dict.setdefault(folder, {})
+    if folder_dict.get(file_name, 'unchanged') == 'unchanged':
+        folder_dict[file_name] = status
+
+
+# COUNT THE OUTCOMES IN write_dict PER FOLDER, AND LIST THE FILES UNDER EACH OUTCOME, FOR CLEAN_WRITES
+def write_report(write_dict):
+    report = {}
+    for folder in write_dict:
+        report[folder] = {x: sorted([y for y in write_dict[folder] if write_dict[folder][y] == x])
+                          for x in ['created', 'updated', 'unchanged', 'removed']}
+    return report
+
+
+# CLUSTER THE TITLES IN clean_dict WHOSE CLEANED SCRIPTS (READ BACK FROM CLEAN_DIR) ARE IDENTICAL OR NEAR
+# DUPLICATES, THROUGH EXACT HASHES AND MINHASH LSH OVER THE WHOLE CORPUS (SEE script_dedup.group_fingerprints)
+# RETURNS THE CLUSTERS AS {"titles", "files", "similarity", "exact", "mpaa", "mpaa_conflict", "keep"}, WHERE
+# keep IS THE TITLE WITH THE LONGEST CLEANED SCRIPT (THE FIRST ONE ON TIES)
+def find_cross_duplicates(clean_dict, near_thresh=0.9):
+    titles = list(clean_dict)
+    hashes = []
+    signatures = []
+    sizes = []
+    seen = set()
+    for script in tqdm(titles):
+        text = read_text(join(CLEAN_DIR, clean_dict[script]["file"]["file_name"] + ".txt"))
+        hashes.append(text_hash(text))
+        sizes.append(len(text))
+        signatures.append(None)
+        if near_thresh < 1 and hashes[-1] not in seen:
+            seen.add(hashes[-1])
+            signatures[-1] = minhash_signature(text)
+
+    _, groups = group_fingerprints(hashes, signatures, near_thresh)
+    clusters = []
+    for group in groups:
+        members = [titles[i] for i in group["members"]]
+        ratings = [get_mpaa_rating(clean_dict, x, {}) for x in members]
+        keep = max(group["members"], key=lambda i: (sizes[i], -i))
+        clusters.append({
+            "titles": members,
+            "files": [clean_dict[x]["file"]["file_name"] for x in members],
+            "similarity": group["similarity"],
+            "exact": group["exact"],
+            "mpaa": ratings,
+            "mpaa_conflict": len(set(ratings)) > 1,
+            "keep": titles[keep]
+        })
+    return clusters
+
+
+# DROP ALL BUT THE KEPT TITLE OF EACH CLUSTER WITHOUT AN MPAA CONFLICT FROM clean_dict AND mpaa_dict,
+# DELETING THEIR OUTPUT FILES UNLESS A REMAINING TITLE USES THE SAME FILE; RETURNS THE REMOVED TITLES
+def remove_cross_duplicates(clean_dict, clusters, mpaa_dict, write_dict):
+    removed = []
+    for cluster in clusters:
+        if cluster["mpaa_conflict"]:
+            continue
+        for script in cluster["titles"]:
+            if script == cluster["keep"]:
+                continue
+            mpaa_rating = get_mpaa_rating(clean_dict, script, {})
+            mpaa_dict[mpaa_rating] -= 1
+            if mpaa_dict[mpaa_rating] == 0:
+                mpaa_dict.pop(mpaa_rating)
+            clean_dict.pop(script)
+            removed.append(script)
+
+    kept_files = set([clean_dict[x]["file"]["file_name"] for x in clean_dict])
+    for cluster in clusters:
+        for script, file_name in zip(cluster["titles"], cluster["files"]):
+            if script in removed and file_name not in kept_files:
+                for out_dir in [CLEAN_DIR, CLEANMPAA_DIR]:
+                    if exists(join(out_dir, file_name + ".txt")):
+                        remove(join(out_dir, file_name + ".txt"))
+                    write_dict.setdefault(out_dir, {})[file_name + ".txt"] = 'removed'
+    return removed
+
+
+# PICK THE SOURCE WITH THE MOST DUPLICATES AMONG THE OTHER SOURCES, THEN THE LARGEST
+# DUPLICATES ARE FOUND BY EXACT HASH AND MINHASH LSH (SEE script_dedup.find_duplicates)
+# RETURNS THE CHOSEN SCRIPT AND THE DUPLICATE GROUPS AS LISTS OF FILE NAMES WITH THEIR SIMILARITY
+def compare_scripts(scripts, near_thresh=0.9):
+    matches, groups = find_duplicates([x["text"] for x in scripts], near_thresh)
+    for i, script in enumerate(scripts):
+        script["matches"] = matches[i]
+
+    groups = [{"files": [scripts[i]["file_name"] for i in x["members"]], "similarity": x["similarity"],
+               "exact": x["exact"]} for x in groups]
+    return sorted(scripts, key=lambda i: (i['matches'], i["size"]), reverse=True)[0], groups
+
+
+def read_text(path):
     f = open(path, 'r', errors="ignore")
     text = f.read()
     f.close()
-    clean_text = clean_script(text).strip()
+    return text
 
-    return clean_text
 
+# LINES OF AN UNPROCESSED SCRIPT, DECODED ONE AT A TIME FROM A MEMORY MAP (SAME TEXT AS read_text)
+def read_text_lines(path):
+    return read_lines(path, errors="ignore")
 
-clean_dict = {}
-mpaa_dict = {}
 
-count = 0
-count_total = 0
-mpaa_count = 0
+def get_clean_text(path, stats=None):
+    clean_text = '\n'.join(clean_lines(read_text_lines(path), stats=stats)).strip()
 
-for script in tqdm(metadata):
-    files = metadata[script]["files"]
+    return clean_text
 
-    #MPAA mod
 
-    mpaa_rating = get_mpaa_rating(metadata, script, mpaa_dict)
-    if mpaa_rating is None:
-        continue
+# ON-DISK CACHE KEY: THE SCRIPT'S PATH, MTIME AND SIZE, AND THE CLEANING VERSION
+def clean_cache_key(path):
+    path_stat = stat(path)
+    key = "%s|%d|%d|%d" % (abspath(path), path_stat.st_mtime_ns, path_stat.st_size, CLEAN_VERSION)
+    return hashlib.sha1(key.encode('utf-8', 'ignore')).hexdigest()
 
-    if len(files) == 1:
-        path = join(SCRIPT_DIR, files[0]["source"],
-                    files[0]["file_name"] + ".txt")
-        clean_text = get_clean_text(path)
 
-        if clean_text.strip() == "":
-            print(files)
-            continue
+# ON-DISK CACHE ENTRY, OR None IF THERE IS NONE OR IT CANNOT BE READ (IT IS THEN CLEANED AND WRITTEN AGAIN)
+def read_cache_entry(cache_file):
+    if not isfile(cache_file):
+        return None
+    try:
+        with open(cache_file, 'r') as infile:
+            entry = json.load(infile)
+        return entry if "text" in entry and "clean_time" in entry else None
+    except (OSError, ValueError, TypeError):
+        return None
 
-        clean_dict[script] = {"file": files[0]}
-        if "tmdb" in metadata[script]:
-            clean_dict[script]["tmdb"] = metadata[script]["tmdb"]
-        if "imdb" in metadata[script]:
-            clean_dict[script]["imdb"] = metadata[script]["imdb"]
 
+# WRITE AN ON-DISK CACHE ENTRY TO A TEMPORARY FILE AND RENAME IT INTO PLACE, SO AN INTERRUPTED RUN
+# NEVER LEAVES A TRUNCATED ENTRY
+def write_cache_entry(cache_file, entry):
+    fd, tmp_path = tempfile.mkstemp(dir=dirname(cache_file), prefix='.' + basename(cache_file) + '.', suffix='.tmp')
+    try:
+        with fdopen(fd, 'w') as outfile:
+            json.dump(entry, outfile)
+        replace(tmp_path, cache_file)
+    except BaseException:
+        remove(tmp_path)
+        raise
+
+
+# get_clean_text, READING AND CLEANING EACH SCRIPT ONCE PER RUN (AND ONCE ACROSS RUNS WITH cache_dir)
+# REPEATS ARE SERVED FROM CLEAN_CACHE; BYTES READ AND TIME SPENT (READING AND CLEANING), AND WHAT THE
+# CACHES SAVED, ARE COUNTED IN CACHE_STATS
+def get_clean_text_cached(path, cache_dir=None):
+    if path in CLEAN_CACHE:
+        CLEAN_CACHE.move_to_end(path)
+        clean_text, read_bytes, clean_time = CLEAN_CACHE[path]
+        CACHE_STATS["memory_hits"] += 1
+        CACHE_STATS["saved_read_bytes"] += read_bytes
+        CACHE_STATS["saved_clean_time"] += clean_time
+        return clean_text
+
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = join(cache_dir, clean_cache_key(path) + ".json")
+    entry = read_cache_entry(cache_file) if cache_file is not None else None
+    if entry is not None:
+        clean_text, read_bytes, clean_time = entry["text"], getsize(path), entry["clean_time"]
+        CACHE_STATS["disk_hits"] += 1
+        CACHE_STATS["saved_read_bytes"] += read_bytes - len(clean_text)
+        CACHE_STATS["saved_clean_time"] += clean_time
     else:
-        script_arr = []
-
-        for file in files:
-            path = join(SCRIPT_DIR, file["source"],
-                        file["file_name"] + ".txt")
-            clean_text = get_clean_text(path)
-            if clean_text.strip() == "":
-                print(files)
+        start = time.perf_counter()
+        read_bytes = getsize(path)
+        clean_text = get_clean_text(path, RULE_STATS)
+        clean_time = time.perf_counter() - start
+        CACHE_STATS["cleaned"] += 1
+        CACHE_STATS["read_bytes"] += read_bytes
+        CACHE_STATS["clean_time"] += clean_time
+        if cache_file is not None:
+            write_cache_entry(cache_file, {"path": path, "text": clean_text, "clean_time": clean_time})
+
+    CLEAN_CACHE[path] = (clean_text, read_bytes, clean_time)
+    if len(CLEAN_CACHE) > CLEAN_CACHE_SIZE:
+        CLEAN_CACHE.popitem(last=False)
+    return clean_text
+
+
+# STREAM ONE SOURCE THROUGH clean_lines INTO tmp_name IN CLEAN_DIR AND CLEANMPAA_DIR (WITH THE MPAA LINE)
+# ONLY THE FIRST COMPARE_CHARS CHARACTERS ARE KEPT IN MEMORY AND RETURNED; None (NO FILES LEFT) IF NOTHING IS KEPT
+def stream_clean_file(path, tmp_name, mpaa_rating, stats=None):
+    clean_tmp = join(CLEAN_DIR, tmp_name)
+    mpaa_tmp = join(CLEANMPAA_DIR, tmp_name)
+    prefix = []
+    prefix_len = 0
+    try:
+        with open(clean_tmp, 'w', errors="ignore") as clean_out, open(mpaa_tmp, 'w', errors="ignore") as mpaa_out:
+            mpaa_out.write(f"{mpaa_rating}\n\n")
+            sep = ''
+            for line in clean_lines(read_text_lines(path), stats=stats):
+                clean_out.write(sep + line)
+                mpaa_out.write(sep + line)
+                if prefix_len < COMPARE_CHARS:
+                    prefix.append(sep + line)
+                    prefix_len += len(sep) + len(line)
+                sep = '\n'
+    except BaseException:
+        remove_tmp_files([tmp_name])
+        raise
+
+    if not prefix:
+        remove_tmp_files([tmp_name])
+        return None
+    return ''.join(prefix)[:COMPARE_CHARS]
+
+
+# REMOVE WHICHEVER OF THE TEMPORARY FILES tmp_names EXIST IN CLEAN_DIR AND CLEANMPAA_DIR
+def remove_tmp_files(tmp_names):
+    for tmp_name in tmp_names:
+        for out_dir in [CLEAN_DIR, CLEANMPAA_DIR]:
+            if exists(join(out_dir, tmp_name)):
+                remove(join(out_dir, tmp_name))
+
+
+# TEMPORARY OUTPUT NAMES OF EVERY SOURCE OF A clean_title_job JOB
+def job_tmp_names(job):
+    job_index, files = job[0], job[1]
+    return ["%s.txt.%d.%d.tmp" % (file["file_name"], job_index, i) for i, file in enumerate(files)]
+
+
+# CLEAN ALL SOURCES OF ONE TITLE AND PICK ONE AS IN THE SEQUENTIAL RUN, LEAVING ITS OUTPUTS IN TEMPORARY FILES
+# job: (job_index, files, mpaa_rating, near_thresh); job_index KEEPS TEMPORARY NAMES UNIQUE ACROSS TITLES
+# RETURNS (final file entry or None, tmp_name, duplicate groups, number of empty sources, per-rule counters)
+def clean_title_job(job):
+    job_index, files, mpaa_rating, near_thresh = job
+    script_arr = []
+    empty = 0
+    stats = new_rule_stats()
+    try:
+        for file, tmp_name in zip(files, job_tmp_names(job)):
+            path = join(SCRIPT_DIR, file["source"], file["file_name"] + ".txt")
+            text = stream_clean_file(path, tmp_name, mpaa_rating, stats)
+            if text is None:
+                empty += 1
                 continue
-            file["text"] = clean_text[:10000]
+            file = dict(file)
+            file["text"] = text
             file["matches"] = 0
-
+            file["tmp_name"] = tmp_name
             script_arr.append(file)
-        final = compare_scripts(script_arr)
-        final.pop('text', 'No Key found')
-        final.pop('matches', 'No Key found')
 
-        clean_dict[script] = {"file": final}
-        if "tmdb" in metadata[script]:
-            clean_dict[script]["tmdb"] = metadata[script]["tmdb"]
-        if "imdb" in metadata[script]:
-            clean_dict[script]["imdb"] = metadata[script]["imdb"]
-
-    clean_dict[script]["file"].pop('size', 'No Key found')
+        if not script_arr:
+            return None, None, [], empty, stats
+        groups = []
+        final = script_arr[0]
+        if len(files) > 1:
+            final, groups = compare_scripts(script_arr, near_thresh)
+        remove_tmp_files([file["tmp_name"] for file in script_arr if file is not final])
+    except BaseException:
+        remove_tmp_files(job_tmp_names(job))
+        raise
+
+    tmp_name = final.pop("tmp_name")
+    final.pop('text', 'No Key found')
+    final.pop('matches', 'No Key found')
+    final.pop('size', 'No Key found')
+    return final, tmp_name, groups, empty, stats
+
+
+# RUN clean_title_job OVER A PROCESS POOL (1 WORKER RUNS IN THIS PROCESS), YIELDING RESULTS IN JOB ORDER
+def clean_titles(jobs, num_workers, chunk_size):
+    if num_workers == 1:
+        yield from map(clean_title_job, jobs)
+        return
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        yield from executor.map(clean_title_job, jobs, chunksize=chunk_size)
+
+
+if __name__ == "__main__":
+    near_thresh, cache_dir, num_workers, chunk_size, force, cross_policy, cross_thresh = read_args()
+
+    if not exists(CLEAN_DIR):
+        makedirs(CLEAN_DIR)
+    if not exists(CLEANMPAA_DIR):
+        makedirs(CLEANMPAA_DIR)
+    if cache_dir is not None and not exists(cache_dir):
+        makedirs(cache_dir)
+
+    f = open(META_FILE, 'r')
+    metadata = json.load(f)
+
+    clean_dict = {}
+    dup_dict = {}
+    write_dict = {}
+    mpaa_dict = {}
+
+    count = 0
+    count_total = 0
+    mpaa_count = 0
+
+    if num_workers is not None:
+        titles = []
+        jobs = []
+        for script in metadata:
+            mpaa_rating = get_mpaa_rating(metadata, script, mpaa_dict)
+            if mpaa_rating is None:
+                continue
+            titles.append(script)
+            jobs.append((len(jobs), metadata[script]["files"], mpaa_rating, near_thresh))
+
+        results = clean_titles(jobs, num_workers, chunk_size)
+        try:
+            for script, (final, tmp_name, groups, empty, stats) in tqdm(zip(titles, results), total=len(jobs)):
+                merge_rule_stats(RULE_STATS, stats)
+                for _ in range(empty):
+                    print(metadata[script]["files"])
+                if final is None:
+                    continue
+                if groups:
+                    dup_dict[script] = groups
+
+                clean_dict[script] = {"file": final}
+                if "tmdb" in metadata[script]:
+                    clean_dict[script]["tmdb"] = metadata[script]["tmdb"]
+                if "imdb" in metadata[script]:
+                    clean_dict[script]["imdb"] = metadata[script]["imdb"]
+
+                # RENAMED HERE, IN TITLE ORDER, SO TITLES SHARING A FILE NAME END UP AS IN THE SEQUENTIAL RUN
+                file_name = final["file_name"] + ".txt"
+                for out_dir in [CLEAN_DIR, CLEANMPAA_DIR]:
+                    record_write(write_dict, out_dir, file_name,
+                                 replace_if_changed(join(out_dir, tmp_name), join(out_dir, file_name), force))
+                mpaa_count += 1
+        except BaseException:
+            # A WORKER THAT FAILED OR DIED LEAVES THE TEMPORARY OUTPUTS OF THE TITLES NOT YET RENAMED
+            for job in jobs:
+                remove_tmp_files(job_tmp_names(job))
+            raise
 
-    path = join(SCRIPT_DIR, clean_dict[script]["file"]["source"],
-                clean_dict[script]["file"]["file_name"] + ".txt")
-    clean_text = get_clean_text(path)
+    else:
+        for script in tqdm(metadata):
+            files = metadata[script]["files"]
 
-    with open(join(CLEAN_DIR, clean_dict[script]["file"]["file_name"] + ".txt"), 'w', errors="ignore") as out:
-        out.write(clean_text)
+            #MPAA mod
 
-    final_text = f"{mpaa_rating}\n\n{clean_text}"
+            mpaa_rating = get_mpaa_rating(metadata, script, mpaa_dict)
+            if mpaa_rating is None:
+                continue
 
-    mpaa_path = join(CLEANMPAA_DIR, clean_dict[script]["file"]["file_name"] + ".txt")
-    with open(mpaa_path, 'w', errors="ignore") as out:
-        out.write(final_text)
+            if len(files) == 1:
+                path = join(SCRIPT_DIR, files[0]["source"],
+                            files[0]["file_name"] + ".txt")
+                clean_text = get_clean_text_cached(path, cache_dir)
+
+                if clean_text.strip() == "":
+                    print(files)
+                    continue
+
+                clean_dict[script] = {"file": files[0]}
+                if "tmdb" in metadata[script]:
+                    clean_dict[script]["tmdb"] = metadata[script]["tmdb"]
+                if "imdb" in metadata[script]:
+                    clean_dict[script]["imdb"] = metadata[script]["imdb"]
+
+            else:
+                script_arr = []
+
+                for file in files:
+                    path = join(SCRIPT_DIR, file["source"],
+                                file["file_name"] + ".txt")
+                    clean_text = get_clean_text_cached(path, cache_dir)
+                    if clean_text.strip() == "":
+                        print(files)
+                        continue
+                    file["text"] = clean_text[:COMPARE_CHARS]
+                    file["matches"] = 0
+
+                    script_arr.append(file)
+                if not script_arr:
+                    continue
+                final, groups = compare_scripts(script_arr, near_thresh)
+                if groups:
+                    dup_dict[script] = groups
+                final.pop('text', 'No Key found')
+                final.pop('matches', 'No Key found')
+
+                clean_dict[script] = {"file": final}
+                if "tmdb" in metadata[script]:
+                    clean_dict[script]["tmdb"] = metadata[script]["tmdb"]
+                if "imdb" in metadata[script]:
+                    clean_dict[script]["imdb"] = metadata[script]["imdb"]
+
+            clean_dict[script]["file"].pop('size', 'No Key found')
+
+            path = join(SCRIPT_DIR, clean_dict[script]["file"]["source"],
+                        clean_dict[script]["file"]["file_name"] + ".txt")
+            clean_text = get_clean_text_cached(path, cache_dir)
+
+            file_name = clean_dict[script]["file"]["file_name"] + ".txt"
+            record_write(write_dict, CLEAN_DIR, file_name,
+                         write_if_changed(join(CLEAN_DIR, file_name), clean_text, force))
+
+            final_text = f"{mpaa_rating}\n\n{clean_text}"
+
+            mpaa_path = join(CLEANMPAA_DIR, file_name)
+            record_write(write_dict, CLEANMPAA_DIR, file_name, write_if_changed(mpaa_path, final_text, force))
     
-    mpaa_count += 1
-
-with open(join(CLEAN_META), "w") as outfile:
-    json.dump(clean_dict, outfile, indent=4)
-
-print("Total scripts: ", len(clean_dict))
-# print(count_total)
-
-#count = 0
-#score = {}
-#for script in clean_dict:
-#    if "tmdb" in clean_dict[script] and "imdb" in clean_dict[script]:
-#        count += 1
-#    if clean_dict[script]["file"]["source"] in score:
-#        score[clean_dict[script]["file"]["source"]] +=1
-#    else:
-#        score[clean_dict[script]["file"]["source"]] =1
-
-#print("Scripts with complete metadata: ", count)
-print("Scripts with MPAA:", mpaa_count)
-print("MPAA Rating Counts:", mpaa_dict)
-#print("Source Breakdown: ", score)
\ No newline at end of file
+            mpaa_count += 1
+
+    cross_clusters = []
+    removed = []
+    if cross_policy != 'off':
+        print("Find duplicate scripts across titles")
+        cross_clusters = find_cross_duplicates(clean_dict, cross_thresh)
+        with open(CLEAN_CROSS_DUPS, "w") as outfile:
+            json.dump(cross_clusters, outfile, indent=4)
+    if cross_policy == 'remove':
+        removed = remove_cross_duplicates(clean_dict, cross_clusters, mpaa_dict, write_dict)
+        mpaa_count -= len(removed)
+
+    with open(join(CLEAN_META), "w") as outfile:
+        json.dump(clean_dict, outfile, indent=4)
+    with open(CLEAN_DUPS, "w") as outfile:
+        json.dump(dup_dict, outfile, indent=4)
+    with open(CLEAN_RULES_REPORT, "w") as outfile:
+        json.dump(rule_report(RULE_STATS), outfile, indent=4)
+    write_summary = write_report(write_dict)
+    with open(CLEAN_WRITES, "w") as outfile:
+        json.dump(write_summary, outfile, indent=4)
+
+    print("Total scripts: ", len(clean_dict))
+    print("Titles with duplicate sources:", len(dup_dict))
+    if cross_policy != 'off':
+        print("Duplicate scripts across titles: %d clusters, %d titles removed" % (len(cross_clusters), len(removed)))
+    # print(count_total)
+
+    #count = 0
+    #score = {}
+    #for script in clean_dict:
+    #    if "tmdb" in clean_dict[script] and "imdb" in clean_dict[script]:
+    #        count += 1
+    #    if clean_dict[script]["file"]["source"] in score:
+    #        score[clean_dict[script]["file"]["source"]] +=1
+    #    else:
+    #        score[clean_dict[script]["file"]["source"]] =1
+
+    #print("Scripts with complete metadata: ", count)
+    print("Scripts with MPAA:", mpaa_count)
+    print("MPAA Rating Counts:", mpaa_dict)
+    for out_dir in write_summary:
+        print("%s: %d created, %d updated, %d unchanged, %d removed" %
+              (out_dir, len(write_summary[out_dir]["created"]), len(write_summary[out_dir]["updated"]),
+               len(write_summary[out_dir]["unchanged"]), len(write_summary[out_dir]["removed"])))
+    if num_workers is None:
+        print("Scripts cleaned: %d (%.1f MB read, %.2fs reading and cleaning)" %
+              (CACHE_STATS["cleaned"], CACHE_STATS["read_bytes"] / 1e6, CACHE_STATS["clean_time"]))
+        print("Cleaning reused: %d from memory, %d from disk cache "
+              "(saved %.1f MB of reads, %.2fs of reading and cleaning)" %
+              (CACHE_STATS["memory_hits"], CACHE_STATS["disk_hits"], CACHE_STATS["saved_read_bytes"] / 1e6,
+               CACHE_STATS["saved_clean_time"]))
+    #print("Source Breakdown: ", score)
\ No newline at end of file
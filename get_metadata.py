@@ -1,104 +1,150 @@
 from os import dup, listdir, makedirs
 from os.path import isfile, join, sep, getsize, exists
 
+import argparse
 import urllib
 import urllib.request
 import re
 import json
-import string
+import threading
 from unidecode import unidecode # type: ignore
 from tqdm.std import tqdm # type: ignore
-from fuzzywuzzy import fuzz # type: ignore
 
 import imdb # type: ignore
 
 import config
 
-ia = imdb.Cinemagoer()
-
-f = open('sources.json', 'r')
-data = json.load(f)
+from http_pool import HttpPool
+from metadata_cache import ResponseCache, DEFAULT_TTLS, DAY, normalize_query, normalize_url
+from metadata_journal import MetadataJournal, FOUND, NOT_FOUND, ERROR
+from title_match import extra_clean, average_ratio, origin_keys, use_rapidfuzz
+from title_index import LocalTitleIndex
 
 META_DIR = join("scripts", "metadata")
-TMDB_MOVIE_URL = "https://api.themoviedb.org/3/search/movie?api_key=%s&language=en-US&query=%s&page=1"
-TMDB_TV_URL = "https://api.themoviedb.org/3/search/tv?api_key=%s&language=en-US&query=%s&page=1"
-TMDB_ID_URL = "https://api.themoviedb.org/3/find/%s?api_key=%s&language=en-US&external_source=imdb_id"
-TMDB_MPAA_URL = "https://api.themoviedb.org/3/movie/%s/release_dates?api_key=%s"
+CACHE_FILE = join(META_DIR, "metadata_cache.sqlite")
+JOURNAL_FILE = join(META_DIR, "metadata_journal.jsonl")
+TITLE_INDEX_FILE = join(META_DIR, "title_index.sqlite")
+TMDB_API = "https://api.themoviedb.org/3"
+TMDB_MOVIE_URL = "/search/movie?api_key=%s&language=en-US&query=%s&page=1"
+TMDB_TV_URL = "/search/tv?api_key=%s&language=en-US&query=%s&page=1"
+TMDB_ID_URL = "/find/%s?api_key=%s&language=en-US&external_source=imdb_id"
+TMDB_MPAA_URL = "/movie/%s/release_dates?api_key=%s"
 tmdb_api_key = config.tmdb_api_key
 
-forbidden = ["the", "a", "an", "and", "or", "part",
-             "vol", "chapter", "movie", "transcript"]
-
-metadata = {}
-
-
-def clean_name(name):
-    name = name.lower()
-    # Split by "_"
-    name = " ".join(name.split("_"))
-    # Remove ", The" and ", A"
-    name = name.replace(", the", "")
-    name = name.replace(", a", "")
-    name = re.sub(' +', ' ', name).strip()
-
-    # If name has filmed as or released as, use those names instead
-    alt_name = name.split("filmed as")
-    if len(alt_name) > 1:
-        name = re.sub(r"[\([{})\]]", "", name).split("filmed as")[-1].strip()
-    alt_name = name.split("released as")
-    if len(alt_name) > 1:
-        name = re.sub(r"[\([{})\]]", "", name).split("released as")[-1].strip()
-    # Remove brackets ()
-    name = re.sub(r'\([^)]*\)', '', name)
-    # Remove "Early/Final Pilot TV Script PDF", "Script",
-    # "Transcript", "Pilot", "First Draft"
-    name = name.replace("early pilot", "")
-    name = name.replace("final pilot", "")
-    name = name.replace("transcript", "")
-    name = name.replace("first draft", "")
-    name = name.replace("tv script pdf", "")
-    name = name.replace("pilot", "")
-    name = name.strip()
-
-    return name
-
-
-def average_ratio(n, m):
-    return ((fuzz.token_sort_ratio(n,  m) + fuzz.token_sort_ratio(m,  n)) // 2)
-
-
-def roman_to_int(num):
-    string = num.split()
-    res = []
-    for s in string:
-        if s == "ii":
-            res.append("2")
-        elif s == "iii":
-            res.append("3")
-        elif s == "iv":
-            res.append("4")
-        elif s == "v":
-            res.append("5")
-        elif s == "vi":
-            res.append("6")
-        elif s == "vii":
-            res.append("7")
-        elif s == "viii":
-            res.append("8")
-        elif s == "ix":
-            res.append("9")
-        else:
-            res.append(s)
-    return " ".join(res)
-
-
-def extra_clean(name):
-    name = roman_to_int(clean_name(name)).replace(
-        "the ", "").replace("-", "").replace(":", "").replace("episode", "").replace(".", "")
-    return name
-
-
-def get_tmdb(name, type="movie"):
+# SHARED KEEP-ALIVE CONNECTIONS AND RATE LIMIT FOR ALL METADATA REQUESTS (SET UP BY get_pool)
+HTTP_POOL = None
+# PERSISTENT CACHE OF TMDb AND IMDb RESPONSES (None: EVERY LOOKUP GOES TO THE NETWORK)
+METADATA_CACHE = None
+# JOURNAL OF LOOKUP ATTEMPTS THAT LETS AN INTERRUPTED RUN RESUME (None: NO JOURNAL)
+JOURNAL = None
+# RESPONSES OF THE BATCHED TMDb REQUESTS OF THIS RUN, BY (KIND, KEY), AND THE REQUESTS THEY SAVED
+PLAN_RESPONSES = {}
+PLAN_STATS = {"naive": 0, "sent": 0}
+# TITLES LOOKED UP TOGETHER IN A PASS BEFORE THEIR RESULTS ARE JOURNALED (SEE run_pass)
+PASS_CHUNK = 200
+# LOCAL IMDb TITLE INDEX TRIED BEFORE Cinemagoer (None: NONE), AND WHETHER TO STOP THERE
+LOCAL_INDEX = None
+LOCAL_ONLY = False
+# ONE Cinemagoer INSTANCE PER THREAD
+IMDB_LOCAL = threading.local()
+
+# PROCESS ARGUMENTS
+
+
+def read_args():
+    parser = argparse.ArgumentParser(
+        description='Match the scripts of the included sources to TMDb and IMDb titles and MPAA ratings')
+    parser.add_argument("-w", "--workers", type=int, default=8,
+                        help="Number of titles looked up at a time (and of open connections)")
+    parser.add_argument("-r", "--rate", type=float, default=20,
+                        help="Most requests started per second, kept under TMDb's rate limit")
+    parser.add_argument("-b", "--burst", type=int, default=None,
+                        help="Most requests started at once before the rate limit applies (default: the rate)")
+    parser.add_argument("-u", "--tmdb-url", default=TMDB_API,
+                        help="Base URL of the TMDb API, e.g. a local stub server for testing")
+    parser.add_argument("-c", "--cache", default=CACHE_FILE,
+                        help="SQLite file caching TMDb and IMDb responses between runs")
+    parser.add_argument("-N", "--no-cache", action='store_true',
+                        help="Send every lookup to the network and cache nothing")
+    parser.add_argument("-o", "--offline", action='store_true',
+                        help="Answer lookups only from the cache (including expired entries); titles that are not "
+                             "cached are left unmatched and journaled as errors")
+    parser.add_argument("-t", "--ttl", nargs='+', default=[], metavar="ENDPOINT=DAYS",
+                        help="Days a cached response stays fresh, per endpoint (%s)" % ", ".join(DEFAULT_TTLS))
+    parser.add_argument("-m", "--cache-mb", type=float, default=512,
+                        help="Largest size of the cached responses in MB; the least recently used are evicted")
+    parser.add_argument("-j", "--journal", default=JOURNAL_FILE,
+                        help="Append-only journal of lookup attempts; a rerun resumes from it, skipping titles "
+                             "already resolved and retrying those that failed with an error")
+    parser.add_argument("-R", "--restart", action='store_true',
+                        help="Start a new journal, looking every title up again")
+    parser.add_argument("-k", "--chunk", type=int, default=PASS_CHUNK,
+                        help="Titles planned together and journaled before the next are looked up; an interrupted "
+                             "run loses at most this many lookups")
+    parser.add_argument("-f", "--retry-failed", action='store_true',
+                        help="Also look up again the titles whose last attempt found no match")
+    parser.add_argument("-i", "--title-index", default=TITLE_INDEX_FILE,
+                        help="Local IMDb title index (built by title_index.py) that IMDb searches try first; "
+                             "not used if the file does not exist")
+    parser.add_argument("-L", "--local-only", action='store_true',
+                        help="Leave titles missing from the local title index unmatched instead of searching IMDb")
+    parser.add_argument("-z", "--rapidfuzz", action='store_true',
+                        help="Score titles with rapidfuzz: faster, but its scores differ slightly from fuzzywuzzy's, "
+                             "which can change the names corrected")
+    args = parser.parse_args()
+    if args.local_only and not isfile(args.title_index):
+        raise AssertionError(
+            "Invalid value. Local-only matching needs the title index %s" % args.title_index)
+    if args.workers < 1 or args.rate <= 0 or (args.burst is not None and args.burst < 1) or args.cache_mb <= 0 \
+            or args.chunk < 1:
+        raise AssertionError(
+            "Invalid value. Workers, rate, burst, cache size and chunk size must be positive")
+    if args.offline and args.no_cache:
+        raise AssertionError(
+            "Invalid value. Offline mode needs the cache")
+    ttls = {}
+    for ttl in args.ttl:
+        endpoint, _, days = ttl.partition('=')
+        if endpoint not in DEFAULT_TTLS or not re.match(r'^\d+(\.\d*)?$', days):
+            raise AssertionError(
+                "Invalid value. TTLs are ENDPOINT=DAYS with ENDPOINT one of %s" % ", ".join(DEFAULT_TTLS))
+        ttls[endpoint] = float(days) * DAY
+    cache_file = None if args.no_cache else args.cache
+    title_index = args.title_index if isfile(args.title_index) else None
+    return args.workers, args.rate, args.burst, args.tmdb_url, cache_file, ttls, args.cache_mb, args.offline, \
+        args.journal, args.restart, args.retry_failed, title_index, args.local_only, args.chunk, args.rapidfuzz
+
+
+# THE SHARED HTTP POOL, CREATED WITH DEFAULT LIMITS IF main HAS NOT SET ONE UP
+def get_pool():
+    global HTTP_POOL
+    if HTTP_POOL is None:
+        HTTP_POOL = HttpPool()
+    return HTTP_POOL
+
+
+# RESPONSE TO A REQUEST, FROM THE CACHE IF IT HOLDS ONE, ELSE fetch(*args) (STORED IN THE CACHE)
+# RAISES CacheMiss IN OFFLINE MODE FOR A REQUEST THAT IS NOT CACHED
+def cached_fetch(endpoint, key, fetch, *args):
+    if METADATA_CACHE is None:
+        return fetch(*args)
+    return METADATA_CACHE.fetch(endpoint, key, fetch, *args)
+
+
+# JSON RESPONSE OF A TMDb URL
+def fetch_tmdb(endpoint, url):
+    return cached_fetch(endpoint, normalize_url(url), get_pool().get_json, url)
+
+
+# THIS THREAD'S Cinemagoer INSTANCE
+def get_ia():
+    if not hasattr(IMDB_LOCAL, 'ia'):
+        IMDB_LOCAL.ia = imdb.Cinemagoer()
+    return IMDB_LOCAL.ia
+
+
+# FIRST TMDb SEARCH MATCH FOR name, WITHOUT ITS RATING ({} IF NONE)
+def search_tmdb(name, type="movie"):
     if type == "movie":
         base_url = TMDB_MOVIE_URL
         date = "release_date"
@@ -108,22 +154,18 @@ def get_tmdb(name, type="movie"):
         date = "first_air_date"
         title = "name"
 
-    url = base_url % (tmdb_api_key, urllib.parse.quote(name))
-    response = urllib.request.urlopen(url)
-    res_data = response.read()
-    jres = json.loads(res_data)
+    url = TMDB_API + base_url % (tmdb_api_key, urllib.parse.quote(name))
+    jres = fetch_tmdb("search_" + type, url)
 
     if 'total_results' in jres:
         if jres['total_results'] > 0:
             movie = jres['results'][0]
             if title in movie and date in movie and "id" in movie and "overview" in movie:
-                mpaa = get_release_dates_by_id(movie["id"])
                 return {
                     "title": unidecode(movie[title]),
 #                    "release_date": movie[date],
                     "id": movie["id"],
 #                    "overview": unidecode(movie["overview"]),
-                    "mpaa": mpaa
                 }
             else:
                 return {}
@@ -133,12 +175,21 @@ def get_tmdb(name, type="movie"):
         return {}
 
 
-def get_tmdb_from_id(id):
+# TMDb MATCH WITH ITS RATING
+def with_mpaa(movie, mpaa):
+    return {"title": movie["title"], "id": movie["id"], "mpaa": mpaa} if movie else {}
+
+
+def get_tmdb(name, type="movie"):
+    movie = search_tmdb(name, type)
+    return with_mpaa(movie, get_release_dates_by_id(movie["id"])) if movie else {}
+
 
-    url = TMDB_ID_URL % (id, tmdb_api_key)
-    response = urllib.request.urlopen(url)
-    res_data = response.read()
-    jres = json.loads(res_data)
+# TMDb MATCH FOR AN IMDb ID, WITHOUT ITS RATING ({} IF NONE)
+def find_tmdb(id):
+
+    url = TMDB_API + TMDB_ID_URL % (id, tmdb_api_key)
+    jres = fetch_tmdb("find", url)
 
     if len(jres['movie_results']) > 0:
         results = 'movie_results'
@@ -153,245 +204,426 @@ def get_tmdb_from_id(id):
 
     movie = jres[results][0]
     if title in movie and date in movie and "id" in movie and "overview" in movie:
-        mpaa = get_release_dates_by_id(movie["id"])
         return {
             "title": unidecode(movie[title]),
 #            "release_date": movie[date],
             "id": movie["id"],
 #            "overview": unidecode(movie["overview"]),
-            "mpaa": mpaa
         }
     else:
         print("Unable to fetch TMDB with IMDb")
         return {}
 
 
+def get_tmdb_from_id(id):
+    movie = find_tmdb(id)
+    return with_mpaa(movie, get_release_dates_by_id(movie["id"])) if movie else {}
+
+
 # MPAA fetch function
+# A FAILED REQUEST (OR, OFFLINE, ONE THAT IS NOT CACHED) RAISES, SO THE TITLE IS RECORDED AS AN ERROR AND
+# LOOKED UP AGAIN ON THE NEXT RUN INSTEAD OF BEING KEPT WITHOUT A RATING
 def get_release_dates_by_id(id):
-    url = TMDB_MPAA_URL % (id, tmdb_api_key)
-    try:
-        response = urllib.request.urlopen(url)
-        res_data = response.read()
-        jres = json.loads(res_data)
-
-        if 'results' in jres:
-            for country in jres['results']:
-                if country.get('iso_3166_1') == 'US':
-                    for release in country.get('release_dates', []):
-                        return {
-                            release.get('certification', '')
-                        }
-        else:
-            print("No MPAA Data")
-            return {}   
-    except urllib.error.HTTPError as e:
-        print("MPAA URL Failure", id)
-        return ''
-    except Exception as e:
-        print("MPAA Error")
-        return ''
-
-def get_imdb(name):
-    try:
-        movies = ia.search_movie(name)
-        if len(movies) > 0:
-            movie_id = movies[0].movieID
-            movie = movies[0]
-
-#            if 'year' in movie:
-#                release_date = movie['year']
-#            else:
-#                print("Field missing in response")
-#                return {}
-
-            return {
-                "title": unidecode(movie['title']),
-#                "release_date": release_date,
-                "id": movie_id,
-            }
-        else:
-            return {}
-    except Exception as err:
-        print("Unable to fetch IMDb")
+    url = TMDB_API + TMDB_MPAA_URL % (id, tmdb_api_key)
+    jres = fetch_tmdb("release_dates", url)
+
+    if 'results' in jres:
+        for country in jres['results']:
+            if country.get('iso_3166_1') == 'US':
+                for release in country.get('release_dates', []):
+                    return {
+                        release.get('certification', '')
+                    }
+    else:
+        print("No MPAA Data")
         return {}
 
+# FIRST IMDb SEARCH HIT FOR name (THE ONLY ONE USED) AS [{"id", "title"}], OR []
+def search_imdb(name):
+    movies = get_pool().call(get_ia().search_movie, name)
+    return [{"id": x.movieID, "title": x['title']} for x in movies[:1]]
 
-for source in data:
-    included = data[source]
-    meta_file = join(META_DIR, source + ".json")
-    if included == "true" and isfile(meta_file):
-        with open(meta_file) as json_file:
-            source_meta = json.load(json_file)
-            metadata[source] = source_meta
-
-unique = []
-origin = {}
-for source in metadata:
-    DIR = join("scripts", "unprocessed", source)
-    files = [join(DIR, f) for f in listdir(DIR) if isfile(
-        join(DIR, f)) and getsize(join(DIR, f)) > 3000]
-
-    source_meta = metadata[source]
-    for script in source_meta:
-        name = re.sub(r'\([^)]*\)', '', script.strip()).lower()
-        name = " ".join(name.split('-'))
-        name = re.sub(r'['+string.punctuation+']', ' ', name)
-        name = re.sub(' +', ' ', name).strip()
-        name = name.split()
-        name = " ".join(list(filter(lambda a: a not in forbidden, name)))
-        name = "".join(name.split())
-        name = roman_to_int(name)
-        name = unidecode(name)
-        unique.append(name)
-        if name not in origin:
-            origin[name] = {"files": []}
-        curr_script = metadata[source][script]
-        curr_file = join("scripts", "unprocessed", source,
-                         curr_script["file_name"] + ".txt")
-
-        if curr_file in files:
-            origin[name]["files"].append({
-                "name": unidecode(script),
-                "source": source,
-                "file_name": curr_script["file_name"],
-                "script_url": curr_script["script_url"],
-                "size": getsize(curr_file)
-            })
-
-        else:
-            origin.pop(name)
 
-final = sorted(list(set(unique)))
-print(len(final))
+# IMDb ERRORS (AND, OFFLINE, SEARCHES THAT ARE NOT CACHED) RAISE, SO THEY ARE NOT MISTAKEN FOR TITLES WITHOUT A MATCH
+# THE LOCAL INDEX IS TRIED FOR AN EXACT MATCH FIRST, AND FOR A FUZZY ONE ONLY IF IMDb SEARCH FINDS NOTHING EITHER
+def get_imdb(name):
+    movies = LOCAL_INDEX.search(name, 1) if LOCAL_INDEX is not None else []
+    if not movies and not LOCAL_ONLY:
+        movies = cached_fetch("imdb_search", normalize_query(name), search_imdb, name)
+    if not movies and LOCAL_INDEX is not None:
+        movies = LOCAL_INDEX.search_fuzzy(name, 1)
+    if len(movies) > 0:
+        movie_id = movies[0]["id"]
+        movie = movies[0]
+
+#        if 'year' in movie:
+#            release_date = movie['year']
+#        else:
+#            print("Field missing in response")
+#            return {}
 
-count = 0
+        return {
+            "title": unidecode(movie['title']),
+#            "release_date": release_date,
+            "id": movie_id,
+        }
+    else:
+        return {}
 
-print("Get metadata from TMDb")
 
-for script in tqdm(origin):
-    # Use original name
-    name = origin[script]["files"][0]["name"]
+# TMDb LOOKUP FOR ONE TITLE: THE RAW NAME, THEN THE extra_clean NAME, THEN A TV SEARCH
+# RETURNS THE MATCH ({} IF NONE) AND THE LAST NAME TRIED
+def lookup_tmdb(name):
     movie_data = get_tmdb(name)
-
     if movie_data:
-        origin[script]["tmdb"] = movie_data
-
-    else:
-        # Try with cleaned name
-        name = extra_clean(name)
-        movie_data = get_tmdb(name)
-
-        if movie_data:
-            origin[script]["tmdb"] = movie_data
-
-        else:
-            # Try with TV search
-            tv_data = get_tmdb(name, "tv")
-
-            if tv_data:
-                origin[script]["tmdb"] = tv_data
-
-            else:
-                print(name)
-                count += 1
-
-print(count)
+        return movie_data, name
+    # Try with cleaned name
+    name = extra_clean(name)
+    movie_data = get_tmdb(name)
+    if movie_data:
+        return movie_data, name
+    # Try with TV search
+    return get_tmdb(name, "tv"), name
 
-print("Get metadata from IMDb")
 
-count = 0
-for script in tqdm(origin):
-    name = origin[script]["files"][0]["name"]
+# IMDb LOOKUP FOR ONE TITLE: THE RAW NAME, THEN THE extra_clean NAME
+def lookup_imdb(name):
     movie_data = get_imdb(name)
-
     if not movie_data:
         name = extra_clean(name)
         movie_data = get_imdb(name)
+    return movie_data, name
+
+
+# CROSS-CHECK THE TMDb AND IMDb MATCHES OF ONE TITLE AGAINST ITS FILE NAME, RE-FETCHING THE ONE THAT DISAGREES
+# RETURNS THE CORRECTED MATCHES AND THE MESSAGES FOR LOOKUPS THAT FAILED
+def correct_names(entry):
+    updates = {}
+    failures = []
+    imdb_name = extra_clean(unidecode(entry["imdb"]["title"]))
+    tmdb_name = extra_clean(unidecode(entry["tmdb"]["title"]))
+    file_name = extra_clean(entry["files"][0]["name"])
+    if imdb_name == tmdb_name:
+        return updates, failures
+    tmdb_ratio = average_ratio(file_name, tmdb_name)
+    imdb_ratio = average_ratio(file_name, imdb_name)
+
+    if tmdb_ratio < 85 and imdb_ratio > 85:
+        imdb_id = "tt" + entry["imdb"]["id"]
+        movie_data = get_tmdb_from_id(imdb_id)
+        if movie_data:
+            updates["tmdb"] = movie_data
+        else:
+            failures.append("%s %s" % (entry["imdb"]["title"], imdb_id))
 
-        if not movie_data:
-            print(name)
-            count += 1
+    if tmdb_ratio > 85 and imdb_ratio < 85:
+        movie_data, name = lookup_imdb(entry["tmdb"]["title"])
+        if movie_data:
+            updates["imdb"] = movie_data
         else:
-            origin[script]["imdb"] = movie_data
-    else:
-        origin[script]["imdb"] = movie_data
+            failures.append(name)
 
+    return updates, failures
 
-print(count)
 
-# Use IMDb id to search TMDb
-count = 0
-print("Use IMDb id to search TMDb")
+# ONE LOOKUP, RETURNING THE RESULT AND None, OR None AND THE ERROR IF IT FAILED
+def attempt(func, arg):
+    try:
+        return func(arg), None
+    except Exception as err:
+        return None, "%s: %s" % (type(err).__name__, err)
+
+
+# BATCH LOOKUP FROM A PER-TITLE ONE: attempt(func, arg) FOR EACH ARG ON THE SHARED POOL
+def per_title(func):
+    return lambda args: get_pool().map(lambda x: attempt(func, x), args)
+
+
+# SEND EVERY DISTINCT REQUEST OF ONE KIND THAT THIS RUN HAS NOT ALREADY SENT, ON THE SHARED POOL
+# items ARE (key, arg) PAIRS: ITEMS WITH THE SAME key ARE ONE REQUEST, SENT AS attempt(func, arg)
+# RETURNS THE (response, error) OF EACH ITEM
+def run_batch(kind, items, func):
+    todo = {}
+    for key, arg in items:
+        if (kind, key) not in PLAN_RESPONSES and key not in todo:
+            todo[key] = arg
+    keys = list(todo)
+    for key, response in zip(keys, get_pool().map(lambda x: attempt(func, x), [todo[k] for k in keys])):
+        PLAN_RESPONSES[(kind, key)] = response
+    PLAN_STATS["sent"] += len(keys)
+    return [PLAN_RESPONSES[(kind, key)] for key, arg in items]
+
+
+# RATINGS OF THE TMDb MATCHES OF MANY TITLES, ONE release_dates REQUEST PER DISTINCT ID
+# RETURNS THE MATCHES WITH THEIR RATINGS AND, PER TITLE, THE ERROR OF ITS RATING REQUEST (OR None)
+def plan_mpaa(movies):
+    matched = [i for i, movie in enumerate(movies) if movie]
+    ratings = run_batch("release_dates", [(movies[i]["id"], movies[i]["id"]) for i in matched],
+                        get_release_dates_by_id)
+    PLAN_STATS["naive"] += len(matched)
+    movies = list(movies)
+    errors = [None for x in movies]
+    for i, (mpaa, error) in zip(matched, ratings):
+        if error is not None:
+            errors[i] = error
+        else:
+            movies[i] = with_mpaa(movies[i], mpaa)
+    return movies, errors
+
+
+# lookup_tmdb FOR MANY TITLES AT ONCE: EACH STEP OF THE FALLBACK CHAIN (RAW NAME, extra_clean NAME, TV SEARCH)
+# SENDS THE DISTINCT SEARCHES OF ALL TITLES STILL UNMATCHED AT ONCE (SEARCHES DIFFERING ONLY IN CASE OR SPACING
+# ARE ONE SEARCH), THEN THE RATINGS OF ALL MATCHES ARE FETCHED ONCE PER DISTINCT ID
+# RETURNS (result, error) PER TITLE, AS attempt(lookup_tmdb, name) WOULD
+def plan_tmdb(names):
+    movies = [{} for x in names]
+    errors = [None for x in names]
+    tried = list(names)
+    pending = list(range(len(names)))
+    for type, clean in [("movie", False), ("movie", True), ("tv", False)]:
+        if clean:
+            for i in pending:
+                tried[i] = extra_clean(names[i])
+        responses = run_batch("search_" + type, [(normalize_query(tried[i]), tried[i]) for i in pending],
+                              lambda x: search_tmdb(x, type))
+        unmatched = []
+        for i, (movie, error) in zip(pending, responses):
+            PLAN_STATS["naive"] += 1
+            if error is not None:
+                errors[i] = error
+            elif movie:
+                movies[i] = movie
+            else:
+                unmatched.append(i)
+        pending = unmatched
+
+    movies, mpaa_errors = plan_mpaa(movies)
+    errors = [x if x is not None else y for x, y in zip(errors, mpaa_errors)]
+    return [(None, errors[i]) if errors[i] is not None else ((movies[i], tried[i]), None) for i in range(len(names))]
+
+
+# get_tmdb_from_id FOR MANY IMDb IDS AT ONCE, ONE find AND ONE release_dates REQUEST PER DISTINCT ID
+def plan_tmdb_ids(imdb_ids):
+    responses = run_batch("find", [(x, x) for x in imdb_ids], find_tmdb)
+    PLAN_STATS["naive"] += len(imdb_ids)
+    movies, mpaa_errors = plan_mpaa([movie if error is None else {} for movie, error in responses])
+    errors = [error if error is not None else mpaa_error for (_, error), mpaa_error in zip(responses, mpaa_errors)]
+    return [(None, error) if error is not None else (movie, None) for movie, error in zip(movies, errors)]
+
+
+# RUN ONE PASS, WITH A PROGRESS BAR: lookup(args) FOR EVERY TITLE THE JOURNAL HAS NOT ALREADY RESOLVED FOR THE
+# SAME query, RECORDING EACH ATTEMPT AS FOUND OR NOT (BY found(result)) OR AS AN ERROR
+# lookup TAKES THE LIST OF ARGS AND GIVES A (result, error) PAIR FOR EACH (SEE per_title); IT IS CALLED ON
+# PASS_CHUNK TITLES AT A TIME, AND EACH CHUNK IS JOURNALED (AND SYNCED) BEFORE THE NEXT ONE IS LOOKED UP, SO A
+# CRASH OR BAN LOSES AT MOST ONE CHUNK OF LOOKUPS
+# RETURNS (script, result) IN TITLE ORDER, WITH result None FOR LOOKUPS THAT FAILED WITH AN ERROR
+def run_pass(pass_name, scripts, queries, lookup, found, args=None):
+    args = queries if args is None else args
+    results = {}
+    todo = []
+    for script, query, arg in zip(scripts, queries, args):
+        entry = JOURNAL.resolved(pass_name, script, query) if JOURNAL is not None else None
+        if entry is None:
+            todo.append((script, query, arg))
+        else:
+            results[script] = entry["result"]
+
+    with tqdm(total=len(todo)) as progress:
+        for start in range(0, len(todo), PASS_CHUNK):
+            chunk = todo[start:start + PASS_CHUNK]
+            for (script, query, arg), (result, error) in zip(chunk, lookup([x[2] for x in chunk])):
+                if error is not None:
+                    print(script, error)
+                if JOURNAL is not None:
+                    if error is not None:
+                        JOURNAL.record(pass_name, script, query, ERROR, error=error)
+                    else:
+                        JOURNAL.record(pass_name, script, query, FOUND if found(result) else NOT_FOUND,
+                                       convert_sets_to_lists(result))
+                results[script] = result
+                progress.update()
+            if JOURNAL is not None:
+                JOURNAL.sync()
+
+    return [(script, results[script]) for script in scripts]
+
+
+# LOAD THE METADATA OF EVERY INCLUDED SOURCE
+def load_metadata(sources_file='sources.json'):
+    metadata = {}
+    f = open(sources_file, 'r')
+    data = json.load(f)
+    for source in data:
+        included = data[source]
+        meta_file = join(META_DIR, source + ".json")
+        if included == "true" and isfile(meta_file):
+            with open(meta_file) as json_file:
+                source_meta = json.load(json_file)
+                metadata[source] = source_meta
+    return metadata
+
+
+# GROUP THE SCRIPTS OF ALL SOURCES BY NORMALISED TITLE, KEEPING TITLES WHOSE FILES ARE ALL PRESENT
+# RETURNS THE TITLES AND THE LIST OF NORMALISED NAMES OF EVERY SCRIPT
+def build_origin(metadata):
+    unique = []
+    origin = {}
+    for source in metadata:
+        DIR = join("scripts", "unprocessed", source)
+        # SIZE OF EACH KEPT FILE, LOOKED UP BY PATH
+        files = {}
+        for f in listdir(DIR):
+            if isfile(join(DIR, f)) and getsize(join(DIR, f)) > 3000:
+                files[join(DIR, f)] = getsize(join(DIR, f))
+
+        source_meta = metadata[source]
+        for script, name in zip(source_meta, origin_keys(list(source_meta))):
+            unique.append(name)
+            if name not in origin:
+                origin[name] = {"files": []}
+            curr_script = metadata[source][script]
+            curr_file = join("scripts", "unprocessed", source,
+                             curr_script["file_name"] + ".txt")
+
+            if curr_file in files:
+                origin[name]["files"].append({
+                    "name": unidecode(script),
+                    "source": source,
+                    "file_name": curr_script["file_name"],
+                    "script_url": curr_script["script_url"],
+                    "size": files[curr_file]
+                })
 
-for script in tqdm(origin):
-    if "imdb" in origin[script] and "tmdb" not in origin[script]:
-        # print(origin[script]["files"][0]["name"])
-        imdb_id = "tt" + origin[script]["imdb"]["id"]
-        movie_data = get_tmdb_from_id(imdb_id)
-        if movie_data:
-            origin[script]["tmdb"] = movie_data
+            else:
+                origin.pop(name)
+    return origin, unique
 
-        else:
-            print(origin[script]["imdb"]["title"], imdb_id)
-            count += 1
 
 def convert_sets_to_lists(data):
     if isinstance(data, dict):
         return {k: convert_sets_to_lists(v) for k, v in data.items()}
-    elif isinstance(data, list):
+    elif isinstance(data, (list, tuple)):
         return [convert_sets_to_lists(i) for i in data]
     elif isinstance(data, set):
         return list(data)
     else:
         return data
 
-# Convert sets to lists in the origin dictionary
-originconv = convert_sets_to_lists(origin)
 
-with open(join(META_DIR, "clean_meta.json"), "w") as outfile:
-    json.dump(originconv, outfile, indent=4)
+def write_meta(origin):
+    # Convert sets to lists in the origin dictionary
+    originconv = convert_sets_to_lists(origin)
 
-print(count)
+    with open(join(META_DIR, "clean_meta.json"), "w") as outfile:
+        json.dump(originconv, outfile, indent=4)
 
-count = 0
-print("Identify and correct names")
 
-for script in tqdm(origin):
-    if "imdb" in origin[script] and "tmdb" in origin[script]:
-        imdb_name = extra_clean(unidecode(origin[script]["imdb"]["title"]))
-        tmdb_name = extra_clean(unidecode(origin[script]["tmdb"]["title"]))
-        file_name = extra_clean(origin[script]["files"][0]["name"])
+# MAIN FUNCTION
+if __name__ == "__main__":
+    num_workers, rate, burst, TMDB_API, cache_file, ttls, cache_mb, offline, journal_file, restart, \
+        retry_failed, title_index, LOCAL_ONLY, PASS_CHUNK, rapidfuzz = read_args()
+    use_rapidfuzz(rapidfuzz)
+    if title_index is not None:
+        LOCAL_INDEX = LocalTitleIndex(title_index)
+    HTTP_POOL = HttpPool(num_workers, rate, burst)
+    if cache_file is not None:
+        METADATA_CACHE = ResponseCache(cache_file, ttls, int(cache_mb * (1 << 20)), offline)
+    JOURNAL = MetadataJournal(journal_file, restart, retry_failed)
 
-        if imdb_name != tmdb_name and average_ratio(file_name, tmdb_name) < 85 and average_ratio(file_name, imdb_name) > 85:
-            imdb_id = "tt" + origin[script]["imdb"]["id"]
-            movie_data = get_tmdb_from_id(imdb_id)
-            if movie_data:
-                origin[script]["tmdb"] = movie_data
+    metadata = load_metadata()
+    origin, unique = build_origin(metadata)
 
-            else:
-                print(origin[script]["imdb"]["title"], imdb_id)
-                count += 1
+    final = sorted(list(set(unique)))
+    print(len(final))
 
-        if imdb_name != tmdb_name and average_ratio(file_name, tmdb_name) > 85 and average_ratio(file_name, imdb_name) < 85:
-            name = origin[script]["tmdb"]["title"]
-            movie_data = get_imdb(name)
+    count = 0
 
-            if not movie_data:
-                name = extra_clean(name)
-                movie_data = get_imdb(name)
+    print("Get metadata from TMDb")
 
-                if not movie_data:
-                    print(name)
-                    count += 1
-                else:
-                    origin[script]["imdb"] = movie_data
-            else:
-                origin[script]["imdb"] = movie_data
+    scripts = list(origin)
+    names = [origin[script]["files"][0]["name"] for script in scripts]
+    for script, result in run_pass("tmdb", scripts, names, plan_tmdb, lambda x: bool(x[0])):
+        if result is None:
+            count += 1
+            continue
+        movie_data, name = result
+        if movie_data:
+            origin[script]["tmdb"] = movie_data
+        else:
+            print(name)
+            count += 1
+
+    print(count)
 
+    print("Get metadata from IMDb")
 
-print(count)
+    count = 0
+    for script, result in run_pass("imdb", scripts, names, per_title(lookup_imdb), lambda x: bool(x[0])):
+        if result is None:
+            count += 1
+            continue
+        movie_data, name = result
+        if movie_data:
+            origin[script]["imdb"] = movie_data
+        else:
+            print(name)
+            count += 1
 
-originconv = convert_sets_to_lists(origin)
+    print(count)
 
-with open(join(META_DIR, "clean_meta.json"), "w") as outfile:
-    json.dump(originconv, outfile, indent=4)
+    # Use IMDb id to search TMDb
+    count = 0
+    print("Use IMDb id to search TMDb")
+
+    scripts = [x for x in origin if "imdb" in origin[x] and "tmdb" not in origin[x]]
+    imdb_ids = ["tt" + origin[script]["imdb"]["id"] for script in scripts]
+    results = run_pass("tmdb_id", scripts, imdb_ids, plan_tmdb_ids, bool)
+    for imdb_id, (script, movie_data) in zip(imdb_ids, results):
+        if movie_data:
+            origin[script]["tmdb"] = movie_data
+        else:
+            if movie_data is not None:
+                print(origin[script]["imdb"]["title"], imdb_id)
+            count += 1
+
+    write_meta(origin)
+
+    print(count)
+
+    count = 0
+    print("Identify and correct names")
+
+    scripts = [x for x in origin if "imdb" in origin[x] and "tmdb" in origin[x]]
+    queries = [[origin[x]["imdb"]["id"], origin[x]["tmdb"]["id"], origin[x]["files"][0]["name"]] for x in scripts]
+    for script, result in run_pass("correct", scripts, queries, per_title(correct_names), lambda x: not x[1],
+                                   [origin[x] for x in scripts]):
+        if result is None:
+            count += 1
+            continue
+        updates, failures = result
+        origin[script].update(updates)
+        for failure in failures:
+            print(failure)
+        count += len(failures)
+
+    print(count)
+
+    write_meta(origin)
+    HTTP_POOL.close()
+    JOURNAL.close()
+
+    print("%d requests over %d connections, %d retried" %
+          (HTTP_POOL.stats["requests"], HTTP_POOL.stats["connections"], HTTP_POOL.stats["retries"]))
+    print("TMDb: %d searches and rating requests planned instead of %d one title at a time (%d saved)" %
+          (PLAN_STATS["sent"], PLAN_STATS["naive"], PLAN_STATS["naive"] - PLAN_STATS["sent"]))
+    print("journal: %d lookups resumed, %d attempted, %d failed with an error" %
+          (JOURNAL.stats["resumed"], JOURNAL.stats["attempted"], JOURNAL.stats["errors"]))
+    if LOCAL_INDEX is not None:
+        print("title index: %d IMDb searches answered locally, %d not found  |  fuzzy fallback: %d matched, "
+              "%d not" % (LOCAL_INDEX.stats["found"], LOCAL_INDEX.stats["missing"], LOCAL_INDEX.stats["fuzzy"],
+                          LOCAL_INDEX.stats["fuzzy_missing"]))
+    if METADATA_CACHE is not None:
+        print("cache: %d hits (%d expired, offline), %d fetched, %d not cached, %d evicted" %
+              (METADATA_CACHE.stats["hits"], METADATA_CACHE.stats["stale_hits"], METADATA_CACHE.stats["fetched"],
+               METADATA_CACHE.stats["missing"], METADATA_CACHE.stats["evicted"]))
+        METADATA_CACHE.close()
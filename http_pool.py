@@ -0,0 +1,154 @@
+import base64
+import http.client
+import json
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor
+
+# STATUS CODES WORTH RETRYING: RATE LIMITED, OR A PASSING SERVER ERROR
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+
+# TOKEN BUCKET: UP TO burst REQUESTS AT ONCE, REFILLED AT rate REQUESTS PER SECOND
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    # WAIT UNTIL A TOKEN IS AVAILABLE AND TAKE IT
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# KEEP-ALIVE HTTP(S) CONNECTIONS SHARED BY A POOL OF THREADS
+# AT MOST max_connections REQUESTS ARE IN FLIGHT AND REQUESTS START AT NO MORE THAN rate PER SECOND;
+# RATE-LIMITED (429) AND SERVER ERROR RESPONSES ARE RETRIED, HONOURING Retry-After
+# PROXIES ARE TAKEN FROM THE ENVIRONMENT (HTTP_PROXY, HTTPS_PROXY, NO_PROXY) AS urlopen TAKES THEM:
+# HTTPS IS TUNNELLED THROUGH THE PROXY WITH CONNECT, PLAIN HTTP IS SENT TO IT WITH ABSOLUTE URLS
+class HttpPool:
+    def __init__(self, max_connections=8, rate=20, burst=None, timeout=30, retries=3, proxies=None):
+        self.max_connections = max_connections
+        self.bucket = TokenBucket(rate, burst if burst is not None else rate)
+        self.slots = threading.BoundedSemaphore(max_connections)
+        self.timeout = timeout
+        self.retries = retries
+        self.local = threading.local()
+        self.stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "connections": 0, "retries": 0}
+        self.executor = None
+        self.proxies = urllib.request.getproxies() if proxies is None else proxies
+
+    # PROXY URL FOR REQUESTS TO scheme://netloc AS urlsplit PARTS, OR None TO CONNECT DIRECTLY
+    def get_proxy(self, scheme, netloc):
+        proxy = self.proxies.get(scheme)
+        if not proxy or urllib.request.proxy_bypass(urllib.parse.urlsplit('//' + netloc).hostname or netloc):
+            return None
+        return urllib.parse.urlsplit(proxy if '://' in proxy else 'http://' + proxy)
+
+    # THIS THREAD'S OPEN CONNECTION TO scheme://netloc, OPENED IF NEEDED (THROUGH THE PROXY, IF ANY)
+    # RETURNS THE CONNECTION, WHETHER REQUESTS ON IT NEED THE ABSOLUTE URL, AND EXTRA REQUEST HEADERS
+    def get_connection(self, scheme, netloc):
+        connections = getattr(self.local, 'connections', None)
+        if connections is None:
+            connections = self.local.connections = {}
+        if (scheme, netloc) not in connections:
+            conn_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            proxy = self.get_proxy(scheme, netloc)
+            if proxy is None:
+                connections[(scheme, netloc)] = (conn_class(netloc, timeout=self.timeout), False, {})
+            else:
+                headers = {}
+                if proxy.username is not None:
+                    credentials = '%s:%s' % (urllib.parse.unquote(proxy.username),
+                                             urllib.parse.unquote(proxy.password or ''))
+                    headers['Proxy-Authorization'] = 'Basic ' + base64.b64encode(credentials.encode()).decode()
+                conn = conn_class(proxy.hostname, proxy.port or 80, timeout=self.timeout)
+                if scheme == 'https':
+                    conn.set_tunnel(netloc, headers=headers)
+                    connections[(scheme, netloc)] = (conn, False, {})
+                else:
+                    connections[(scheme, netloc)] = (conn, True, headers)
+            self.count("connections")
+        return connections[(scheme, netloc)]
+
+    # DROP THIS THREAD'S CONNECTION TO scheme://netloc AFTER AN ERROR
+    def drop_connection(self, scheme, netloc):
+        conn = self.local.connections.pop((scheme, netloc), None)
+        if conn is not None:
+            conn[0].close()
+
+    def count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    # GET url AND RETURN THE BODY; RAISES urllib.error.HTTPError FOR ERROR RESPONSES, AS urlopen DOES
+    def get(self, url):
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            with self.slots:
+                self.count("requests")
+                conn, absolute, headers = self.get_connection(parts.scheme, parts.netloc)
+                try:
+                    conn.request('GET', url if absolute else path,
+                                 headers=dict(headers, **{'Connection': 'keep-alive', 'Accept': 'application/json'}))
+                    response = conn.getresponse()
+                    body = response.read()
+                except (http.client.HTTPException, OSError):
+                    # STALE KEEP-ALIVE CONNECTION OR NETWORK ERROR: RECONNECT AND RETRY
+                    self.drop_connection(parts.scheme, parts.netloc)
+                    if attempt == self.retries:
+                        raise
+                    self.count("retries")
+                    continue
+                if response.getheader('Connection', '').lower() == 'close':
+                    self.drop_connection(parts.scheme, parts.netloc)
+            if response.status < 400:
+                return body
+            if response.status in RETRY_STATUS and attempt < self.retries:
+                self.count("retries")
+                retry_after = response.getheader('Retry-After')
+                time.sleep(float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt)
+                continue
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.msg, None)
+
+    # GET url AND PARSE THE JSON BODY
+    def get_json(self, url):
+        return json.loads(self.get(url))
+
+    # RUN func(*args) UNDER THE SAME RATE AND CONCURRENCY LIMITS, FOR CLIENTS THAT MAKE THEIR OWN REQUESTS
+    def call(self, func, *args):
+        self.bucket.acquire()
+        with self.slots:
+            self.count("requests")
+            return func(*args)
+
+    # RUN func OVER items ON max_connections THREADS, YIELDING RESULTS IN ITEM ORDER
+    # THE THREADS (AND SO THEIR OPEN CONNECTIONS) ARE KEPT FOR LATER CALLS UNTIL close
+    def map(self, func, items):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_connections)
+        return self.executor.map(func, items)
+
+    # STOP THE THREADS; THEIR CONNECTIONS CLOSE WITH THEM
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
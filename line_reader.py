@@ -0,0 +1,87 @@
+import codecs
+import locale
+import mmap
+
+from contextlib import contextmanager
+
+# LINE BREAKS RECOGNISED BY str.splitlines
+SPLITLINES_BREAKS = '\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029'
+# HOW MUCH OF A MAPPED FILE IS READ BEFORE ITS PAGES ARE RELEASED
+RELEASE_BYTES = 1 << 22
+
+
+# MEMORY-MAP A FILE READ-ONLY; EMPTY FILES (WHICH CANNOT BE MAPPED) GIVE b''
+@contextmanager
+def map_file(file_path):
+    with open(file_path, 'rb') as fid:
+        try:
+            view = mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            yield b''
+            return
+        try:
+            if hasattr(view, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                view.madvise(mmap.MADV_SEQUENTIAL)
+            yield view
+        finally:
+            view.close()
+
+
+# ITERATE OVER THE b'\n'-TERMINATED CHUNKS OF A MAPPED FILE (THE LAST ONE MAY LACK THE b'\n')
+# NO UTF-8 SEQUENCE CONTAINS THE BYTE b'\n', SO EACH CHUNK DECODES ON ITS OWN
+# PAGES ALREADY READ ARE HANDED BACK EVERY RELEASE_BYTES SO THEY DO NOT ADD UP IN THE RESIDENT SET
+def iter_chunks(view):
+    pos = 0
+    released = 0
+    size = len(view)
+    can_release = hasattr(view, 'madvise') and hasattr(mmap, 'MADV_DONTNEED')
+    while pos < size:
+        end = view.find(b'\n', pos)
+        end = size if end == -1 else end + 1
+        yield view[pos:end]
+        pos = end
+        if can_release and pos - released >= RELEASE_BYTES:
+            release_end = pos - pos % mmap.PAGESIZE
+            view.madvise(mmap.MADV_DONTNEED, released, release_end - released)
+            released = release_end
+
+
+# LINES OF A TEXT FILE WITHOUT LINE ENDINGS, AS open(file_path, 'r', errors=errors).read().split('\n')
+# WOULD GIVE THEM (UNIVERSAL NEWLINES), BUT DECODED ONE LINE AT A TIME FROM A MEMORY MAP
+# encoding DEFAULTS TO THE LOCALE ENCODING, AS open() DOES
+def read_lines(file_path, encoding=None, errors='strict'):
+    if encoding is None:
+        encoding = locale.getpreferredencoding(False)
+    with map_file(file_path) as view:
+        ends_with_break = False
+        for chunk in iter_chunks(view):
+            line = chunk.decode(encoding, errors)
+            if line.endswith('\n'):
+                line = line[:-2] if line.endswith('\r\n') else line[:-1]
+                ends_with_break = True
+            else:
+                ends_with_break = line.endswith('\r')
+                if ends_with_break:
+                    line = line[:-1]
+            yield from line.split('\r')
+        if ends_with_break or len(view) == 0:
+            yield ''
+
+
+# LINES OF A TEXT FILE AS str.splitlines GIVES THEM FOR THE WHOLE DECODED TEXT (NO NEWLINE TRANSLATION),
+# EACH WITH THE CHARACTER POSITION WHERE IT STARTS IN THAT TEXT, DECODED ONE LINE AT A TIME FROM A MEMORY MAP
+# AS WITH codecs.open(...).read(), AN INCOMPLETE CHARACTER AT THE VERY END OF THE FILE IS LEFT OUT
+def read_split_lines(file_path, encoding='utf-8', errors='strict'):
+    decoder = codecs.getincrementaldecoder(encoding)(errors)
+    with map_file(file_path) as view:
+        char_pos = 0
+        for chunk in iter_chunks(view):
+            text = decoder.decode(chunk)
+            for line in text.splitlines(True):
+                if line.endswith('\r\n'):
+                    yield line[:-2], char_pos
+                elif line[-1:] and line[-1] in SPLITLINES_BREAKS:
+                    yield line[:-1], char_pos
+                else:
+                    yield line, char_pos
+                char_pos += len(line)
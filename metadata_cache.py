@@ -0,0 +1,123 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+DAY = 24 * 3600
+# HOW LONG A CACHED RESPONSE OF EACH ENDPOINT IS USED BEFORE IT IS FETCHED AGAIN (SECONDS)
+# RATINGS GET ADDED AND REVISED AFTER RELEASE, SO release_dates EXPIRES SOONEST
+DEFAULT_TTLS = {
+    "search_movie": 30 * DAY,
+    "search_tv": 30 * DAY,
+    "find": 90 * DAY,
+    "release_dates": 7 * DAY,
+    "imdb_search": 30 * DAY
+}
+# LARGEST TOTAL SIZE OF CACHED RESPONSES; THE LEAST RECENTLY USED ARE EVICTED PAST IT
+DEFAULT_MAX_BYTES = 512 * (1 << 20)
+# URL PARAMETERS THAT DO NOT CHANGE THE RESPONSE
+IGNORED_PARAMS = ["api_key"]
+
+
+# RAISED IN OFFLINE MODE FOR A REQUEST THAT IS NOT IN THE CACHE
+class CacheMiss(LookupError):
+    pass
+
+
+# SEARCH TEXT AS THE CACHE KEYS IT: CASE AND RUNS OF WHITESPACE DO NOT CHANGE A SEARCH
+def normalize_query(query):
+    return re.sub(r'\s+', ' ', query).strip().lower()
+
+
+# CACHE KEY OF A URL: HOST, PATH AND SORTED PARAMETERS, WITHOUT THE API KEY AND WITH THE SEARCH TEXT NORMALISED
+def normalize_url(url):
+    parts = urllib.parse.urlsplit(url)
+    params = [(k, normalize_query(v) if k == 'query' else v)
+              for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True) if k not in IGNORED_PARAMS]
+    return parts.netloc.lower() + parts.path + '?' + urllib.parse.urlencode(sorted(params))
+
+
+# PERSISTENT CACHE OF JSON RESPONSES IN AN SQLITE FILE, SHARED BY THREADS
+# ENTRIES EXPIRE AFTER THEIR ENDPOINT'S TTL, AND THE LEAST RECENTLY USED ARE EVICTED ONCE THE CACHED
+# RESPONSES OUTGROW max_bytes. IN OFFLINE MODE NOTHING IS FETCHED: EXPIRED ENTRIES ARE STILL SERVED,
+# AND REQUESTS THAT ARE NOT CACHED RAISE CacheMiss
+class ResponseCache:
+    def __init__(self, path, ttls=None, max_bytes=DEFAULT_MAX_BYTES, offline=False):
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "stale_hits": 0, "fetched": 0, "missing": 0, "evicted": 0}
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, endpoint TEXT, '
+                          'value TEXT, size INTEGER, created REAL, accessed REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self.conn.commit()
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    # CACHED RESPONSE FOR key, OR None IF THERE IS NONE OR IT HAS EXPIRED (UNLESS OFFLINE)
+    def get(self, endpoint, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute('SELECT value, created FROM responses WHERE key = ?',
+                                    (endpoint + ':' + key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttls.get(endpoint, 0):
+                if not self.offline:
+                    return None
+                self.stats["stale_hits"] += 1
+            self.conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, endpoint + ':' + key))
+            self.conn.commit()
+            self.stats["hits"] += 1
+        return json.loads(row[0])
+
+    # STORE A RESPONSE, EVICTING THE LEAST RECENTLY USED ENTRIES IF THE CACHE GROWS TOO LARGE
+    def put(self, endpoint, key, value):
+        now = time.time()
+        text = json.dumps(value)
+        with self.lock:
+            old = self.conn.execute('SELECT size FROM responses WHERE key = ?', (endpoint + ':' + key,)).fetchone()
+            self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                              (endpoint + ':' + key, endpoint, text, len(text), now, now))
+            self.total_bytes += len(text) - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self.evict(self.max_bytes * 0.9)
+            self.conn.commit()
+
+    # DROP THE LEAST RECENTLY USED ENTRIES UNTIL THE CACHE HOLDS AT MOST target_bytes (CALLED WITH THE LOCK HELD)
+    def evict(self, target_bytes):
+        rows = self.conn.execute('SELECT key, size FROM responses ORDER BY accessed')
+        dropped = []
+        for key, size in rows:
+            if self.total_bytes <= target_bytes:
+                break
+            dropped.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany('DELETE FROM responses WHERE key = ?', dropped)
+        self.stats["evicted"] += len(dropped)
+
+    # CACHED RESPONSE FOR key, OR fetch(*args) STORED UNDER key (CacheMiss IN OFFLINE MODE)
+    def fetch(self, endpoint, key, fetch, *args):
+        value = self.get(endpoint, key)
+        if value is not None:
+            return value
+        if self.offline:
+            self.count("missing")
+            raise CacheMiss("%s %s is not cached" % (endpoint, key))
+        value = fetch(*args)
+        self.count("fetched")
+        self.put(endpoint, key, value)
+        return value
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
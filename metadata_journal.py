@@ -0,0 +1,68 @@
+import json
+import os
+import time
+
+# STATUS OF A LOOKUP ATTEMPT: A MATCH, NO MATCH, OR AN ERROR (E.G. A NETWORK FAILURE OR RATE-LIMIT BAN)
+FOUND = "found"
+NOT_FOUND = "not_found"
+ERROR = "error"
+
+
+# APPEND-ONLY JSONL JOURNAL OF METADATA LOOKUPS: ONE LINE PER ATTEMPT WITH THE PASS, TITLE, QUERY, STATUS AND
+# RESULT. ON RESUME THE LAST ATTEMPT FOR A (PASS, TITLE) IS REUSED IF ITS QUERY IS UNCHANGED AND IT DID NOT
+# FAIL WITH AN ERROR (OR, WITH retry_failed, IF IT FOUND A MATCH). A LINE CUT SHORT BY A CRASH IS IGNORED
+class MetadataJournal:
+    def __init__(self, path, restart=False, retry_failed=False):
+        self.path = path
+        self.retry_failed = retry_failed
+        self.last = {}
+        self.stats = {"resumed": 0, "attempted": 0, "errors": 0}
+        if restart and os.path.exists(path):
+            os.remove(path)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as fid:
+                for line in fid:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.last[(entry["pass"], entry["title"])] = entry
+            self.trim_partial_line()
+        self.fid = open(path, 'a', encoding='utf-8')
+
+    # DROP AN UNTERMINATED LAST LINE SO THE NEXT ENTRY STARTS ON A LINE OF ITS OWN
+    def trim_partial_line(self):
+        with open(self.path, 'rb+') as fid:
+            data = fid.read()
+            if data and not data.endswith(b'\n'):
+                fid.truncate(data.rfind(b'\n') + 1)
+
+    # THE RESULT OF THE LAST ATTEMPT FOR title IN pass_name IF IT CAN BE REUSED FOR query, ELSE None
+    def resolved(self, pass_name, title, query):
+        entry = self.last.get((pass_name, title))
+        if entry is None or entry["query"] != query or entry["status"] == ERROR:
+            return None
+        if self.retry_failed and entry["status"] != FOUND:
+            return None
+        self.stats["resumed"] += 1
+        return entry
+
+    # APPEND ONE ATTEMPT (result MUST BE JSON-SERIALISABLE)
+    def record(self, pass_name, title, query, status, result=None, error=None):
+        entry = {"pass": pass_name, "title": title, "query": query, "status": status, "result": result,
+                 "error": error, "time": time.time()}
+        self.fid.write(json.dumps(entry) + '\n')
+        self.fid.flush()
+        self.last[(pass_name, title)] = entry
+        self.stats["attempted"] += 1
+        if status == ERROR:
+            self.stats["errors"] += 1
+
+    # FORCE THE JOURNAL TO DISK (AT THE END OF EACH PASS)
+    def sync(self):
+        self.fid.flush()
+        os.fsync(self.fid.fileno())
+
+    def close(self):
+        self.sync()
+        self.fid.close()
@@ -6,16 +6,52 @@ import numpy as np
 import argparse
 import re
 import time
-import codecs
 import json
+import hashlib
+import csv
 
 from os import listdir, makedirs
 from os.path import isfile, join, sep, getsize, exists
 
+from array import array
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import SimpleQueue
+
 from tqdm import tqdm
 
+from line_reader import read_split_lines
+
 import traceback
 
+try:
+    # IN-PROCESS POPPLER BINDING (pip install pdftotext, needs poppler-cpp); OPTIONAL
+    import pdftotext
+except ImportError:
+    pdftotext = None
+
+# PARSER SETTINGS
+PARSE_CONFIG = {
+    'tag_set': ['S', 'N', 'C', 'D', 'E', 'T', 'M', 'MPAA'],
+    'meta_set': ['BLACK', 'darkness'],
+    'bound_set': ['int.', 'ext.', 'int ', 'ext ', 'exterior ', 'interior '],
+    'trans_set': ['cut', 'fade', 'transition', 'dissolve'],
+    # CHARACTERS REMOVED BEFORE COUNTING WORDS FOR TRANSITION/METADATA DETECTION
+    'word_filter': '[^a-zA-Z ]',
+    'char_max_words': 5,
+    'meta_thresh': 2,
+    'sent_thresh': 5,
+    'trans_thresh': 6
+}
+# PARSED LINE RECORD: CLASS TAG, TEXT AND 1-BASED (START, END) OFFSETS OF THE SOURCE LINES IT COVERS
+ParsedLine = namedtuple('ParsedLine', ['tag', 'text', 'offset'])
+# KEYWORD MATCHERS BY PARSER CONFIGURATION, SEE get_matchers
+MATCHER_CACHE = {}
+# PARSER OUTPUT VERSION; BUMP WHEN A CODE CHANGE ALTERS THE OUTPUT SO OLD MANIFEST ENTRIES ARE RE-PARSED
+# 2: SCRIPTS ENDING IN A CHARACTER CUE ARE WRITTEN (ABRIDGED) INSTEAD OF FAILING
+PARSER_VERSION = 2
+
 # PROCESS ARGUMENTS
 
 
@@ -34,6 +70,16 @@ def read_args():
         "-c", "--char", help="Print char info file (on/off)", default='off')
     parser.add_argument("-f", "--offsets",
                         help="Print offset indices (on/off)", default='off')
+    parser.add_argument("-g", "--fast",
+                        help="Use the single-pass fast tagger (on/off)", default='off')
+    parser.add_argument("-b", "--backend",
+                        help="PDF text backend (auto/poppler/cli)", default='auto')
+    parser.add_argument("-p", "--pages",
+                        help="PDF page range to parse, e.g. 1-20", default=None)
+    parser.add_argument("-j", "--charformat",
+                        help="Also write char info statistics as json/csv (off/json/csv)", default='off')
+    parser.add_argument("-x", "--config", default=None,
+                        help="JSON file overriding parser settings, e.g. keyword sets for non-English scripts")
     args = parser.parse_args()
     if args.abridged not in ['on', 'off']:
         raise AssertionError(
@@ -47,48 +93,157 @@ def read_args():
     if args.offsets not in ['on', 'off']:
         raise AssertionError(
             "Invalid value. Choose either off or on")
-    return os.path.abspath(args.input), os.path.abspath(args.output), args.abridged, args.tags, args.char, args.offsets
+    if args.fast not in ['on', 'off']:
+        raise AssertionError(
+            "Invalid value. Choose either off or on")
+    if args.backend not in ['auto', 'poppler', 'cli']:
+        raise AssertionError(
+            "Invalid value. Choose either auto, poppler or cli")
+    if args.charformat not in ['off', 'json', 'csv']:
+        raise AssertionError(
+            "Invalid value. Choose either off, json or csv")
+    page_range = None
+    if args.pages is not None:
+        if not re.match(r'^\d+-\d+$', args.pages):
+            raise AssertionError(
+                "Invalid value. Page range should look like 1-20")
+        page_range = tuple(int(x) for x in args.pages.split('-'))
+    return os.path.abspath(args.input), os.path.abspath(args.output), args.abridged, args.tags, args.char, args.offsets, args.fast, \
+        args.backend, page_range, args.charformat, load_config(args.config)
+
+
+def read_batch_args():
+    parser = argparse.ArgumentParser(
+        description='Parse every script listed in clean_files_meta.json')
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (1 parses in this process)")
+    parser.add_argument("-k", "--chunksize", type=int, default=8,
+                        help="Number of scripts sent to a worker at a time")
+    parser.add_argument("-F", "--force", action='store_true',
+                        help="Re-parse every script, ignoring the parse manifest")
+    parser.add_argument("-j", "--charformat", default='off',
+                        help="Also write char info statistics as json/csv (off/json/csv)")
+    parser.add_argument("-x", "--config", default=None,
+                        help="JSON file overriding parser settings, e.g. keyword sets for non-English scripts")
+    args = parser.parse_args()
+    if args.workers < 1 or args.chunksize < 1:
+        raise AssertionError(
+            "Invalid value. Workers and chunk size must be at least 1")
+    if args.charformat not in ['off', 'json', 'csv']:
+        raise AssertionError(
+            "Invalid value. Choose either off, json or csv")
+    return args.workers, args.chunksize, args.force, args.charformat, load_config(args.config)
 
 
 # FIND OFFSET INDICES FOR EACH LINE
+# SINGLE PASS OVER THE SCRIPT LOCATING WHERE EACH NON-BLANK LINE STARTS, THEN get_offset_from_starts
 def get_offset(script_lines, script_str):
-    offset_mat = np.empty((0, 2), dtype=int)
+    line_starts = array('q')
     pos_init = 0
     for line_val in script_lines:
         if line_val != '':
             line_start = script_str.find(line_val, pos_init)
-            sub_script = script_str[line_start: (line_start + len(line_val))]
-            valid_indices = [(line_start + i)
-                             for i, x in enumerate(sub_script) if x != ' ']
-            offset_mat = np.append(offset_mat, np.array(
-                [[min(valid_indices), (max(valid_indices) + 1)]]), axis=0)
+            line_starts.append(line_start)
+            pos_init = line_start + len(line_val) + 1
+        else:
+            line_starts.append(pos_init)
+            pos_init += 1
+
+    return get_offset_from_starts(script_lines, line_starts)
+
+
+# FIND OFFSET INDICES FOR EACH LINE, GIVEN THE CHARACTER POSITION WHERE EACH LINE STARTS, IN A
+# PREALLOCATED (NUM_LINES, 2) ARRAY; FIRST/LAST NON-SPACE CHARACTERS ARE FOUND WITH LSTRIP/RSTRIP
+# BLANK LINES ARE COUNTED AS ONE CHARACTER AFTER THE END OF THE PREVIOUS LINE
+def get_offset_from_starts(script_lines, line_starts):
+    offset_mat = np.empty((len(script_lines), 2), dtype=int)
+    pos_init = 0
+    for line_num, line_val in enumerate(script_lines):
+        if line_val != '':
+            line_start = line_starts[line_num]
+            lead_len = len(line_val) - len(line_val.lstrip(' '))
+            if lead_len == len(line_val):
+                # LINE OF SPACES ONLY, KEEP THE WHOLE LINE
+                offset_mat[line_num, 0] = line_start
+                offset_mat[line_num, 1] = line_start + len(line_val)
+            else:
+                offset_mat[line_num, 0] = line_start + lead_len
+                offset_mat[line_num, 1] = line_start + \
+                    len(line_val.rstrip(' '))
             pos_init = line_start + len(line_val) + 1
         else:
-            offset_mat = np.append(offset_mat, np.array(
-                [[pos_init, (pos_init + 1)]]), axis=0)
+            offset_mat[line_num, 0] = pos_init
+            offset_mat[line_num, 1] = pos_init + 1
             pos_init += 1
 
     return offset_mat + 1
 
 
-# READ FILE
-def read_txt(file_path):
-    fid = codecs.open(file_path, mode='r', encoding='utf-8')
-    txt_file = fid.read()
-    fid.close()
+# SPLIT TEXT INTO LINES AND OFFSETS
+def split_txt(txt_file):
     txt_lines = txt_file.splitlines()
     txt_offsets = get_offset(txt_lines, txt_file)
     return txt_lines, txt_offsets
 
 
+# READ FILE
+# LINES ARE DECODED ONE AT A TIME FROM A MEMORY MAP, SO THE WHOLE TEXT IS NEVER HELD AS ONE STRING
+def read_txt(file_path):
+    txt_lines = []
+    line_starts = array('q')
+    for line_val, line_start in read_split_lines(file_path, 'utf-8'):
+        txt_lines.append(line_val)
+        line_starts.append(line_start)
+    return txt_lines, get_offset_from_starts(txt_lines, line_starts)
+
+
+# EXTRACT LAYOUT-PRESERVING PDF TEXT WITH THE POPPLER BINDING, IN MEMORY
+# PAGES ARE 1-BASED AND INCLUSIVE; EACH PAGE ENDS WITH A FORM FEED, AS IN pdftotext OUTPUT
+def pdf_text_poppler(file_orig, first_page=None, last_page=None):
+    with open(file_orig, 'rb') as fid:
+        pdf = pdftotext.PDF(fid, physical=True)
+        first_ind = 0 if first_page is None else max(first_page - 1, 0)
+        last_ind = len(pdf) if last_page is None else min(last_page, len(pdf))
+        return ''.join([pdf[i] + '\f' for i in range(first_ind, last_ind)])
+
+
+# EXTRACT LAYOUT-PRESERVING PDF TEXT WITH THE pdftotext COMMAND, READ FROM ITS STDOUT
+def pdf_text_cli(file_orig, first_page=None, last_page=None):
+    cmd = ['pdftotext', '-enc', 'UTF-8', '-layout']
+    if first_page is not None:
+        cmd += ['-f', str(first_page)]
+    if last_page is not None:
+        cmd += ['-l', str(last_page)]
+    proc = subprocess.run(cmd + [file_orig, '-'],
+                          stdout=subprocess.PIPE, check=True)
+    return proc.stdout.decode('utf-8')
+
+
+# EXTRACT PDF TEXT WITH THE CHOSEN BACKEND ('poppler', 'cli' OR 'auto')
+# 'auto' USES THE POPPLER BINDING IF INSTALLED AND FALLS BACK TO THE pdftotext COMMAND
+def extract_pdf_text(file_orig, backend='auto', first_page=None, last_page=None):
+    if backend not in ['auto', 'poppler', 'cli']:
+        raise AssertionError(
+            "Invalid PDF backend. Choose either auto, poppler or cli")
+    if backend == 'poppler' and pdftotext is None:
+        raise AssertionError(
+            "PDF backend poppler needs the pdftotext Python package")
+    if backend == 'poppler' or (backend == 'auto' and pdftotext is not None):
+        return pdf_text_poppler(file_orig, first_page, last_page)
+
+    return pdf_text_cli(file_orig, first_page, last_page)
+
+
+# READ PDF FILE
+def read_pdf(file_path, backend='auto', first_page=None, last_page=None):
+    return split_txt(extract_pdf_text(file_path, backend, first_page, last_page))
+
+
 # PROCESS FILE
-def read_file(file_orig):
+def read_file(file_orig, pdf_backend='auto', first_page=None, last_page=None):
     if file_orig.endswith(".pdf"):
-        file_name = file_orig.replace('.pdf', '.txt')
-        subprocess.call(['pdftotext', '-enc', 'UTF-8',
-                         '-layout', file_orig, file_name])
-        script_orig, script_offsets = read_txt(file_name)
-        subprocess.call('rm ' + file_name, shell=True)
+        script_orig, script_offsets = read_pdf(
+            file_orig, pdf_backend, first_page, last_page)
     elif file_orig.endswith(".txt"):
         script_orig, script_offsets = read_txt(file_orig)
     else:
@@ -97,12 +252,60 @@ def read_file(file_orig):
 
     return script_orig, script_offsets
 
+
+# REMOVE INDENTS AND COLLAPSE WHITESPACE; LINES WITHOUT ALPHANUMERIC CHARACTERS BECOME EMPTY
+def remove_indents(script_orig):
+    alnum_filter = re.compile('[\W_]+', re.UNICODE)
+    script_noind = []
+    for script_line in script_orig:
+        if len(script_line.split()) > 0 and alnum_filter.sub('', script_line) != '':
+            script_noind.append(' '.join(script_line.split()))
+        else:
+            script_noind.append('')
+
+    return script_noind
+
+
+# COMPILE A KEYWORD LIST INTO ONE ALTERNATION REGEX; search() IS TRUE IF ANY KEYWORD IS A SUBSTRING
+def keyword_regex(keywords):
+    if len(keywords) == 0:
+        return re.compile('(?!)')
+
+    return re.compile('|'.join([re.escape(x) for x in sorted(keywords, key=len, reverse=True)]))
+
+
+# KEYWORD MATCHERS SHARED BY THE DETECTORS, BUILT ONCE PER PARSER CONFIGURATION
+# bound, trans: SEARCHED IN THE LOWER-CASED LINE; meta: SEARCHED IN THE LINE AS IS
+# CUSTOM KEYWORD SETS (E.G. FOR NON-ENGLISH SCRIPTS) ARE SET THROUGH THE CONFIGURATION
+def get_matchers(config=PARSE_CONFIG):
+    config_key = json.dumps(config, sort_keys=True)
+    if config_key not in MATCHER_CACHE:
+        MATCHER_CACHE[config_key] = {
+            'bound': keyword_regex(config['bound_set']),
+            'trans': keyword_regex(config['trans_set']),
+            'meta': keyword_regex(config['meta_set']),
+            'word_filter': re.compile(config['word_filter'])
+        }
+
+    return MATCHER_CACHE[config_key]
+
+
+# READ A JSON FILE OF PARSER SETTINGS; KEYS IT DOES NOT SET KEEP THEIR DEFAULT VALUES
+def load_config(config_path):
+    config = dict(PARSE_CONFIG)
+    if config_path is not None:
+        with open(config_path, 'r', encoding='utf-8') as infile:
+            config.update(json.load(infile))
+
+    return config
+
+
 # DETECT SCENE BOUNDARIES:
 # LOOK FOR ALL-CAPS LINES CONTAINING "INT." OR "EXT."
-def get_scene_bound(script_noind, tag_vec, tag_set, bound_set):
+def get_scene_bound(script_noind, tag_vec, tag_set, bound_match):
     bound_ind = [i for i, x in enumerate(script_noind) if tag_vec[i] not in tag_set and
                  x.isupper() and
-                 any([y in x.lower() for y in bound_set])]
+                 bound_match.search(x.lower())]
     if len(bound_ind) > 0:
         for x in bound_ind:
             tag_vec[x] = 'S'
@@ -112,11 +315,10 @@ def get_scene_bound(script_noind, tag_vec, tag_set, bound_set):
 
 # DETECT TRANSITIONS:
 # LOOK FOR ALL-CAPS LINES PRECEDED BY NEWLINE, FOLLOWED BY NEWLINE AND CONTAINING "CUT " OR "FADE "
-def get_trans(script_noind, tag_vec, tag_set, trans_thresh, trans_set):
-    re_func = re.compile('[^a-zA-Z ]')
+def get_trans(script_noind, tag_vec, tag_set, trans_thresh, trans_match, re_func):
     trans_ind = [i for i, x in enumerate(script_noind) if tag_vec[i] not in tag_set
                  and len(re_func.sub('', x).split()) < trans_thresh
-                 and any([y in x.lower() for y in trans_set])]
+                 and trans_match.search(x.lower())]
     if len(trans_ind) > 0:
         for x in trans_ind:
             tag_vec[x] = 'T'
@@ -126,15 +328,13 @@ def get_trans(script_noind, tag_vec, tag_set, trans_thresh, trans_set):
 
 # DETECT METADATA:
 # LOOK FOR CONTENT PRECEDING SPECIFIC PHRASES THAT INDICATE BEGINNING OF MOVIE
-def get_meta(script_noind, tag_vec, tag_set, meta_thresh, meta_set, sent_thresh, bound_ind, trans_ind):
-    re_func = re.compile('[^a-zA-Z ]')
-
+def get_meta(script_noind, tag_vec, tag_set, meta_thresh, meta_match, re_func, sent_thresh, bound_ind, trans_ind):
     met_ind = [i for i, x in enumerate(script_noind) if tag_vec[i] not in tag_set
                and i != 0 and i != (len(script_noind) - 1)
                and len(x.split()) < meta_thresh
                and len(re_func.sub('', script_noind[i - 1]).split()) == 0
                and len(re_func.sub('', script_noind[i + 1]).split()) == 0
-               and any([y in x for y in meta_set])]
+               and meta_match.search(x)]
     sent_ind = [i for i, x in enumerate(script_noind) if tag_vec[i] not in tag_set
                 and i != 0 and i != (len(script_noind) - 1)
                 and len(x.split()) > sent_thresh
@@ -215,6 +415,104 @@ def get_scene_desc(script_noind, tag_vec, tag_set):
     return tag_vec
 
 
+# FAST TAGGER:
+# COMPUTE EACH LINE'S FEATURES ONCE, THEN ASSIGN S/T/M/C/D/E/N IN ONE PASS
+# SAME RULES AND PRIORITY ORDER AS get_scene_bound -> get_trans -> get_meta -> get_char_dial -> get_scene_desc
+def get_tags_fast(script_noind, matchers, char_max_words, meta_thresh, sent_thresh, trans_thresh):
+    re_func = matchers['word_filter']
+    bound_match = matchers['bound']
+    trans_match = matchers['trans']
+    meta_match = matchers['meta']
+    num_lines = len(script_noind)
+    # LINE FEATURES
+    num_words = [0] * num_lines
+    alpha_words = [0] * num_lines
+    base_tag = ['0'] * num_lines
+    has_dial = [False] * num_lines
+    char_cand = [False] * num_lines
+    for i, x in enumerate(script_noind):
+        words = x.split()
+        if len(words) == 0:
+            continue
+        x_lower = x.lower()
+        num_words[i] = len(words)
+        alpha_words[i] = len(re_func.sub('', x).split())
+        if x.isupper() and bound_match.search(x_lower):
+            base_tag[i] = 'S'
+        elif alpha_words[i] < trans_thresh and trans_match.search(x_lower):
+            base_tag[i] = 'T'
+        dial_str, _, rem_str = separate_dial_meta(x)
+        has_dial[i] = dial_str != '' or rem_str != ''
+        char_cand[i] = has_dial[i] and len(words) < char_max_words and \
+            all(y.isupper() for y in words)
+
+    # METADATA: NON-EMPTY LINES BEFORE THE FIRST BOUNDARY/TRANSITION/META PHRASE/SENTENCE
+    meta_end = 0
+    for i, x in enumerate(script_noind):
+        if base_tag[i] != '0':
+            meta_end = i
+            break
+        if i != 0 and i != (num_lines - 1):
+            if num_words[i] < meta_thresh and alpha_words[i - 1] == 0 and alpha_words[i + 1] == 0 \
+                    and meta_match.search(x):
+                meta_end = i
+                break
+            if num_words[i] > sent_thresh and num_words[i - 1] == 0 and num_words[i + 1] > 0:
+                meta_end = i
+                break
+
+    for i in range(meta_end):
+        if num_words[i] > 0:
+            base_tag[i] = 'M'
+
+    # CHARACTER-DIALOGUE AND SCENE DESCRIPTION
+    # DIALOGUE RUNS FROM A CHARACTER LINE UNTIL THE NEXT EMPTY LINE, CHARACTER OR LAST LINE
+    tag_list = []
+    in_dial = False
+    for i, x in enumerate(script_noind):
+        if base_tag[i] == '0' and char_cand[i] and i != 0 and i != (num_lines - 1) \
+                and num_words[i + 1] > 0:
+            tag_list.append('C')
+            in_dial = True
+        elif in_dial and num_words[i] > 0 and i != (num_lines - 1):
+            tag_list.append('D' if has_dial[i] else 'E')
+        else:
+            in_dial = False
+            if base_tag[i] == '0' and num_words[i] > 0 and not x.strip('.').isdigit():
+                tag_list.append('N')
+            else:
+                tag_list.append(base_tag[i])
+
+    return np.array(tag_list)
+
+
+# ASSIGN A CLASS TAG TO EVERY LINE ('0' FOR UN-TAGGED LINES)
+def tag_script(script_noind, fast_flag='off', config=PARSE_CONFIG):
+    matchers = get_matchers(config)
+    if fast_flag == 'on':
+        return get_tags_fast(script_noind, matchers, config['char_max_words'], config['meta_thresh'],
+                             config['sent_thresh'], config['trans_thresh'])
+
+    tag_set = set(config['tag_set'])
+    tag_vec = np.array(['0' for x in range(len(script_noind))])
+    # DETECT SCENE BOUNDARIES
+    tag_vec, bound_ind = get_scene_bound(
+        script_noind, tag_vec, tag_set, matchers['bound'])
+    # DETECT TRANSITIONS
+    tag_vec, trans_ind = get_trans(
+        script_noind, tag_vec, tag_set, config['trans_thresh'], matchers['trans'], matchers['word_filter'])
+    # DETECT METADATA
+    tag_vec = get_meta(script_noind, tag_vec, tag_set, config['meta_thresh'], matchers['meta'],
+                       matchers['word_filter'], config['sent_thresh'], bound_ind, trans_ind)
+    # DETECT CHARACTER-DIALOGUE
+    tag_vec = get_char_dial(script_noind, tag_vec,
+                            tag_set, config['char_max_words'])
+    # DETECT SCENE DESCRIPTION
+    tag_vec = get_scene_desc(script_noind, tag_vec, tag_set)
+
+    return tag_vec
+
+
 # CHECK IF LINES CONTAIN START OF PARENTHESES
 def par_start(line_set):
     return [i for i, x in enumerate(line_set) if '(' in x]
@@ -226,24 +524,29 @@ def par_end(line_set):
 
 
 # COMBINE MULTI-LINE CLASSES, SPLIT MULTI-CLASS LINES
+# span_final HOLDS THE FIRST AND LAST INDEX IN tag_valid OF THE LINES EACH OUTPUT LINE COMES FROM
 def combine_tag_lines(tag_valid, script_valid):
     tag_final = []
     script_final = []
+    span_final = []
     changed_tags = [x for x in tag_valid]
     for i, x in enumerate(tag_valid):
         if i == 0:
             tag_final.append('MPAA')
             script_final.append(script_valid[i])
+            span_final.append((i, i))
         elif x in ['M', 'T', 'S']:
             # APPEND METADATA, TRANSITION AND SCENE BOUNDARY LINES AS THEY ARE
             tag_final.append(x)
             script_final.append(script_valid[i])
+            span_final.append((i, i))
         elif x in ['C', 'D', 'N']:
             # IF CHARACTER, DIALOGUE OR SCENE DESCRIPTION CONSIST OF MULTIPLE LINES, COMBINE THEM
             if i == 0 or x != tag_valid[i - 1]:
                 # INITIALIZE IF FIRST OF MULTIPLE LINES
                 to_combine = []
                 comb_ind = []
+                comb_start = i
 
             to_combine += script_valid[i].split()
             comb_ind.append(i)
@@ -253,6 +556,7 @@ def combine_tag_lines(tag_valid, script_valid):
                     # IF SCENE DESCRIPTION, WRITE AS IT IS
                     tag_final.append(x)
                     script_final.append(combined_str)
+                    span_final.append((comb_start, i))
                 else:
                     _, in_par, _ = separate_dial_meta(combined_str)
                     if in_par != '':
@@ -290,6 +594,7 @@ def combine_tag_lines(tag_valid, script_valid):
                                 ' '.join(char_dial_str.split()))
                             tag_final.append('E')
                             script_final.append(dial_meta_str)
+                            span_final += [(comb_start, i), (comb_start, i)]
                         elif x == 'D':
                             # IF DIALOGUE, PREPEND DIALOGUE METADATA
                             tag_final.append('E')
@@ -297,10 +602,12 @@ def combine_tag_lines(tag_valid, script_valid):
                             tag_final.append(x)
                             script_final.append(
                                 ' '.join(char_dial_str.split()))
+                            span_final += [(comb_start, i), (comb_start, i)]
                     else:
                         # IF NO DIALOGUE METADATA, WRITE AS IT IS
                         tag_final.append(x)
                         script_final.append(combined_str)
+                        span_final.append((comb_start, i))
         elif x == 'E':
             # IF DIALOGUE METADATA LINE, WRITE WITHOUT PARENTHESIS
             split_1 = script_valid[i].split('(')
@@ -308,8 +615,9 @@ def combine_tag_lines(tag_valid, script_valid):
             dial_met = split_2[0]
             tag_final.append('E')
             script_final.append(dial_met)
+            span_final.append((i, i))
 
-    return tag_final, script_final, changed_tags
+    return tag_final, script_final, span_final, changed_tags
 
 
 # CHECK FOR UN-MERGED CLASSES
@@ -435,47 +743,193 @@ def rearrange_tag_lines(tag_merged, script_merged):
     return tag_rear, script_rear
 
 
-# PARSER FUNCTION
-def parse(file_orig, save_dir, abr_flag, tag_flag, char_flag, off_flag, save_name=None, abridged_name=None, tag_name=None, charinfo_name=None, offset_name=None):
-    # ------------------------------------------------------------------------------------
-    # DEFINE
-    tag_set = ['S', 'N', 'C', 'D', 'E', 'T', 'M', 'MPAA']
-    meta_set = ['BLACK', 'darkness']
-    bound_set = ['int.', 'ext.', 'int ', 'ext ', 'exterior ', 'interior ']
-    trans_set = ['cut', 'fade', 'transition', 'dissolve']
-    char_max_words = 5
-    meta_thresh = 2
-    sent_thresh = 5
-    trans_thresh = 6
-    # READ PDF/TEXT FILE
-    script_orig, script_offsets = read_file(file_orig)
-    # REMOVE INDENTS
-    alnum_filter = re.compile('[\W_]+', re.UNICODE)
-    script_noind = []
-    for script_line in script_orig:
-        if len(script_line.split()) > 0 and alnum_filter.sub('', script_line) != '':
-            script_noind.append(' '.join(script_line.split()))
-        else:
-            script_noind.append('')
+# COUNT SENTENCES BY SPLITTING ON SENTENCE-FINAL PUNCTUATION FOLLOWED BY WHITESPACE
+def count_sentences(line_str, sent_split=re.compile(r'(?<=[.!?])\s+')):
+    return len([x for x in sent_split.split(line_str) if x.strip() != ''])
+
+
+# SPEAKER STATISTICS IN ONE GROUPED PASS OVER THE PARSED RECORDS
+# lines: CHARACTER LINES FOLLOWED BY DIALOGUE (AS IN THE CHAR INFO FILE); cues: ALL CHARACTER LINES
+# words, sentences: COUNTED OVER THAT DIALOGUE; SPEAKERS ARE SORTED BY NAME
+def get_char_info(records):
+    char_info = {}
+    prev_rec = None
+    for rec in records:
+        if rec.tag == 'C':
+            if rec.text not in char_info:
+                char_info[rec.text] = {
+                    'cues': 0, 'lines': 0, 'words': 0, 'sentences': 0}
+            char_info[rec.text]['cues'] += 1
+        elif rec.tag == 'D' and prev_rec is not None and prev_rec.tag == 'C':
+            spk_info = char_info[prev_rec.text]
+            spk_info['lines'] += 1
+            spk_info['words'] += len(rec.text.split())
+            spk_info['sentences'] += count_sentences(rec.text)
+        prev_rec = rec
+
+    return {x: char_info[x] for x in sorted(char_info)}
+
+
+# WRITE CHAR INFO FILE ("NAME: LINES" PER SPEAKER), PLUS A JSON OR CSV COPY WITH ALL STATISTICS
+def write_char_info(char_info, charinfo_name, charinfo_format=None):
+    charinfo_vec = [char_id + ': ' + str(char_info[char_id]['lines'])
+                    for char_id in char_info]
+    np.savetxt(charinfo_name, charinfo_vec, fmt='%s',
+               delimiter='\n', encoding="utf-8")
+    if charinfo_format is None or charinfo_format == 'off':
+        return
+
+    stats_name = os.path.splitext(charinfo_name)[0] + '.' + charinfo_format
+    if charinfo_format == 'json':
+        with open(stats_name, 'w', encoding='utf-8') as outfile:
+            json.dump(char_info, outfile, indent=4)
+    elif charinfo_format == 'csv':
+        with open(stats_name, 'w', encoding='utf-8', newline='') as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(['character', 'lines', 'cues', 'words', 'sentences'])
+            for char_id in char_info:
+                writer.writerow([char_id] + [char_info[char_id][x]
+                                             for x in ['lines', 'cues', 'words', 'sentences']])
+    else:
+        raise AssertionError(
+            "Invalid char info format. Choose either json or csv")
 
-    num_lines = len(script_noind)
-    tag_vec = np.array(['0' for x in range(num_lines)])
-    # ------------------------------------------------------------------------------------
-    # DETECT SCENE BOUNDARIES
-    tag_vec, bound_ind = get_scene_bound(
-        script_noind, tag_vec, tag_set, bound_set)
-    # DETECT TRANSITIONS
-    tag_vec, trans_ind = get_trans(
-        script_noind, tag_vec, tag_set, trans_thresh, trans_set)
-    # DETECT METADATA
-    tag_vec = get_meta(script_noind, tag_vec, tag_set, meta_thresh,
-                       meta_set, sent_thresh, bound_ind, trans_ind)
-    # DETECT CHARACTER-DIALOGUE
-    tag_vec = get_char_dial(script_noind, tag_vec, tag_set, char_max_words)
-    # DETECT SCENE DESCRIPTION
-    tag_vec = get_scene_desc(script_noind, tag_vec, tag_set)
-    # ------------------------------------------------------------------------------------
-    # REMOVE UN-TAGGED LINES
+
+# WRITE PARSED SCRIPT, ONE "TAG: TEXT" LINE PER RECORD
+def write_parsed(records, save_name):
+    fid = open(save_name, 'w')
+    for rec in records:
+        _ = fid.write(rec.tag + ': ' + rec.text + '\n')
+
+    fid.close()
+
+
+# WRITE CHARACTER=>DIALOGUE ABRIDGED VERSION FROM CHARACTER RECORDS FOLLOWED BY DIALOGUE
+def write_abridged(records, abridged_name):
+    fid = open(abridged_name, 'w')
+    prev_rec = None
+    for rec in records:
+        if rec.tag == 'D' and prev_rec is not None and prev_rec.tag == 'C':
+            char_str = ' '.join(('C: ' + prev_rec.text).split('C:')[1].split())
+            dial_str = ' '.join(('D: ' + rec.text).split('D:')[1].split())
+            _ = fid.write(''.join([char_str, '=>', dial_str, '\n']))
+        prev_rec = rec
+
+    fid.close()
+
+
+# FORMAT TAGS, LINES BY REPEATED MERGE/REARRANGE PASSES UNTIL NOTHING CHANGES
+# KEPT AS REFERENCE FOR normalize_tag_lines; RETURNS THE NUMBER OF PASSES AS WELL
+def format_tag_lines_legacy(tag_valid, script_valid):
+    max_rev = 0
+    while find_same(tag_valid).shape[0] > 0 or len(find_arrange(tag_valid)[1]) > 0:
+        tag_valid, script_valid = merge_tag_lines(tag_valid, script_valid)
+        tag_valid, script_valid = rearrange_tag_lines(tag_valid, script_valid)
+        max_rev += 1
+        if max_rev == 1000:
+            raise AssertionError(
+                "Too many revisions. Something must be wrong.")
+
+    return tag_valid, script_valid, max_rev
+
+
+# APPEND A LINE, MERGING IT INTO THE PREVIOUS ONE IF BOTH HAVE THE SAME (NON-METADATA) TAG
+# MERGED SPANS COVER BOTH LINES
+def append_merged(tag_out, script_out, span_out, tag, line, span):
+    if len(tag_out) > 0 and tag != 'M' and tag_out[-1] == tag:
+        script_out[-1] = script_out[-1] + ' ' + line
+        span_out[-1] = (min(span_out[-1][0], span[0]), max(span_out[-1][1], span[1]))
+        return True
+
+    tag_out.append(tag)
+    script_out.append(line)
+    span_out.append(span)
+    return False
+
+
+# JOIN THE LINES OF A BLOCK WITH A GIVEN TAG; THE SPAN COVERS ALL OF THEM
+def join_block_tag(block_tag, block_script, block_span, tag):
+    tag_ind = [i for i, x in enumerate(block_tag) if x == tag]
+    return ' '.join([block_script[i] for i in tag_ind]), \
+        (min([block_span[i][0] for i in tag_ind]), max([block_span[i][1] for i in tag_ind]))
+
+
+# MOVE DIALOGUE METADATA AFTER DIALOGUE IN A C-* BLOCK STARTING WITH C-E-D OR C-D-E-D
+def flush_char_block(block_tag, block_script, block_span, tag_norm, script_norm, span_norm):
+    if block_tag[: 3] == ['C', 'E', 'D'] or block_tag[: 4] == ['C', 'D', 'E', 'D']:
+        dial_str, dial_span = join_block_tag(
+            block_tag, block_script, block_span, 'D')
+        meta_str, meta_span = join_block_tag(
+            block_tag, block_script, block_span, 'E')
+        tag_norm += ['C', 'D', 'E']
+        script_norm += [block_script[0], dial_str, meta_str]
+        span_norm += [block_span[0], dial_span, meta_span]
+        rest_merged = False
+        tag_rest = []
+        script_rest = []
+        span_rest = []
+        for i, x in enumerate(block_tag):
+            if x not in ['C', 'D', 'E']:
+                rest_merged = append_merged(
+                    tag_rest, script_rest, span_rest, x, block_script[i], block_span[i]) or rest_merged
+        tag_norm += tag_rest
+        script_norm += script_rest
+        span_norm += span_rest
+        return True, rest_merged
+
+    tag_norm += block_tag
+    script_norm += block_script
+    span_norm += block_span
+    return False, False
+
+
+# FORMAT TAGS, LINES IN ONE LINEAR PASS:
+# MERGE CONSECUTIVE IDENTICAL CLASSES AND MOVE DIALOGUE METADATA AFTER DIALOGUE
+# ALSO REPORTS HOW MANY PASSES format_tag_lines_legacy WOULD HAVE NEEDED, AND WHETHER IT
+# WOULD HAVE DROPPED THE SCRIPT (rearrange_tag_lines RETURNS NOTHING WHEN NO BLOCK NEEDS REARRANGING)
+# span_valid (DEFAULT: EACH LINE'S OWN INDEX) IS CARRIED THROUGH MERGES AS span_norm
+def normalize_tag_lines(tag_valid, script_valid, span_valid=None):
+    if span_valid is None:
+        span_valid = [(i, i) for i in range(len(tag_valid))]
+    tag_norm = []
+    script_norm = []
+    span_norm = []
+    block_tag = []
+    block_script = []
+    block_span = []
+    any_merged = False
+    any_arranged = False
+    rest_merged = False
+    for i, x in enumerate(tag_valid):
+        if len(block_tag) > 0 and x == 'C' and block_tag[-1] != 'C':
+            arranged, merged = flush_char_block(
+                block_tag, block_script, block_span, tag_norm, script_norm, span_norm)
+            any_arranged = any_arranged or arranged
+            rest_merged = rest_merged or merged
+            block_tag = []
+            block_script = []
+            block_span = []
+        any_merged = append_merged(
+            block_tag, block_script, block_span, x, script_valid[i], span_valid[i]) or any_merged
+
+    arranged, merged = flush_char_block(
+        block_tag, block_script, block_span, tag_norm, script_norm, span_norm)
+    any_arranged = any_arranged or arranged
+    rest_merged = rest_merged or merged
+    if any_arranged and rest_merged:
+        num_rev = 2
+    elif any_arranged or any_merged:
+        num_rev = 1
+    else:
+        num_rev = 0
+    legacy_drop = (any_merged and not any_arranged) or rest_merged
+
+    return tag_norm, script_norm, span_norm, num_rev, legacy_drop
+
+
+# DROP UN-TAGGED LINES AND COMBINE MULTI-LINE CLASSES (combine_tag_lines), WRITING THE CHANGED DIALOGUE
+# TAGS BACK INTO tag_vec; RETURNS THE SOURCE LINE INDEX OF EACH TAGGED LINE AND THE COMBINED TAGS, LINES, SPANS
+def combine_tags(tag_vec, script_noind):
     nz_ind_vec = np.where(tag_vec != '0')[0]
     tag_valid = []
     script_valid = []
@@ -485,12 +939,78 @@ def parse(file_orig, save_dir, abr_flag, tag_flag, char_flag, off_flag, save_nam
             script_valid.append(script_noind[i])
 
     # UPDATE TAGS
-    tag_valid, script_valid, changed_tags = combine_tag_lines(
+    tag_valid, script_valid, span_valid, changed_tags = combine_tag_lines(
         tag_valid, script_valid)
     for change_ind in range(len(nz_ind_vec)):
         if tag_vec[nz_ind_vec[change_ind]] == 'D':
             tag_vec[nz_ind_vec[change_ind]] = changed_tags[change_ind]
 
+    return nz_ind_vec, tag_valid, script_valid, span_valid
+
+
+# YIELD ONE RECORD PER NORMALIZED LINE, WITH THE OFFSETS OF ITS SOURCE LINES
+def iter_records(nz_ind_vec, tag_norm, script_norm, span_norm, script_offsets):
+    for i, x in enumerate(tag_norm):
+        yield ParsedLine(str(x), script_norm[i], (int(script_offsets[nz_ind_vec[span_norm[i][0]], 0]),
+                                                 int(script_offsets[nz_ind_vec[span_norm[i][1]], 1])))
+
+
+# NORMALIZE COMBINED LINES (normalize_tag_lines) INTO RECORDS WITH THE OFFSETS OF THEIR SOURCE LINES
+# RETURNS THE RECORDS AND THE NORMALIZER STATISTICS
+def build_records(nz_ind_vec, tag_valid, script_valid, span_valid, script_offsets):
+    tag_valid, script_valid, span_valid, num_rev, legacy_drop = normalize_tag_lines(
+        tag_valid, script_valid, span_valid)
+    records = list(iter_records(nz_ind_vec, tag_valid, script_valid, span_valid, script_offsets))
+
+    return records, num_rev, legacy_drop
+
+
+# PARSE SCRIPT LINES INTO FORMATTED RECORDS
+# RETURNS THE RECORDS, THE PER-LINE TAG VECTOR AND THE NORMALIZER STATISTICS
+def parse_lines(script_orig, script_offsets, fast_flag='off', config=PARSE_CONFIG):
+    # REMOVE INDENTS
+    script_noind = remove_indents(script_orig)
+    # ------------------------------------------------------------------------------------
+    # DETECT CLASSES
+    tag_vec = tag_script(script_noind, fast_flag, config)
+    # ------------------------------------------------------------------------------------
+    # REMOVE UN-TAGGED LINES, UPDATE TAGS
+    combined = combine_tags(tag_vec, script_noind)
+    # FORMAT TAGS, LINES
+    records, num_rev, legacy_drop = build_records(*combined, script_offsets)
+
+    return records, tag_vec, num_rev, legacy_drop
+
+
+# STREAMING PARSE API: YIELD (tag, text, offset) RECORDS OF A PDF/TXT FILE OR OF SCRIPT TEXT, IN ORDER
+# STREAMING IS PER SCRIPT, NOT PER LINE: TAGGING AND NORMALIZING NEED THE WHOLE SCRIPT, SO THE
+# FIRST RECORD COMES ONLY AFTER BOTH HAVE RUN; THE RECORDS THEMSELVES ARE BUILT AS THEY ARE CONSUMED
+def iter_parsed(file_or_text, fast_flag='off', pdf_backend='auto', page_range=None, config=None):
+    if '\n' not in file_or_text and isfile(file_or_text):
+        first_page, last_page = (None, None) if page_range is None else page_range
+        script_orig, script_offsets = read_file(
+            file_or_text, pdf_backend, first_page, last_page)
+    else:
+        script_orig, script_offsets = split_txt(file_or_text)
+    script_noind = remove_indents(script_orig)
+    tag_vec = tag_script(script_noind, fast_flag, PARSE_CONFIG if config is None else config)
+    nz_ind_vec, tag_valid, script_valid, span_valid = combine_tags(tag_vec, script_noind)
+    tag_norm, script_norm, span_norm, _, _ = normalize_tag_lines(tag_valid, script_valid, span_valid)
+    yield from iter_records(nz_ind_vec, tag_norm, script_norm, span_norm, script_offsets)
+
+
+# PARSER FUNCTION
+def parse(file_orig, save_dir, abr_flag, tag_flag, char_flag, off_flag, save_name=None, abridged_name=None, tag_name=None, charinfo_name=None, offset_name=None, fast_flag='off', pdf_backend='auto', page_range=None, charinfo_format=None, config=None):
+    # ------------------------------------------------------------------------------------
+    # READ PDF/TEXT FILE
+    first_page, last_page = (None, None) if page_range is None else page_range
+    script_orig, script_offsets = read_file(
+        file_orig, pdf_backend, first_page, last_page)
+    # ------------------------------------------------------------------------------------
+    # PARSE
+    records, tag_vec, num_rev, legacy_drop = parse_lines(
+        script_orig, script_offsets, fast_flag, PARSE_CONFIG if config is None else config)
+
     # SAVE TAGS TO FILE
     if tag_flag == 'on':
         if tag_name is None:
@@ -511,16 +1031,6 @@ def parse(file_orig, save_dir, abr_flag, tag_flag, char_flag, off_flag, save_nam
 
         np.savetxt(offset_name, script_offsets, fmt='%s', delimiter=',')
 
-    # FORMAT TAGS, LINES
-    max_rev = 0
-    while find_same(tag_valid).shape[0] > 0 or len(find_arrange(tag_valid)[1]) > 0:
-        tag_valid, script_valid = merge_tag_lines(tag_valid, script_valid)
-        tag_valid, script_valid = rearrange_tag_lines(tag_valid, script_valid)
-        max_rev += 1
-        if max_rev == 1000:
-            raise AssertionError(
-                "Too many revisions. Something must be wrong.")
-
     # ------------------------------------------------------------------------------------
     # WRITE PARSED SCRIPT TO FILE
     if save_name is None:
@@ -529,61 +1039,169 @@ def parse(file_orig, save_dir, abr_flag, tag_flag, char_flag, off_flag, save_nam
     else:
         save_name = os.path.join(save_dir, "tagged", save_name)
 
-    fid = open(save_name, 'w')
-    for tag_ind in range(len(tag_valid)):
-        _ = fid.write(tag_valid[tag_ind] + ': ' + script_valid[tag_ind] + '\n')
-
-    fid.close()
+    write_parsed(records, save_name)
     # ------------------------------------------------------------------------------------
     # CREATE CHARACTER=>DIALOGUE ABRIDGED VERSION
     if abr_flag == 'on':
-        fid = open(save_name, 'r')
-        parsed_script = fid.read().splitlines()
-        fid.close()
         if abridged_name is None:
             abridged_name = os.path.join(save_dir, '.'.join(
                 file_orig.split('/')[-1].split('.')[: -1]) + '_abridged.txt')
         else:
             abridged_name = os.path.join(save_dir, "dialogue", abridged_name)
 
-        abridged_ind = [i for i, x in enumerate(parsed_script) if x.startswith('C:') and
-                        parsed_script[i + 1].startswith('D:')]
-        fid = open(abridged_name, 'w')
-        for i in abridged_ind:
-            char_str = ' '.join(parsed_script[i].split('C:')[1].split())
-            dial_str = ' '.join(parsed_script[i + 1].split('D:')[1].split())
-            _ = fid.write(''.join([char_str, '=>', dial_str, '\n']))
-
-        fid.close()
+        write_abridged(records, abridged_name)
 
     # ------------------------------------------------------------------------------------
     # CREATE CHAR INFO FILE
     if char_flag == 'on':
-        tag_str_vec = np.array(tag_valid)
-        script_vec = np.array(script_valid)
-        char_ind = np.where(tag_str_vec == 'C')[0]
-        char_set = sorted(set(script_vec[char_ind]))
-        charinfo_vec = []
-        for char_id in char_set:
-            spk_ind = list(
-                set(np.where(script_vec == char_id)[0]) & set(char_ind))
-            if len(spk_ind) > 0:
-                num_lines = len([i for i in spk_ind if i != (len(tag_str_vec) - 1) and
-                                 tag_str_vec[i + 1] == 'D'])
-                charinfo_str = char_id + ': ' + \
-                    str(num_lines)
-                charinfo_vec.append(charinfo_str)
         if charinfo_name is None:
             charinfo_name = os.path.join(save_dir, '.'.join(
                 file_orig.split('/')[-1].split('.')[: -1]) + '_charinfo.txt')
         else:
             charinfo_name = os.path.join(save_dir, "charinfo", charinfo_name)
-        np.savetxt(charinfo_name, charinfo_vec, fmt='%s',
-                   delimiter='\n', encoding="utf-8")
+        write_char_info(get_char_info(records),
+                        charinfo_name, charinfo_format)
+
+    return num_rev, legacy_drop
+
+
+# PARSE ONE BATCH JOB; ERRORS ARE RETURNED WITH THEIR TRACEBACK INSTEAD OF RAISED
+def parse_job(job):
+    script, parse_args, parse_kwargs = job
+    try:
+        return script, parse(*parse_args, **parse_kwargs), None
+    except Exception:
+        return script, None, traceback.format_exc()
+
+
+# SET IN EACH POOL WORKER; parse_job_chunk POSTS ('start'|'done', script) TO IT AROUND EVERY JOB
+# SO parse_batch CAN TELL WHICH SCRIPTS WERE IN FLIGHT WHEN A WORKER DIED
+JOB_EVENTS = None
+
+
+def init_parse_worker(job_events):
+    global JOB_EVENTS
+    JOB_EVENTS = job_events
+
+
+def parse_job_chunk(jobs):
+    out = []
+    for job in jobs:
+        if JOB_EVENTS is not None:
+            JOB_EVENTS.put(('start', job[0]))
+        out.append(parse_job(job))
+        if JOB_EVENTS is not None:
+            JOB_EVENTS.put(('done', job[0]))
+    return out
+
+
+# RE-RUN SUSPECT JOBS CONCURRENTLY, EACH IN ITS OWN SINGLE-WORKER POOL,
+# SO ONE THAT KILLS ITS WORKER CANNOT TAKE THE OTHERS DOWN WITH IT
+def isolate_jobs(jobs, results):
+    executors = [ProcessPoolExecutor(max_workers=1) for _ in jobs]
+    try:
+        futures = [executor.submit(parse_job, job) for executor, job in zip(executors, jobs)]
+        for job, future in zip(jobs, futures):
+            try:
+                script, parse_out, err = future.result()
+                results[script] = (parse_out, err)
+            except BrokenProcessPool:
+                results[job[0]] = (None, "Worker process died while parsing this script\n")
+    finally:
+        for executor in executors:
+            executor.shutdown()
+
+
+# PARSE MANY SCRIPTS OVER A PROCESS POOL
+# RETURNS {script: (parse result, traceback)} IN THE ORDER OF jobs
+# IF A WORKER DIES, ONLY THE SCRIPTS THAT WERE IN FLIGHT AT THAT MOMENT (AT MOST ONE PER
+# WORKER) ARE RE-RUN IN ISOLATION, SO THE ONE THAT KILLED IT IS RECORDED AS FAILED;
+# EVERY OTHER UNFINISHED SCRIPT GOES BACK THROUGH A FRESH POOL OF num_workers
+def parse_batch(jobs, num_workers, chunk_size):
+    results = {}
+    if num_workers == 1:
+        for job in tqdm(jobs):
+            script, parse_out, err = parse_job(job)
+            results[script] = (parse_out, err)
+        return {job[0]: results[job[0]] for job in jobs}
+
+    pending = jobs
+    with tqdm(total=len(jobs)) as pbar:
+        while pending:
+            chunks = [pending[i: (i + chunk_size)] for i in range(0, len(pending), chunk_size)]
+            # SimpleQueue WRITES STRAIGHT TO ITS PIPE, SO A 'start' IS NOT LOST IF THE WORKER DIES
+            job_events = SimpleQueue()
+            broken_chunks = []
+            with ProcessPoolExecutor(max_workers=num_workers, initializer=init_parse_worker,
+                                     initargs=(job_events,)) as executor:
+                futures = {executor.submit(parse_job_chunk, chunk): chunk for chunk in chunks}
+                for future in as_completed(futures):
+                    try:
+                        for script, parse_out, err in future.result():
+                            results[script] = (parse_out, err)
+                        pbar.update(len(futures[future]))
+                    except BrokenProcessPool:
+                        broken_chunks.append(futures[future])
+            if not broken_chunks:
+                break
+
+            started, done = set(), set()
+            while not job_events.empty():
+                event, script = job_events.get()
+                (started if event == 'start' else done).add(script)
+            job_events.close()
+            unfinished = [job for chunk in broken_chunks for job in chunk]
+            suspects = [job for job in unfinished if job[0] in started and job[0] not in done]
+            if not suspects:
+                # THE WORKER DIED BEFORE REPORTING ANY JOB; ISOLATE ONE CHUNK TO GUARANTEE PROGRESS
+                suspects = broken_chunks[0]
+            isolate_jobs(suspects, results)
+            pbar.update(len(suspects))
+            suspect_scripts = {job[0] for job in suspects}
+            pending = [job for job in unfinished if job[0] not in suspect_scripts]
+
+    return {job[0]: results[job[0]] for job in jobs}
+
+
+# SHA-256 OF A FILE'S CONTENT
+def hash_file(file_path):
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as fid:
+        for block in iter(lambda: fid.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+# SHA-256 OF THE PARSER VERSION, PARSER SETTINGS AND ALL parse() ARGUMENTS BUT THE INPUT FILE
+def hash_config(parse_args, parse_kwargs):
+    config = parse_kwargs.get('config')
+    config_str = json.dumps({'version': PARSER_VERSION, 'config': PARSE_CONFIG if config is None else config,
+                             'args': list(parse_args[1:]),
+                             'kwargs': {x: parse_kwargs[x] for x in parse_kwargs if x != 'config'}}, sort_keys=True)
+    return hashlib.sha256(config_str.encode('utf-8')).hexdigest()
+
+
+# BUILD THE MANIFEST ENTRY OF A JOB; THE INPUT HASH IS None IF THE INPUT FILE IS MISSING
+def manifest_entry(parse_args, parse_kwargs, outputs):
+    file_orig = parse_args[0]
+    return {
+        "input_hash": hash_file(file_orig) if isfile(file_orig) else None,
+        "config_hash": hash_config(parse_args, parse_kwargs),
+        "outputs": outputs
+    }
+
+
+# A MANIFEST ENTRY IS VALID IF INPUT, SETTINGS AND OUTPUT NAMES ARE UNCHANGED AND ALL OUTPUTS EXIST
+def manifest_valid(old_entry, new_entry):
+    return old_entry is not None and new_entry["input_hash"] is not None \
+        and all([old_entry.get(x) == new_entry[x] for x in ["input_hash", "config_hash", "outputs"]]) \
+        and "result" in old_entry and all([isfile(x) for x in new_entry["outputs"]])
 
 
 # MAIN FUNCTION
 if __name__ == "__main__":
+    num_workers, chunk_size, force, charinfo_format, config = read_batch_args()
+
     DIR_FINAL = join("scripts", "filtered_mpaa")
     DIR_OUT = join("scripts", "parsed")
     DIR_OUT_FULL = join(DIR_OUT, "tagged")
@@ -592,6 +1210,8 @@ if __name__ == "__main__":
     META_DIR = join("scripts", "metadata")
     CLEAN_META = join(META_DIR, "clean_files_meta.json")
     PARSED_META = join(META_DIR, "clean_parsed_meta.json")
+    PARSED_ERRORS = join(META_DIR, "clean_parsed_errors.json")
+    PARSED_MANIFEST = join(META_DIR, "clean_parsed_manifest.json")
 
     if not os.path.exists(DIR_OUT):
         os.makedirs(DIR_OUT)
@@ -609,7 +1229,8 @@ if __name__ == "__main__":
     meta = json.load(f)
     f.close()
 
-    for script in tqdm(meta):
+    jobs = []
+    for script in meta:
         file = meta[script]["file"]
         file_orig = join(DIR_FINAL, file["file_name"] + ".txt")
         save_dir = DIR_OUT
@@ -617,25 +1238,68 @@ if __name__ == "__main__":
         tag_flag = "off"
         char_flag = "on"
         off_flag = "off"
+        fast_flag = "on"
         save_name = file["file_name"] + "_parsed.txt"
         abridged_name = file["file_name"] + "_dialogue.txt"
         tag_name = None
         charinfo_name = file["file_name"] + "_charinfo.txt"
+        jobs.append((script, (file_orig, save_dir, abr_flag, tag_flag, char_flag, off_flag,
+                              save_name, abridged_name, tag_name, charinfo_name),
+                     {"fast_flag": fast_flag, "charinfo_format": charinfo_format, "config": config}))
+
+    # REUSE OUTPUTS OF SCRIPTS WHOSE INPUT AND SETTINGS ARE UNCHANGED SINCE THE LAST RUN
+    manifest = {}
+    if not force and isfile(PARSED_MANIFEST):
+        with open(PARSED_MANIFEST, 'r') as infile:
+            manifest = json.load(infile)
+
+    new_manifest = {}
+    results = {}
+    stale_jobs = []
+    for script, parse_args, parse_kwargs in jobs:
+        outputs = [join(DIR_OUT_FULL, parse_args[6]), join(DIR_OUT_ABRIDGED, parse_args[7]),
+                   join(DIR_OUT_CHARINFO, parse_args[9])]
+        if parse_kwargs["charinfo_format"] != 'off':
+            outputs.append(join(DIR_OUT_CHARINFO, os.path.splitext(parse_args[9])[0] + '.' +
+                                parse_kwargs["charinfo_format"]))
+        new_manifest[script] = manifest_entry(parse_args, parse_kwargs, outputs)
+        if manifest_valid(manifest.get(script), new_manifest[script]):
+            new_manifest[script]["result"] = manifest[script]["result"]
+            results[script] = (tuple(manifest[script]["result"]), None)
+        else:
+            stale_jobs.append((script, parse_args, parse_kwargs))
 
-        try:
-            parse(file_orig, save_dir, abr_flag, tag_flag, char_flag,
-                  off_flag, save_name, abridged_name, tag_name, charinfo_name)
-            meta[script]["parsed"] = {
-                "dialogue": abridged_name,
-                "charinfo": charinfo_name,
-                "tagged": save_name
-            }
-        except Exception as err:
-            #print(err)
+    results.update(parse_batch(stale_jobs, num_workers, chunk_size))
+
+    legacy_drops = []
+    errors = {}
+    for script, parse_args, _ in jobs:
+        parse_out, err = results[script]
+        if err is not None:
             print(f"Error occurred in script: {script}")
-            
-            # Print the full traceback for more details
-            traceback.print_exc()
-            pass
+            errors[script] = {"file": parse_args[0], "traceback": err}
+            continue
+
+        num_rev, legacy_drop = parse_out
+        new_manifest[script]["result"] = [num_rev, legacy_drop]
+        meta[script]["parsed"] = {
+            "dialogue": parse_args[7],
+            "charinfo": parse_args[9],
+            "tagged": parse_args[6],
+            "revisions": num_rev
+        }
+        if legacy_drop:
+            legacy_drops.append(script)
+
     with open(join(PARSED_META), "w") as outfile:
         json.dump(meta, outfile, indent=4)
+    with open(PARSED_ERRORS, "w") as outfile:
+        json.dump(errors, outfile, indent=4)
+    with open(PARSED_MANIFEST, "w") as outfile:
+        json.dump({x: new_manifest[x] for x in new_manifest if "result" in new_manifest[x]},
+                  outfile, indent=4)
+
+    print("Scripts reused from the last run:", len(jobs) - len(stale_jobs))
+    print("Scripts parsed:", len(stale_jobs) - len(errors))
+    print("Scripts failed:", len(errors), "(see " + PARSED_ERRORS + ")")
+    print("Scripts the old merge/rearrange loop would have emptied:", len(legacy_drops))
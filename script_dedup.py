@@ -0,0 +1,143 @@
+import hashlib
+import zlib
+
+import numpy as np
+
+# MINHASH SETTINGS: 128 PERMUTATIONS SPLIT INTO 16 LSH BANDS OF 8 ROWS
+# (CANDIDATE PAIRS START SHOWING UP AROUND 0.7 JACCARD SIMILARITY)
+NUM_PERM = 128
+NUM_BANDS = 16
+SHINGLE_SIZE = 5
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+PERM_CACHE = {}
+
+
+# EXACT FINGERPRINT OF A TEXT
+def text_hash(text):
+    return hashlib.sha1(text.encode('utf-8', 'ignore')).hexdigest()
+
+
+# 32-BIT HASHES OF THE WORD SHINGLES IN A TEXT (SHORT TEXTS ARE ONE SHINGLE)
+def shingle_hashes(text, shingle_size=SHINGLE_SIZE):
+    words = text.lower().split()
+    if len(words) <= shingle_size:
+        shingles = [' '.join(words)]
+    else:
+        shingles = [' '.join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)]
+    return np.unique(np.array([zlib.crc32(x.encode('utf-8', 'ignore')) for x in shingles], dtype=np.uint64))
+
+
+# RANDOM (a, b) PAIRS OF THE HASH PERMUTATIONS, SHARED BY ALL SIGNATURES WITH THE SAME SETTINGS
+def get_permutations(num_perm=NUM_PERM, seed=1):
+    key = (num_perm, seed)
+    if key not in PERM_CACHE:
+        rng = np.random.RandomState(seed)
+        PERM_CACHE[key] = (rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64),
+                           rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64))
+    return PERM_CACHE[key]
+
+
+# MINHASH SIGNATURE OF A TEXT
+def minhash_signature(text, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE):
+    perm_a, perm_b = get_permutations(num_perm)
+    hashes = shingle_hashes(text, shingle_size)
+    with np.errstate(over='ignore'):
+        perm_hashes = (np.outer(hashes, perm_a) + perm_b) % MERSENNE_PRIME & MAX_HASH
+    return perm_hashes.min(axis=0)
+
+
+# ESTIMATED JACCARD SIMILARITY OF TWO SIGNATURES
+def signature_similarity(sig_1, sig_2):
+    return float(np.mean(sig_1 == sig_2))
+
+
+# CANDIDATE PAIRS (i < j) OF SIGNATURES SHARING AT LEAST ONE LSH BAND
+def lsh_candidates(signatures, num_bands=NUM_BANDS):
+    candidates = set()
+    if len(signatures) < 2:
+        return candidates
+    rows = len(signatures[0]) // num_bands
+    for band in range(num_bands):
+        buckets = {}
+        for i, sig in enumerate(signatures):
+            buckets.setdefault(sig[band * rows:(band + 1) * rows].tobytes(), []).append(i)
+        for bucket in buckets.values():
+            for j in range(1, len(bucket)):
+                for k in range(j):
+                    candidates.add((bucket[k], bucket[j]))
+    return candidates
+
+
+# UNION-FIND ROOT WITH PATH HALVING
+def find_root(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+# GROUP ITEMS BY FINGERPRINT: ITEMS WITH THE SAME EXACT HASH ARE DUPLICATES, AND DISTINCT HASHES WHOSE
+# SIGNATURES HAVE AN ESTIMATED SIMILARITY OF AT LEAST near_thresh ARE LINKED THROUGH LSH (near_thresh >= 1 IS
+# EXACT ONLY). ONLY THE FIRST ITEM OF EACH HASH NEEDS A SIGNATURE (THE OTHERS MAY BE None)
+# RETURNS (matches, groups): THE NUMBER OF ITEMS EACH ITEM DUPLICATES, AND THE GROUPS OF MORE THAN ONE
+# ITEM AS {"members", "similarity" (LOWEST LINKED SIMILARITY), "exact"}
+def group_fingerprints(hashes, signatures, near_thresh=0.9, num_bands=NUM_BANDS):
+    exact_groups = {}
+    for i, item_hash in enumerate(hashes):
+        exact_groups.setdefault(item_hash, []).append(i)
+    reps = [x[0] for x in exact_groups.values()]
+    rep_members = list(exact_groups.values())
+
+    matches = [0 for x in hashes]
+    parent = list(range(len(reps)))
+    links = {}
+    for members in rep_members:
+        for i in members:
+            matches[i] += len(members) - 1
+
+    if near_thresh < 1 and len(reps) > 1:
+        rep_signatures = [signatures[i] for i in reps]
+        for j, k in sorted(lsh_candidates(rep_signatures, num_bands)):
+            similarity = signature_similarity(rep_signatures[j], rep_signatures[k])
+            if similarity < near_thresh:
+                continue
+            for i in rep_members[j]:
+                matches[i] += len(rep_members[k])
+            for i in rep_members[k]:
+                matches[i] += len(rep_members[j])
+            root_j, root_k = find_root(parent, j), find_root(parent, k)
+            if root_j != root_k:
+                parent[root_k] = root_j
+            links[(j, k)] = similarity
+
+    grouped = {}
+    for j in range(len(reps)):
+        grouped.setdefault(find_root(parent, j), []).append(j)
+    group_similarity = {}
+    for (j, k), similarity in links.items():
+        root = find_root(parent, j)
+        group_similarity[root] = min(group_similarity.get(root, 1.0), similarity)
+    groups = []
+    for root, rep_group in grouped.items():
+        members = sorted([i for j in rep_group for i in rep_members[j]])
+        if len(members) < 2:
+            continue
+        groups.append({"members": members, "similarity": group_similarity.get(root, 1.0),
+                       "exact": len(rep_group) == 1})
+
+    return matches, sorted(groups, key=lambda x: x["members"])
+
+
+# GROUP DUPLICATE TEXTS (SEE group_fingerprints), FINGERPRINTING EACH DISTINCT TEXT ONCE
+def find_duplicates(texts, near_thresh=0.9, num_perm=NUM_PERM, num_bands=NUM_BANDS,
+                    shingle_size=SHINGLE_SIZE):
+    hashes = [text_hash(x) for x in texts]
+    signatures = [None for x in texts]
+    if near_thresh < 1:
+        seen = set()
+        for i, text in enumerate(texts):
+            if hashes[i] not in seen:
+                seen.add(hashes[i])
+                signatures[i] = minhash_signature(text, num_perm, shingle_size)
+    return group_fingerprints(hashes, signatures, near_thresh, num_bands)
@@ -0,0 +1,242 @@
+import argparse
+import gzip
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+from unidecode import unidecode # type: ignore
+
+from title_match import extra_clean, TitleIndex
+
+# TITLE TYPES OF title.basics KEPT BY DEFAULT, MOST PREFERRED FIRST WHEN SEVERAL TITLES SHARE A NAME
+TITLE_TYPES = ['movie', 'tvMovie', 'video', 'tvSeries', 'tvMiniSeries', 'tvSpecial', 'short', 'tvShort',
+               'tvEpisode', 'videoGame', 'tvPilot']
+DEFAULT_TYPES = ['movie', 'tvMovie', 'video', 'tvSeries', 'tvMiniSeries', 'tvSpecial', 'short']
+# ROWS INSERTED PER TRANSACTION WHILE IMPORTING
+IMPORT_BATCH = 50000
+NON_ALNUM = re.compile(r'[^a-z0-9]+')
+YEAR = re.compile(r'\((\d{4})\)')
+# LEAST average_ratio OF A FUZZY MATCH (None: EXACT KEYS ONLY)
+FUZZY_CUTOFF = 90
+# MOST TITLES SCORED PER FUZZY LOOKUP: THOSE SHARING THE MOST WORD BEGINNINGS AND ENDINGS WITH THE NAME
+FUZZY_CANDIDATES = 200
+# MOST POSTINGS READ PER FUZZY LOOKUP: THE NAME'S RAREST TOKENS ARE USED UNTIL THEIR TITLES ADD UP TO THIS
+# (THE RAREST ONE IS ALWAYS USED), SO COMMON WORDS DO NOT SCAN A LARGE PART OF THE INDEX
+FUZZY_POSTINGS = 20000
+
+# PROCESS ARGUMENTS
+
+
+def read_args():
+    parser = argparse.ArgumentParser(
+        description='Import an IMDb title.basics dump into a local title index for get_metadata.py')
+    parser.add_argument("-b", "--basics", required=True,
+                        help="title.basics.tsv(.gz) in IMDb's dataset layout")
+    parser.add_argument("-r", "--ratings", default=None,
+                        help="title.ratings.tsv(.gz); vote counts order titles sharing a name, as IMDb search does")
+    parser.add_argument("-o", "--output", default=os.path.join("scripts", "metadata", "title_index.sqlite"),
+                        help="Index file to write")
+    parser.add_argument("-t", "--types", nargs='+', default=DEFAULT_TYPES,
+                        help="Title types to keep (%s)" % ", ".join(TITLE_TYPES))
+    args = parser.parse_args()
+    if not set(args.types) <= set(TITLE_TYPES):
+        raise AssertionError(
+            "Invalid value. Title types must be among %s" % ", ".join(TITLE_TYPES))
+    return args.basics, args.ratings, args.output, args.types
+
+
+# SEARCH KEY OF A TITLE: THE extra_clean NAME, TRANSLITERATED, WITH ONLY LETTERS AND DIGITS
+def index_key(name):
+    return NON_ALNUM.sub('', unidecode(extra_clean(name)).lower())
+
+
+# ROWS OF AN IMDb DATASET FILE (GZIPPED OR NOT) AS LISTS OF FIELDS, WITHOUT THE HEADER; \N BECOMES None
+def read_tsv(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', newline='\n') as fid:
+        header = fid.readline().rstrip('\n').split('\t')
+        for line in fid:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != len(header):
+                continue
+            yield [None if x == '\\N' else x for x in fields]
+
+
+# WORD BEGINNINGS AND ENDINGS (FOUR CHARACTERS, WORDS OF THREE OR MORE) OF A NORMALISED TITLE: A MISSPELT WORD
+# USUALLY KEEPS ONE OF THE TWO, SO TITLES SHARING THEM ARE THE CANDIDATES OF A FUZZY LOOKUP
+def fuzzy_tokens(normal):
+    words = [x for x in NON_ALNUM.split(unidecode(normal).lower()) if len(x) >= 3]
+    return set(['^' + x[:4] for x in words] + [x[-4:] + '$' for x in words])
+
+
+# YEAR IN PARENTHESES IN A NAME (-1 IF NONE)
+def name_year(name):
+    year = YEAR.search(name)
+    return int(year.group(1)) if year else -1
+
+
+# NUMERIC PART OF AN IMDb ID (tt0133093 -> 133093)
+def id_number(tconst):
+    return int(tconst[2:])
+
+
+# IMDb ID AS Cinemagoer GIVES movieID (SEVEN DIGITS OR MORE, WITHOUT tt)
+def movie_id(number):
+    return "%07d" % number
+
+
+# LOAD title.basics (AND title.ratings) INTO A NEW INDEX FILE, REPLACING ANY OLD ONE ONLY WHEN COMPLETE
+# EACH TITLE IS KEYED BY ITS PRIMARY AND ORIGINAL TITLE (index_key), AND ITS PRIMARY TITLE IS STORED NORMALISED
+# (extra_clean, TRANSLITERATED) WITH ITS fuzzy_tokens, AND HOW MANY TITLES HAVE EACH TOKEN, FOR FUZZY LOOKUPS;
+# RETURNS THE NUMBER OF TITLES KEPT
+def import_title_basics(basics_path, index_path, ratings_path=None, types=DEFAULT_TYPES):
+    votes = {}
+    if ratings_path is not None:
+        for tconst, rating, num_votes in read_tsv(ratings_path):
+            votes[id_number(tconst)] = int(num_votes or 0)
+
+    kinds = dict([(x, TITLE_TYPES.index(x)) for x in types])
+    out_dir = os.path.dirname(os.path.abspath(index_path))
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix='.tmp')
+    os.close(fd)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute('CREATE TABLE titles (id INTEGER PRIMARY KEY, title TEXT, kind INTEGER, year INTEGER, '
+                     'votes INTEGER, normal TEXT)')
+        conn.execute('CREATE TEMP TABLE new_keys (key TEXT, id INTEGER)')
+        conn.execute('CREATE TABLE title_keys (key TEXT, id INTEGER, PRIMARY KEY (key, id)) WITHOUT ROWID')
+        conn.execute('CREATE TEMP TABLE new_tokens (token TEXT, id INTEGER)')
+        conn.execute('CREATE TABLE title_tokens (token TEXT, id INTEGER, PRIMARY KEY (token, id)) WITHOUT ROWID')
+        conn.execute('CREATE TABLE token_counts (token TEXT PRIMARY KEY, titles INTEGER) WITHOUT ROWID')
+        conn.execute('CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT)')
+        count = 0
+        titles = []
+        keys = []
+        tokens = []
+        for row in read_tsv(basics_path):
+            tconst, title_type, primary, original, start_year = row[0], row[1], row[2], row[3], row[5]
+            if title_type not in kinds or primary is None:
+                continue
+            number = id_number(tconst)
+            normal = unidecode(extra_clean(primary))
+            titles.append((number, primary, kinds[title_type], int(start_year) if start_year else None,
+                           votes.get(number, 0), normal))
+            for key in set([index_key(primary), index_key(original or primary)]):
+                if key:
+                    keys.append((key, number))
+            tokens.extend([(x, number) for x in fuzzy_tokens(normal)])
+            count += 1
+            if len(titles) >= IMPORT_BATCH:
+                conn.executemany('INSERT OR REPLACE INTO titles VALUES (?, ?, ?, ?, ?, ?)', titles)
+                conn.executemany('INSERT INTO new_keys VALUES (?, ?)', keys)
+                conn.executemany('INSERT INTO new_tokens VALUES (?, ?)', tokens)
+                titles = []
+                keys = []
+                tokens = []
+        conn.executemany('INSERT OR REPLACE INTO titles VALUES (?, ?, ?, ?, ?, ?)', titles)
+        conn.executemany('INSERT INTO new_keys VALUES (?, ?)', keys)
+        conn.executemany('INSERT INTO new_tokens VALUES (?, ?)', tokens)
+        # KEYS GO IN SORTED, SO THE KEY TABLE IS ITS OWN INDEX AND IS BUILT IN ONE SEQUENTIAL PASS
+        conn.execute('INSERT OR IGNORE INTO title_keys SELECT key, id FROM new_keys ORDER BY key, id')
+        conn.execute('DROP TABLE new_keys')
+        conn.execute('INSERT OR IGNORE INTO title_tokens SELECT token, id FROM new_tokens ORDER BY token, id')
+        conn.execute('DROP TABLE new_tokens')
+        conn.execute('INSERT INTO token_counts SELECT token, COUNT(*) FROM title_tokens GROUP BY token')
+        conn.executemany('INSERT INTO meta VALUES (?, ?)', [
+            ('basics', os.path.basename(basics_path)), ('ratings', os.path.basename(ratings_path or '')),
+            ('types', ' '.join(types)), ('titles', str(count)), ('created', str(time.time()))])
+        conn.commit()
+        conn.execute('VACUUM')
+        conn.close()
+        os.replace(tmp_path, index_path)
+    except BaseException:
+        conn.close()
+        os.remove(tmp_path)
+        raise
+    return count
+
+
+# READ-ONLY LOOKUPS IN AN INDEX FILE WRITTEN BY import_title_basics, SAFE TO SHARE BETWEEN THREADS
+# search MATCHES KEYS EXACTLY; search_fuzzy IS A SLOWER, WEAKER FALLBACK FOR NAMES NOTHING ELSE MATCHED, AND
+# FINDS NOTHING IF fuzzy_cutoff IS None OR THE INDEX WAS WRITTEN BEFORE IT STORED fuzzy_tokens
+class LocalTitleIndex:
+    def __init__(self, index_path, fuzzy_cutoff=FUZZY_CUTOFF):
+        if not os.path.isfile(index_path):
+            raise AssertionError(
+                "Invalid value. Title index %s does not exist" % index_path)
+        self.index_path = index_path
+        self.local = threading.local()
+        self.stats_lock = threading.Lock()
+        self.stats = {"found": 0, "missing": 0, "fuzzy": 0, "fuzzy_missing": 0}
+        has_tokens = self.get_connection().execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'token_counts'").fetchone()[0]
+        self.fuzzy_cutoff = fuzzy_cutoff if has_tokens else None
+
+    # THIS THREAD'S CONNECTION
+    def get_connection(self):
+        if not hasattr(self.local, 'conn'):
+            self.local.conn = sqlite3.connect('file:%s?mode=ro' % os.path.abspath(self.index_path), uri=True)
+        return self.local.conn
+
+    def count(self, stat):
+        with self.stats_lock:
+            self.stats[stat] += 1
+
+    # TITLES WHOSE KEY EQUALS THAT OF name, AS [{"id", "title", "year"}], THE LIKELIEST FIRST: A YEAR IN
+    # PARENTHESES IN name PICKS TITLES OF THAT YEAR, THEN MOVIES BEFORE OTHER TYPES, THEN BY VOTES
+    def search(self, name, limit=5):
+        key = index_key(name)
+        hits = []
+        if key:
+            rows = self.get_connection().execute(
+                'SELECT t.id, t.title, t.year FROM title_keys k JOIN titles t ON t.id = k.id WHERE k.key = ? '
+                'GROUP BY t.id ORDER BY t.year = ? DESC, t.kind, t.votes DESC, t.id LIMIT ?',
+                (key, name_year(name), limit))
+            hits = [{"id": movie_id(x[0]), "title": x[1], "year": x[2]} for x in rows]
+        self.count("found" if hits else "missing")
+        return hits
+
+    # THE limit TITLES CLOSEST TO name BY average_ratio (BOTH TRANSLITERATED), SCORING AT LEAST fuzzy_cutoff,
+    # AMONG THE FUZZY_CANDIDATES TITLES SHARING THE MOST OF ITS RAREST fuzzy_tokens; TIES GO AS IN search
+    def search_fuzzy(self, name, limit=5):
+        hits = []
+        name = unidecode(name)
+        tokens = sorted(fuzzy_tokens(extra_clean(name)))
+        if self.fuzzy_cutoff is not None and tokens:
+            conn = self.get_connection()
+            counts = conn.execute('SELECT token, titles FROM token_counts WHERE token IN (%s) ORDER BY titles, token' %
+                                  ', '.join(['?'] * len(tokens)), tokens).fetchall()
+            tokens = []
+            postings = 0
+            for token, titles in counts:
+                if tokens and postings + titles > FUZZY_POSTINGS:
+                    break
+                tokens.append(token)
+                postings += titles
+        if self.fuzzy_cutoff is not None and tokens:
+            rows = conn.execute(
+                'SELECT t.id, t.title, t.year, t.normal FROM (SELECT id, COUNT(*) AS shared FROM title_tokens '
+                'WHERE token IN (%s) GROUP BY id ORDER BY shared DESC, id LIMIT ?) c JOIN titles t ON t.id = c.id '
+                'ORDER BY t.year = ? DESC, t.kind, t.votes DESC, t.id' % ', '.join(['?'] * len(tokens)),
+                tokens + [FUZZY_CANDIDATES, name_year(name)]).fetchall()
+            index = TitleIndex([x[1] for x in rows], range(len(rows)), [x[3] for x in rows])
+            hits = [{"id": movie_id(rows[i][0]), "title": rows[i][1], "year": rows[i][2]}
+                    for i, title, score in index.top_k(name, limit, self.fuzzy_cutoff)]
+        self.count("fuzzy" if hits else "fuzzy_missing")
+        return hits
+
+
+# MAIN FUNCTION
+if __name__ == "__main__":
+    basics_path, ratings_path, index_path, types = read_args()
+    start = time.perf_counter()
+    count = import_title_basics(basics_path, index_path, ratings_path, types)
+    print("%d titles indexed in %s (%.1f MB) in %.1fs" %
+          (count, index_path, os.path.getsize(index_path) / 1e6, time.perf_counter() - start))
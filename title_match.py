@@ -0,0 +1,192 @@
+import re
+import string
+
+import numpy as np
+
+from unidecode import unidecode # type: ignore
+
+from fuzzywuzzy import fuzz, utils as fuzz_utils # type: ignore
+
+try:
+    # C++ STRING MATCHING (pip install rapidfuzz); OPTIONAL, AND ONLY USED AFTER use_rapidfuzz()
+    from rapidfuzz import fuzz as rapid_fuzz, process as rapid_process # type: ignore
+    from rapidfuzz.utils import default_process # type: ignore
+except ImportError:
+    rapid_fuzz = None
+
+# fuzzywuzzy SCORES (a, b) AND (b, a) ALIKE UNLESS IT FALLS BACK TO difflib, WHOSE MATCHING IS NOT SYMMETRIC
+SYMMETRIC = fuzz.SequenceMatcher.__module__ != 'difflib'
+# WHETHER similarity SCORES WITH rapidfuzz INSTEAD OF fuzzywuzzy (SEE use_rapidfuzz)
+USE_RAPIDFUZZ = False
+
+ROMAN_NUMERALS = {"ii": "2", "iii": "3", "iv": "4", "v": "5", "vi": "6", "vii": "7", "viii": "8", "ix": "9"}
+PARENS = re.compile(r'\([^)]*\)')
+BRACKETS = re.compile(r"[\([{})\]]")
+SPACES = re.compile(' +')
+# CHARACTERS LEFT BY fuzzywuzzy'S PROCESSING; ANY OTHER CHARACTER IS COUNTED IN ONE EXTRA COLUMN
+ALPHABET = 'abcdefghijklmnopqrstuvwxyz0123456789 '
+# COLUMN OF EACH BYTE OF THE ASCII-ENCODED TITLE (ANY OTHER CHARACTER IS ENCODED AS '?')
+ALPHABET_COLUMNS = np.array([ALPHABET.find(chr(i)) % (len(ALPHABET) + 1) for i in range(128)], dtype=np.intp)
+# WORDS LEFT OUT OF ORIGIN KEYS; PUNCTUATION (HYPHENS INCLUDED, BUT NOT BACKSLASHES, WHICH THE ORIGINAL REGEX
+# CHARACTER CLASS READ AS AN ESCAPE) SEPARATES WORDS IN THEM
+FORBIDDEN_WORDS = frozenset(["the", "a", "an", "and", "or", "part",
+                             "vol", "chapter", "movie", "transcript"])
+PUNCTUATION_TO_SPACE = str.maketrans(string.punctuation.replace('\\', ''), ' ' * (len(string.punctuation) - 1))
+
+# extra_clean OF EVERY TITLE SEEN, SO EACH IS NORMALISED ONCE PER RUN
+NORMAL_CACHE = {}
+
+
+def clean_name(name):
+    name = name.lower()
+    # Split by "_"
+    name = " ".join(name.split("_"))
+    # Remove ", The" and ", A"
+    name = name.replace(", the", "")
+    name = name.replace(", a", "")
+    name = SPACES.sub(' ', name).strip()
+
+    # If name has filmed as or released as, use those names instead
+    if "filmed as" in name:
+        name = BRACKETS.sub("", name).split("filmed as")[-1].strip()
+    if "released as" in name:
+        name = BRACKETS.sub("", name).split("released as")[-1].strip()
+    # Remove brackets ()
+    name = PARENS.sub('', name)
+    # Remove "Early/Final Pilot TV Script PDF", "Script",
+    # "Transcript", "Pilot", "First Draft"
+    name = name.replace("early pilot", "")
+    name = name.replace("final pilot", "")
+    name = name.replace("transcript", "")
+    name = name.replace("first draft", "")
+    name = name.replace("tv script pdf", "")
+    name = name.replace("pilot", "")
+    name = name.strip()
+
+    return name
+
+
+def roman_to_int(num):
+    return " ".join([ROMAN_NUMERALS.get(s, s) for s in num.split()])
+
+
+# NORMALISED TITLE FOR MATCHING (MEMOISED)
+def extra_clean(name):
+    if name not in NORMAL_CACHE:
+        NORMAL_CACHE[name] = roman_to_int(clean_name(name)).replace(
+            "the ", "").replace("-", "").replace(":", "").replace("episode", "").replace(".", "")
+    return NORMAL_CACHE[name]
+
+
+# KEY UNDER WHICH get_metadata GROUPS THE SCRIPTS OF ONE TITLE ACROSS SOURCES: NO PARENTHESES, LOWER CASE,
+# PUNCTUATION AND FORBIDDEN WORDS DROPPED, WORDS RUN TOGETHER, A LONE ROMAN NUMERAL AS A DIGIT, TRANSLITERATED
+def origin_key(name):
+    words = PARENS.sub('', name.strip()).lower().translate(PUNCTUATION_TO_SPACE).split()
+    name = "".join([w for w in words if w not in FORBIDDEN_WORDS])
+    return unidecode(ROMAN_NUMERALS.get(name, name))
+
+
+# ORIGIN KEYS OF A BATCH OF NAMES, IN ORDER, EACH DISTINCT NAME NORMALISED ONCE
+def origin_keys(names):
+    keys = {}
+    for name in names:
+        if name not in keys:
+            keys[name] = origin_key(name)
+    return [keys[x] for x in names]
+
+
+# SCORE TITLES WITH rapidfuzz (OR AGAIN WITH fuzzywuzzy). rapidfuzz IS MUCH FASTER, BUT ITS Indel SCORES DIFFER
+# FROM THE difflib SCORES OF fuzzywuzzy WITHOUT python-Levenshtein, SO SOME PAIRS LAND ON THE OTHER SIDE OF A
+# THRESHOLD; fuzzywuzzy STAYS THE DEFAULT SO THAT MATCHES ARE THE SAME AS BEFORE
+def use_rapidfuzz(enabled=True):
+    global USE_RAPIDFUZZ
+    if enabled and rapid_fuzz is None:
+        raise AssertionError(
+            "Invalid value. Scoring with rapidfuzz needs the rapidfuzz package")
+    USE_RAPIDFUZZ = enabled
+
+
+# fuzz.token_sort_ratio OF TWO TITLES, WITH rapidfuzz AFTER use_rapidfuzz() (0 IF EITHER IS EMPTY ONCE PROCESSED)
+def similarity(n, m):
+    if not USE_RAPIDFUZZ:
+        return fuzz.token_sort_ratio(n, m)
+    n, m = default_process(n), default_process(m)
+    if not n or not m:
+        return 0
+    return int(round(rapid_fuzz.token_sort_ratio(n, m)))
+
+
+# MEAN OF THE SIMILARITY IN BOTH DIRECTIONS, WHICH IS A SINGLE SCORE WHEN THE SCORER IS SYMMETRIC
+def average_ratio(n, m):
+    if USE_RAPIDFUZZ or SYMMETRIC:
+        return similarity(n, m)
+    return (similarity(n, m) + similarity(m, n)) // 2
+
+
+# CHARACTER COUNTS OF A TITLE AS token_sort_ratio COMPARES IT (PROCESSED WITH force_ascii, WHICH DROPS
+# ACCENTED LETTERS, TOKENS JOINED BY SPACES)
+def char_counts(name):
+    processed = " ".join(fuzz_utils.full_process(name, force_ascii=True).split()).encode('ascii', 'replace')
+    return np.bincount(ALPHABET_COLUMNS[np.frombuffer(processed, dtype=np.uint8)],
+                       minlength=len(ALPHABET) + 1).astype(np.int32)
+
+
+# LOCAL INDEX OF CATALOGUE TITLES FOR TOP-K FUZZY LOOKUP, EACH TITLE NORMALISED ONCE (extra_clean, UNLESS THE
+# NORMALISED TITLES ARE GIVEN AS normal)
+# WITH use_rapidfuzz() A BATCH OF QUERIES IS SCORED AGAINST THE WHOLE INDEX AT ONCE ON ALL CORES. WITHOUT IT, THE
+# CHARACTERS TWO TITLES HAVE IN COMMON BOUND THEIR SCORE (AT MOST 200 * SHARED / TOTAL LENGTH), SO TITLES ARE
+# SCORED BEST BOUND FIRST UNTIL THE BOUND FALLS BELOW THE k-TH SCORE FOUND, GIVING THE SAME MATCHES AS SCORING
+# EVERY TITLE
+class TitleIndex:
+    def __init__(self, titles, keys=None, normal=None):
+        self.titles = list(titles)
+        self.keys = list(range(len(self.titles))) if keys is None else list(keys)
+        self.normal = [extra_clean(x) for x in self.titles] if normal is None else list(normal)
+        self.counts = None
+
+    def __len__(self):
+        return len(self.titles)
+
+    # THE k BEST (score, i) FOR ONE NORMALISED QUERY, SCORING TITLES ONE PAIR AT A TIME
+    def top_k_pairwise(self, query, k):
+        if self.counts is None:
+            self.counts = np.array([char_counts(x) for x in self.normal]).reshape(-1, len(ALPHABET) + 1)
+        counts = char_counts(query)
+        total = self.counts.sum(axis=1) + counts.sum()
+        # ROUNDED UP, AS THE SCORES ARE ROUNDED
+        bounds = -(-200 * np.minimum(self.counts, counts).sum(axis=1) // np.maximum(total, 1))
+        best = []
+        for i in np.argsort(-bounds, kind='stable'):
+            if len(best) >= k and bounds[i] < best[-1][0]:
+                break
+            best.append((average_ratio(query, self.normal[i]), int(i)))
+            best.sort(key=lambda x: (-x[0], x[1]))
+            best = best[:k]
+        return best
+
+    # SCORES OF EVERY QUERY AGAINST EVERY TITLE (rapidfuzz ONLY), AS average_ratio WOULD GIVE THEM WITH IT
+    def score_matrix(self, queries):
+        scores = rapid_process.cdist(queries, self.normal, scorer=rapid_fuzz.token_sort_ratio,
+                                     processor=default_process, workers=-1)
+        scores = np.rint(scores).astype(np.int16)
+        scores[[not default_process(x) for x in queries], :] = 0
+        scores[:, [not default_process(x) for x in self.normal]] = 0
+        return scores
+
+    # THE k BEST MATCHES OF EACH QUERY SCORING AT LEAST cutoff, AS (key, title, score), BEST FIRST
+    # (TIES IN INDEX ORDER)
+    def top_k_batch(self, queries, k=5, cutoff=0):
+        queries = [extra_clean(x) for x in queries]
+        matches = []
+        if USE_RAPIDFUZZ and len(self.normal) > 0:
+            for row in self.score_matrix(queries):
+                best = np.argsort(-row, kind='stable')[:k]
+                matches.append([(self.keys[i], self.titles[i], int(row[i])) for i in best if row[i] >= cutoff])
+            return matches
+        for query in queries:
+            best = self.top_k_pairwise(query, k)
+            matches.append([(self.keys[i], self.titles[i], score) for score, i in best if score >= cutoff])
+        return matches
+
+    def top_k(self, query, k=5, cutoff=0):
+        return self.top_k_batch([query], k, cutoff)[0]